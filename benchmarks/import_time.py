@@ -0,0 +1,81 @@
+"""
+Benchmark de tempo de importação a frio (cold start) do núcleo evm e do app.
+
+Cada alvo é medido em um processo Python novo, N vezes; o resultado é a
+mediana do tempo de parede do import (ou da execução do script do app em
+modo bare, sem servidor Streamlit) e a lista de módulos pesados carregados.
+
+Uso:
+    python benchmarks/import_time.py [--repeat 5] [--json saida.json]
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY_MODULES = ('streamlit', 'streamlit_drawable_canvas', 'pandas', 'matplotlib', 'scipy', 'cv2')
+
+# Alvo -> código executado no processo novo
+TARGETS = {
+    'evm': "import evm",
+    'evm.filters (apply_bandpass_filter)': "from evm.filters import apply_bandpass_filter",
+    'evm.pipeline': "import evm.pipeline",
+    'evm.batch': "import evm.batch",
+    'streamlit_app (bare)': "import runpy; runpy.run_path('streamlit_app.py', run_name='__main__')",
+}
+
+_PROBE = """
+import sys, time, json, logging, warnings
+logging.disable(logging.CRITICAL)
+warnings.simplefilter('ignore')
+t0 = time.perf_counter()
+exec(compile({code!r}, '<bench>', 'exec'))
+elapsed = time.perf_counter() - t0
+heavy = [m for m in {heavy!r} if m in sys.modules]
+print('@@BENCH@@' + json.dumps({{'elapsed': elapsed, 'heavy': heavy}}))
+"""
+
+
+def measure(code, repeat=5):
+    """Executa `code` em `repeat` processos novos e retorna a mediana em segundos e os módulos pesados carregados."""
+    samples = []
+    heavy = []
+    for _ in range(repeat):
+        result = subprocess.run(
+            [sys.executable, '-c', _PROBE.format(code=code, heavy=HEAVY_MODULES)],
+            cwd=ROOT, capture_output=True, text=True
+        )
+        line = next((l for l in result.stdout.splitlines() if l.startswith('@@BENCH@@')), None)
+        if line is None:
+            raise RuntimeError(f"Falha ao medir {code!r}:\n{result.stderr}")
+        data = json.loads(line[len('@@BENCH@@'):])
+        samples.append(data['elapsed'])
+        heavy = data['heavy']
+    return {'median_s': statistics.median(samples), 'min_s': min(samples), 'samples_s': samples, 'heavy_modules': heavy}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Tempo de importação a frio do núcleo evm e do app Streamlit.")
+    parser.add_argument('--repeat', type=int, default=5, help="Processos novos por alvo (padrão: 5)")
+    parser.add_argument('--json', help="Grava os resultados neste arquivo JSON")
+    args = parser.parse_args(argv)
+
+    results = {}
+    for name, code in TARGETS.items():
+        results[name] = measure(code, args.repeat)
+        r = results[name]
+        print(f"{name:40s} {r['median_s'] * 1000:8.1f} ms  (min {r['min_s'] * 1000:.1f} ms)  pesados: {', '.join(r['heavy_modules']) or '-'}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'python': sys.version, 'repeat': args.repeat, 'results': results}, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,270 @@
+"""
+Suíte de benchmarks do pipeline EVM sobre vídeos sintéticos determinísticos.
+
+Para cada combinação de resolução, número de frames e ordem do filtro, mede
+separadamente cada etapa (tempo de parede, tempo de CPU, pico de memória
+alocada via tracemalloc e tamanho da saída) e verifica se as regiões que
+vibram em frequências conhecidas continuam no topo do mapa RMS, para que
+otimizações não quebrem o resultado em silêncio.
+
+Uso:
+    python benchmarks/run_benchmarks.py --quick --json resultados.json
+    python benchmarks/run_benchmarks.py --resolutions 640x360 1280x720 --frames 150 300 --orders 3 5
+    python benchmarks/run_benchmarks.py --quick --baseline anterior.json
+"""
+import os
+import sys
+import gc
+import json
+import time
+import argparse
+import platform
+import tempfile
+import subprocess
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np
+import cv2
+
+from synthetic import make_synthetic_video, region_mask
+from evm.filters import apply_bandpass_filter, compute_rms_map, fft_bandpass_filter, causal_bandpass_rms
+from evm.multires import coarse_to_fine_rms
+from evm.pyramid import laplacian_evm, iter_laplacian_reconstruction
+from evm.render import select_significant_tensors
+from evm.roi import composite_rms, composite_tensor_field, parse_rois, roi_coverage, scale_rois
+from evm.stabilization import stabilize_video
+from evm.tensors import principal_tensor_vectors
+from evm.video_io import read_video, read_video_stack, write_video
+
+
+F_LOW, F_HIGH, FPS = 0.5, 3.0, 30.0
+
+# Critérios de correção
+MIN_TOP_HIT_RATE = 0.9      # fração do top 1% do RMS dentro das regiões vibrantes
+MIN_REGION_CONTRAST = 2.0   # RMS médio da região / RMS mediano fora das regiões
+BORDER_PX = 8               # borda ignorada: após a estabilização ela é preenchida pelo warp
+
+
+def _nbytes(value):
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (tuple, list)):
+        return sum(_nbytes(v) for v in value)
+    if isinstance(value, dict):
+        return sum(_nbytes(v) for v in value.values())
+    return int(getattr(value, 'nbytes', 0))
+
+
+def run_stage(results, name, func, *args, **kwargs):
+    """Executa uma etapa medindo tempo de parede, CPU, pico de memória alocada e tamanho da saída."""
+    gc.collect()
+    tracemalloc.reset_peak()
+    base = tracemalloc.get_traced_memory()[0]
+    t0, c0 = time.perf_counter(), time.process_time()
+    value = func(*args, **kwargs)
+    wall, cpu = time.perf_counter() - t0, time.process_time() - c0
+    peak = tracemalloc.get_traced_memory()[1] - base
+    results[name] = {
+        'wall_s': wall,
+        'cpu_s': cpu,
+        'peak_alloc_mb': peak / 1024 ** 2,
+        'output_mb': _nbytes(value) / 1024 ** 2,
+    }
+    return value
+
+
+def check_regions(rms_map, truth, dominant_freq=None):
+    """Verifica se as regiões vibrantes conhecidas dominam o mapa RMS (e a frequência dominante, se houver)."""
+    H, W = rms_map.shape
+    mask = region_mask(W, H, truth['regions'])
+    rms_map = np.asarray(rms_map, dtype=np.float32)
+    valid = np.zeros((H, W), dtype=bool)
+    valid[BORDER_PX:H - BORDER_PX, BORDER_PX:W - BORDER_PX] = True
+    top = valid & (rms_map >= np.percentile(rms_map[valid], 99))
+    background = float(np.median(rms_map[valid & ~mask])) + 1e-12
+    checks = {'top1pct_hit_rate': float(np.mean(mask[top])), 'regions': []}
+    passed = checks['top1pct_hit_rate'] >= MIN_TOP_HIT_RATE
+    for region in truth['regions']:
+        x0, y0, x1, y1 = region['box']
+        entry = {
+            'freq': region['freq'],
+            'contrast': float(np.mean(rms_map[y0:y1, x0:x1]) / background),
+        }
+        passed &= entry['contrast'] >= MIN_REGION_CONTRAST
+        if dominant_freq is not None:
+            # Frequência dominante ponderada pelos pixels de maior energia da região
+            inner = rms_map[y0:y1, x0:x1]
+            strong = inner >= np.percentile(inner, 90)
+            entry['dominant_freq'] = float(np.median(dominant_freq[y0:y1, x0:x1][strong]))
+            resolution = FPS / truth['frames']
+            entry['freq_error'] = abs(entry['dominant_freq'] - region['freq'])
+            passed &= entry['freq_error'] <= 1.5 * resolution
+        checks['regions'].append(entry)
+    checks['passed'] = bool(passed)
+    return checks
+
+
+def check_roi_tensors(rms_map, truth):
+    """
+    Verifica se, com ROIs, nenhum tensor selecionado (nem o pico) cai na borda
+    das ROIs, onde o mapa composto salta para zero. Uma ROI cobre a primeira
+    região vibrante com folga; a outra é um triângulo sobre o fundo.
+    """
+    H, W = rms_map.shape
+    x0, y0, x1, y1 = truth['regions'][0]['box']
+    rois = scale_rois(parse_rois([
+        [x0 - 20, y0 - 20, x1 + 20, y1 + 20],
+        [[W * 0.6, H * 0.6], [W * 0.95, H * 0.65], [W * 0.8, H * 0.95]],
+    ]), 1.0, 1.0, W, H)
+    results = [{'rms': rms_map[r['box'][1]:r['box'][3], r['box'][0]:r['box'][2]]} for r in rois]
+    field = composite_tensor_field(rois, composite_rms(rois, results, W, H))
+    idxs, crit = select_significant_tensors(field)
+    edge = roi_coverage(rois, W, H) & ~roi_coverage(rois, W, H, inset=1)
+    peak = np.unravel_index(np.argmax(field['principal_abs']), (H, W))
+    on_edge = int(np.count_nonzero(edge[tuple(idxs.T)])) if len(idxs) else 0
+    return {
+        'selected': int(len(idxs)),
+        'on_edge': on_edge,
+        'passed': bool(len(idxs) > 0 and on_edge == 0 and not edge[peak]),
+    }
+
+
+def run_case(video_dir, width, height, n_frames, order, shake_px, noise_std, workers, seed=0):
+    video_path = os.path.join(video_dir, f"synthetic_{width}x{height}_{n_frames}_s{shake_px:g}_n{noise_std:g}.avi")
+    video_path, truth = make_synthetic_video(
+        video_path, width, height, n_frames, FPS,
+        shake_px=shake_px, noise_std=noise_std, seed=seed
+    )
+    stages = {}
+
+    frames_bgr, _ = run_stage(stages, 'read_video', read_video, video_path)
+    del frames_bgr
+    frames_gray, _, fps = run_stage(stages, 'read_video_stack', read_video_stack, video_path)
+    stabilized = run_stage(stages, 'stabilize_video', stabilize_video, frames_gray, method='lk')
+    filtered = run_stage(stages, 'apply_bandpass_filter', apply_bandpass_filter,
+                         stabilized, fps, F_LOW, F_HIGH, order, workers=workers)
+    rms_map = run_stage(stages, 'compute_rms_map', compute_rms_map, filtered, gain=20)
+    del filtered
+    run_stage(stages, 'principal_tensor_vectors', principal_tensor_vectors, rms_map)
+    multires = run_stage(stages, 'coarse_to_fine_rms', coarse_to_fine_rms,
+                         stabilized, fps, F_LOW, F_HIGH, order, gain=20, workers=workers)
+    run_stage(stages, 'causal_bandpass_rms', causal_bandpass_rms, stabilized, fps, F_LOW, F_HIGH, order, gain=20)
+    fft_result = run_stage(stages, 'fft_bandpass_filter', fft_bandpass_filter,
+                           stabilized, fps, F_LOW, F_HIGH, return_filtered=False, workers=workers)
+
+    def laplacian_branch():
+        levels, lowpass = laplacian_evm(frames_gray, fps, F_LOW, F_HIGH, order, 20, workers=workers)
+        return np.stack(list(iter_laplacian_reconstruction(frames_gray, levels, lowpass)))
+
+    output_frames = run_stage(stages, 'laplacian_evm', laplacian_branch)
+    out_path = os.path.join(video_dir, 'output')
+    written = run_stage(stages, 'write_video', write_video, out_path, output_frames, fps)
+    os.remove(written)
+
+    checks = check_regions(rms_map, truth, fft_result['dominant_freq'])
+    checks['multires'] = check_regions(multires['rms'], truth)
+    checks['multires']['refined_fraction'] = multires['refined_fraction']
+    checks['roi_tensors'] = check_roi_tensors(np.asarray(rms_map, dtype=np.float32), truth)
+    checks['passed'] = checks['passed'] and checks['multires']['passed'] and checks['roi_tensors']['passed']
+    return {
+        'width': width,
+        'height': height,
+        'frames': n_frames,
+        'order': order,
+        'shake_px': shake_px,
+        'noise_std': noise_std,
+        'stages': stages,
+        'total_wall_s': sum(s['wall_s'] for s in stages.values()),
+        'checks': checks,
+    }
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    import scipy
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'git_commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'numpy': np.__version__,
+        'scipy': scipy.__version__,
+        'opencv': cv2.__version__,
+    }
+
+
+def compare(results, baseline_path):
+    """Imprime a razão de tempo (atual / base) por etapa para os casos presentes nos dois arquivos."""
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+
+    def case_key(case):
+        return (case['width'], case['height'], case['frames'], case['order'], case['shake_px'], case['noise_std'])
+
+    base_cases = {case_key(c): c for c in baseline['cases']}
+    for case in results['cases']:
+        base = base_cases.get(case_key(case))
+        if base is None:
+            continue
+        print(f"\n{case['width']}x{case['height']} T={case['frames']} ordem={case['order']} (atual / base)")
+        for name, stage in case['stages'].items():
+            if name in base['stages']:
+                ratio = stage['wall_s'] / max(base['stages'][name]['wall_s'], 1e-9)
+                print(f"  {name:26s} {stage['wall_s']:8.3f} s / {base['stages'][name]['wall_s']:8.3f} s = {ratio:5.2f}x")
+
+
+def parse_resolution(text):
+    w, h = text.lower().split('x')
+    return int(w), int(h)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks por etapa do pipeline EVM em vídeos sintéticos.")
+    parser.add_argument('--resolutions', nargs='+', default=['320x180', '640x360', '1280x720'], type=parse_resolution)
+    parser.add_argument('--frames', nargs='+', type=int, default=[150, 300])
+    parser.add_argument('--orders', nargs='+', type=int, default=[3, 5])
+    parser.add_argument('--shake', type=float, default=0.0, help="Tremor de câmera (px) dos vídeos sintéticos")
+    parser.add_argument('--noise', type=float, default=2.0, help="Ruído aditivo (níveis de cinza) dos vídeos sintéticos")
+    parser.add_argument('--workers', type=int, default=1, help="Threads nas etapas em blocos")
+    parser.add_argument('--quick', action='store_true', help="Matriz reduzida: 320x180 e 640x360, 150 frames, ordem 5")
+    parser.add_argument('--json', help="Grava os resultados neste arquivo JSON")
+    parser.add_argument('--baseline', help="JSON de uma execução anterior para comparar os tempos")
+    args = parser.parse_args(argv)
+
+    if args.quick:
+        args.resolutions, args.frames, args.orders = [(320, 180), (640, 360)], [150], [5]
+
+    tracemalloc.start()
+    results = {'environment': environment(), 'band_hz': [F_LOW, F_HIGH], 'fps': FPS, 'workers': args.workers, 'cases': []}
+    with tempfile.TemporaryDirectory(prefix='evm_bench_') as video_dir:
+        for width, height in args.resolutions:
+            for n_frames in args.frames:
+                for order in args.orders:
+                    case = run_case(video_dir, width, height, n_frames, order, args.shake, args.noise, args.workers)
+                    results['cases'].append(case)
+                    status = 'ok' if case['checks']['passed'] else 'FALHOU'
+                    print(f"{width}x{height} T={n_frames} ordem={order}: {case['total_wall_s']:.2f} s, "
+                          f"regiões {status} (top 1%: {case['checks']['top1pct_hit_rate']:.2f})")
+                    for name, stage in case['stages'].items():
+                        print(f"  {name:26s} {stage['wall_s']:8.3f} s  cpu {stage['cpu_s']:8.3f} s  "
+                              f"pico {stage['peak_alloc_mb']:8.1f} MB  saída {stage['output_mb']:8.1f} MB")
+    tracemalloc.stop()
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        compare(results, args.baseline)
+    return 0 if all(case['checks']['passed'] for case in results['cases']) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
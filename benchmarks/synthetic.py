@@ -0,0 +1,109 @@
+"""
+Gerador determinístico de vídeos sintéticos para benchmarks e validação:
+textura estática com regiões retangulares que vibram (deslocamento senoidal
+subpixel) em frequências e amplitudes conhecidas, com tremor de câmera e
+ruído opcionais. A mesma semente gera sempre o mesmo vídeo.
+"""
+import numpy as np
+import cv2
+
+
+# Regiões padrão em coordenadas relativas: (x0, y0, x1, y1, frequência Hz, amplitude px)
+DEFAULT_REGIONS = (
+    (0.15, 0.20, 0.35, 0.45, 1.5, 0.6),
+    (0.60, 0.55, 0.85, 0.85, 2.5, 0.6),
+)
+
+
+def make_texture(width, height, seed=0, scale=4.0):
+    """Textura aleatória suavizada (float32 em [0, 1]) com bordas em várias escalas."""
+    rng = np.random.default_rng(seed)
+    texture = np.zeros((height, width), dtype=np.float32)
+    for sigma in (scale, scale * 3):
+        layer = rng.random((height, width), dtype=np.float32)
+        texture += cv2.GaussianBlur(layer, (0, 0), sigma)
+    texture -= texture.min()
+    texture /= max(float(texture.max()), 1e-6)
+    return texture
+
+
+def region_boxes(width, height, regions=DEFAULT_REGIONS):
+    """Converte regiões relativas em caixas (x0, y0, x1, y1) em pixels, com frequência e amplitude."""
+    boxes = []
+    for x0, y0, x1, y1, freq, amp in regions:
+        boxes.append({
+            'box': (int(x0 * width), int(y0 * height), int(x1 * width), int(y1 * height)),
+            'freq': float(freq),
+            'amp': float(amp),
+        })
+    return boxes
+
+
+def region_mask(width, height, boxes):
+    """Máscara booleana (H, W) da união das regiões vibrantes."""
+    mask = np.zeros((height, width), dtype=bool)
+    for region in boxes:
+        x0, y0, x1, y1 = region['box']
+        mask[y0:y1, x0:x1] = True
+    return mask
+
+
+def iter_synthetic_frames(width, height, n_frames, fps=30.0, regions=DEFAULT_REGIONS,
+                          shake_px=0.0, noise_std=0.0, seed=0):
+    """
+    Gera os frames BGR uint8 do vídeo sintético.
+        Parâmetros:
+        - width, height: resolução
+        - n_frames: número de frames
+        - fps: taxa de quadros
+        - regions: regiões relativas (x0, y0, x1, y1, frequência Hz, amplitude px)
+        - shake_px: desvio padrão do tremor de câmera (translação global, px)
+        - noise_std: desvio padrão do ruído aditivo (níveis de cinza, 0-255)
+        - seed: semente (textura, tremor e ruído)
+    """
+    rng = np.random.default_rng(seed + 1)
+    texture = make_texture(width, height, seed)
+    boxes = region_boxes(width, height, regions)
+    # Tremor: passeio aleatório suavizado, sem deriva acumulada
+    shake = rng.normal(0.0, shake_px, size=(n_frames, 2)) if shake_px > 0 else np.zeros((n_frames, 2))
+    if shake_px > 0:
+        shake = cv2.GaussianBlur(shake.astype(np.float64), (1, 5), 0)
+
+    for t in range(n_frames):
+        frame = texture.copy()
+        for region in boxes:
+            x0, y0, x1, y1 = region['box']
+            d = region['amp'] * np.sin(2 * np.pi * region['freq'] * t / fps)
+            M = np.float32([[1, 0, d], [0, 1, 0.5 * d]])
+            moved = cv2.warpAffine(texture, M, (width, height), flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REFLECT)
+            frame[y0:y1, x0:x1] = moved[y0:y1, x0:x1]
+        if shake_px > 0:
+            M = np.float32([[1, 0, shake[t, 0]], [0, 1, shake[t, 1]]])
+            frame = cv2.warpAffine(frame, M, (width, height), flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REFLECT)
+        frame = frame * 255.0
+        if noise_std > 0:
+            frame += rng.normal(0.0, noise_std, size=frame.shape).astype(np.float32)
+        gray = np.clip(frame, 0, 255).astype(np.uint8)
+        yield cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR)
+
+
+def make_synthetic_video(path, width=640, height=360, n_frames=150, fps=30.0, regions=DEFAULT_REGIONS,
+                         shake_px=0.0, noise_std=0.0, seed=0):
+    """
+    Grava o vídeo sintético em `path` (MJPG/.avi por padrão, como o app).
+        Retorna:
+        - caminho gravado e verdade de referência: {'fps', 'width', 'height',
+          'frames', 'regions': [{'box', 'freq', 'amp'}, ...]}
+    """
+    from evm.video_io import write_video
+
+    frames = iter_synthetic_frames(width, height, n_frames, fps, regions, shake_px, noise_std, seed)
+    written = write_video(path, frames, fps)
+    truth = {
+        'fps': float(fps),
+        'width': int(width),
+        'height': int(height),
+        'frames': int(n_frames),
+        'regions': region_boxes(width, height, regions),
+    }
+    return written, truth
@@ -0,0 +1,133 @@
+"""
+Núcleo de processamento EVM (Eulerian Video Magnification) para análise de
+tensões residuais: leitura de vídeo, estabilização, filtragem temporal, mapa
+RMS e renderização. Não depende do Streamlit: é usado pela interface
+(streamlit_app.py) e pelo processamento em lote (python -m evm.batch).
+
+Os submódulos são carregados sob demanda no primeiro acesso a um nome
+(`import evm` não importa OpenCV, SciPy nem matplotlib); dependências
+pesadas opcionais (scipy, matplotlib) são importadas dentro das funções
+que as usam.
+"""
+import importlib
+
+
+# Nome público -> submódulo que o define
+_EXPORTS = {
+    'TILE_BYTES': 'evm.tiling',
+    'rows_per_tile': 'evm.tiling',
+    'iter_row_tiles': 'evm.tiling',
+    'resolve_workers': 'evm.tiling',
+    'run_tiles': 'evm.tiling',
+    'get_scratch_dir': 'evm.storage',
+    'FrameStore': 'evm.storage',
+    'allocate_frames': 'evm.storage',
+    'CACHE_DIR': 'evm.cache',
+    'hash_file': 'evm.cache',
+    'params_key': 'evm.cache',
+    'StageCache': 'evm.cache',
+    'principal_tensor_field': 'evm.tensors',
+    'principal_tensor_vectors': 'evm.tensors',
+    'PROXY_WIDTH': 'evm.stabilization',
+    'estimate_transforms_orb': 'evm.stabilization',
+    'estimate_transforms_lk': 'evm.stabilization',
+    'apply_transforms': 'evm.stabilization',
+    'load_cached_transforms': 'evm.stabilization',
+    'save_cached_transforms': 'evm.stabilization',
+    'stabilize_video': 'evm.stabilization',
+    'measure_residual_motion': 'evm.stabilization',
+    'VIDEO_CODECS': 'evm.video_io',
+    'open_video': 'evm.video_io',
+    'iter_video_frames': 'evm.video_io',
+    'read_video_stack': 'evm.video_io',
+    'iter_gray_frames': 'evm.video_io',
+    'read_video_crops': 'evm.video_io',
+    'read_video': 'evm.video_io',
+    'StreamingVideoWriter': 'evm.video_io',
+    'write_video': 'evm.video_io',
+    'design_bandpass_sos': 'evm.filters',
+    'apply_bandpass_filter': 'evm.filters',
+    'fft_bandpass_filter': 'evm.filters',
+    'CausalBandpassRMS': 'evm.filters',
+    'iter_frame_chunks': 'evm.filters',
+    'iter_causal_bandpass': 'evm.filters',
+    'causal_bandpass_rms': 'evm.filters',
+    'compare_bandpass_modes': 'evm.filters',
+    'decimation_factor': 'evm.filters',
+    'TemporalDecimator': 'evm.filters',
+    'iter_decimated': 'evm.filters',
+    'compute_rms_map': 'evm.filters',
+    'normalize_map': 'evm.filters',
+    'build_laplacian_pyramid_stack': 'evm.pyramid',
+    'laplacian_evm': 'evm.pyramid',
+    'iter_laplacian_reconstruction': 'evm.pyramid',
+    'gaussian_downsample_stack': 'evm.multires',
+    'hot_tile_regions': 'evm.multires',
+    'coarse_to_fine_rms': 'evm.multires',
+    'parse_rois': 'evm.roi',
+    'scale_rois': 'evm.roi',
+    'roi_area_fraction': 'evm.roi',
+    'roi_mask': 'evm.roi',
+    'process_roi': 'evm.roi',
+    'process_rois': 'evm.roi',
+    'composite_rms': 'evm.roi',
+    'roi_coverage': 'evm.roi',
+    'composite_tensor_field': 'evm.roi',
+    'iter_composite_filtered': 'evm.roi',
+    'colormap_lut': 'evm.render',
+    'apply_colormap_lut': 'evm.render',
+    'create_heatmap_overlay': 'evm.render',
+    'select_significant_tensors': 'evm.render',
+    'draw_tensor_arrows': 'evm.render',
+    'HeatmapRenderer': 'evm.render',
+    'available_memory_bytes': 'evm.planner',
+    'default_memory_budget': 'evm.planner',
+    'estimate_peak_bytes': 'evm.planner',
+    'plan_processing': 'evm.planner',
+    'describe_plan': 'evm.planner',
+    'FrameRingBuffer': 'evm.live',
+    'SlidingWindowRMS': 'evm.live',
+    'StreamingNormalizer': 'evm.live',
+    'iter_live_heatmap': 'evm.live',
+    'parse_bands': 'evm.sweep',
+    'sweep_grid': 'evm.sweep',
+    'sweep_bandpass_rms': 'evm.sweep',
+    'variant_label': 'evm.sweep',
+    'sweep_summary': 'evm.sweep',
+    'sweep_npz_bytes': 'evm.sweep',
+    'npy_bytes': 'evm.export',
+    'npz_bytes': 'evm.export',
+    'map_to_uint16': 'evm.export',
+    'map_image16_bytes': 'evm.export',
+    'TimeSeriesWriter': 'evm.export',
+    'load_time_series': 'evm.export',
+    'STAGE_DEPENDENCIES': 'evm.incremental',
+    'PARAM_STAGES': 'evm.incremental',
+    'param_stages': 'evm.incremental',
+    'downstream_stages': 'evm.incremental',
+    'changed_params': 'evm.incremental',
+    'invalidated_stages': 'evm.incremental',
+    'read_progress': 'evm.jobs',
+    'JobManager': 'evm.jobs',
+    'get_job_manager': 'evm.jobs',
+    'Profiler': 'evm.profiling',
+    'ThrottledProgress': 'evm.profiling',
+    'DEFAULT_PARAMS': 'evm.pipeline',
+    'load_params': 'evm.pipeline',
+    'process_video': 'evm.pipeline',
+}
+
+__all__ = sorted(_EXPORTS)
+
+
+def __getattr__(name):
+    module_name = _EXPORTS.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(module_name), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
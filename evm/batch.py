@@ -0,0 +1,269 @@
+"""
+Processamento em lote sem interface: aplica o pipeline EVM a um diretório (ou
+glob) de vídeos em processos paralelos e grava um manifesto com o resumo.
+
+Uso:
+    python -m evm.batch videos/ -p params.yaml -o resultados/ --jobs 4 --max-memory-mb 8000
+"""
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+import traceback
+import warnings
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from evm.pipeline import estimate_job_bytes, load_params, process_video
+
+
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov')
+
+
+def discover_videos(inputs, recursive=False):
+    """
+    Lista os vídeos a processar, sem repetições e em ordem estável.
+        Parâmetros:
+        - inputs: diretórios, arquivos ou padrões glob
+        - recursive: percorre subdiretórios (diretórios e padrões com **)
+
+        Retorna:
+        - lista de caminhos absolutos
+    """
+    found = []
+    for item in inputs:
+        if os.path.isdir(item):
+            pattern = os.path.join(item, '**', '*') if recursive else os.path.join(item, '*')
+            candidates = glob.glob(pattern, recursive=recursive)
+        elif os.path.isfile(item):
+            candidates = [item]
+        else:
+            candidates = glob.glob(item, recursive=recursive)
+        found.extend(
+            path for path in sorted(candidates)
+            if os.path.isfile(path) and os.path.splitext(path)[1].lower() in VIDEO_EXTENSIONS
+        )
+    unique = []
+    seen = set()
+    for path in map(os.path.abspath, found):
+        if path not in seen:
+            seen.add(path)
+            unique.append(path)
+    return unique
+
+
+def clip_output_dirs(videos, output_root):
+    """Um subdiretório por vídeo, com o nome do arquivo (sufixo _2, _3... em colisões)."""
+    dirs = []
+    used = set()
+    for path in videos:
+        stem = os.path.splitext(os.path.basename(path))[0]
+        name, k = stem, 1
+        while name in used:
+            k += 1
+            name = f"{stem}_{k}"
+        used.add(name)
+        dirs.append(os.path.join(output_root, name))
+    return dirs
+
+
+def run_clip(video_path, params, output_dir, threads=1, profiler=None):
+    """
+    Processa um vídeo no processo de trabalho. Erros não interrompem o lote:
+    são registrados na entrada do manifesto. O profiler (opcional) permite
+    acompanhar as etapas durante o processamento (ver evm.jobs).
+    """
+    entry = {'video': video_path, 'output_dir': output_dir}
+    t0 = time.perf_counter()
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("always")
+        try:
+            metrics = process_video(video_path, params, output_dir, workers=threads, profiler=profiler)
+            entry['status'] = 'ok'
+            entry['outputs'] = metrics['outputs']
+            entry['metrics'] = os.path.join(output_dir, 'metrics.json')
+            entry['rms'] = metrics.get('rms')
+            entry['timings'] = metrics['timings']
+        except Exception as e:
+            entry['status'] = 'error'
+            entry['error'] = f"{type(e).__name__}: {e}"
+            entry['traceback'] = traceback.format_exc()
+    if caught:
+        entry['warnings'] = [str(w.message) for w in caught]
+    entry['elapsed'] = time.perf_counter() - t0
+    return entry
+
+
+def _failed_entry(video_path, output_dir, error, elapsed=0.0):
+    """
+    Entrada de manifesto para um vídeo cujo processo de trabalho não devolveu
+    resultado (processo encerrado, falha ao submeter ou lote interrompido).
+    """
+    return {
+        'video': video_path,
+        'output_dir': output_dir,
+        'status': 'error',
+        'error': error,
+        'elapsed': elapsed,
+    }
+
+
+def run_batch(videos, params, output_root, jobs=1, threads=1, max_memory_bytes=None, log=print):
+    """
+    Processa os vídeos em até `jobs` processos. Com max_memory_bytes, um novo
+    vídeo só é iniciado quando a soma das estimativas de RAM dos vídeos em
+    andamento (estimate_job_bytes) cabe no orçamento; um vídeo que sozinho
+    excede o orçamento é processado isoladamente. Sem memory_budget_mb nos
+    parâmetros, cada vídeo planeja a resolução para a sua fração
+    (max_memory_bytes / jobs) do orçamento.
+        Parâmetros:
+        - videos: lista de caminhos
+        - params: parâmetros do pipeline (load_params)
+        - output_root: diretório raiz de saída
+        - jobs: número máximo de processos simultâneos
+        - threads: threads por processo nas etapas em blocos
+        - max_memory_bytes: orçamento total de RAM (None = sem limite)
+        - log: função de log do progresso
+
+        Retorna:
+        - manifesto (dict), também gravado em output_root/manifest.json
+    """
+    os.makedirs(output_root, exist_ok=True)
+    if max_memory_bytes is not None and params.get('memory_budget_mb') is None:
+        params = dict(params, memory_budget_mb=max_memory_bytes / max(1, jobs) / 1024 ** 2)
+    output_dirs = clip_output_dirs(videos, output_root)
+    entries = [None] * len(videos)
+    t_start = time.perf_counter()
+
+    estimates = []
+    with warnings.catch_warnings():
+        # Avisos de leitura são registrados quando o vídeo for processado
+        warnings.simplefilter("ignore")
+        for path in videos:
+            try:
+                estimates.append(estimate_job_bytes(path, params, workers=threads))
+            except Exception:
+                estimates.append(0)
+
+    # 'spawn': os processos de trabalho importam apenas o pacote evm.
+    # O manifesto é gravado mesmo se o lote for interrompido; um processo de
+    # trabalho encerrado (ex.: falta de memória) vira entrada com erro.
+    context = multiprocessing.get_context('spawn')
+    try:
+        with ProcessPoolExecutor(max_workers=max(1, jobs), mp_context=context) as pool:
+            pending = {}
+            started = {}
+            reserved = 0
+            done_count = 0
+
+            def record(i, entry):
+                nonlocal done_count
+                entry['estimated_bytes'] = estimates[i]
+                entries[i] = entry
+                done_count += 1
+                status = entry['status'] if entry['status'] == 'ok' else f"erro ({entry['error']})"
+                log(f"[{done_count}/{len(videos)}] {os.path.basename(entry['video'])}: {status} em {entry['elapsed']:.1f} s")
+
+            def collect(futures):
+                nonlocal reserved
+                for future in futures:
+                    i = pending.pop(future)
+                    reserved -= estimates[i]
+                    try:
+                        entry = future.result()
+                    except Exception as e:
+                        entry = _failed_entry(videos[i], output_dirs[i], f"{type(e).__name__}: {e}",
+                                              time.perf_counter() - started[i])
+                    record(i, entry)
+
+            for i, path in enumerate(videos):
+                while pending and (
+                    len(pending) >= jobs
+                    or (max_memory_bytes is not None and reserved + estimates[i] > max_memory_bytes)
+                ):
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(done)
+                started[i] = time.perf_counter()
+                try:
+                    future = pool.submit(run_clip, path, params, output_dirs[i], threads)
+                except Exception as e:
+                    # Pool quebrado por um processo encerrado: não aceita novas tarefas
+                    record(i, _failed_entry(path, output_dirs[i], f"{type(e).__name__}: {e}"))
+                    continue
+                pending[future] = i
+                reserved += estimates[i]
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+    finally:
+        for i, entry in enumerate(entries):
+            if entry is None:
+                entries[i] = _failed_entry(videos[i], output_dirs[i], "lote interrompido antes do término")
+        n_ok = sum(entry['status'] == 'ok' for entry in entries)
+        manifest = {
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'params': params,
+            'jobs': jobs,
+            'threads': threads,
+            'max_memory_bytes': max_memory_bytes,
+            'elapsed': time.perf_counter() - t_start,
+            'summary': {'total': len(entries), 'ok': n_ok, 'error': len(entries) - n_ok},
+            'clips': entries,
+        }
+        with open(os.path.join(output_root, 'manifest.json'), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2, ensure_ascii=False)
+    return manifest
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog='python -m evm.batch',
+        description="Processamento EVM em lote (heatmap RMS, métricas e vídeo por clipe)."
+    )
+    parser.add_argument('inputs', nargs='+', help="Diretórios, arquivos de vídeo ou padrões glob")
+    parser.add_argument('-p', '--params', help="Arquivo de parâmetros JSON ou YAML (padrões da interface se omitido)")
+    parser.add_argument('-o', '--output', default='evm_resultados', help="Diretório de saída (padrão: evm_resultados)")
+    parser.add_argument('-j', '--jobs', type=int, default=max(1, (os.cpu_count() or 1) // 2),
+                        help="Número máximo de vídeos processados simultaneamente")
+    parser.add_argument('-t', '--threads', type=int, default=1,
+                        help="Threads por processo nas etapas em blocos (padrão: 1)")
+    parser.add_argument('--max-memory-mb', type=float, default=None,
+                        help="Orçamento total de RAM dos processos simultâneos, em MB")
+    parser.add_argument('-r', '--recursive', action='store_true', help="Busca vídeos em subdiretórios")
+    parser.add_argument('--no-video', action='store_true', help="Não grava o vídeo de saída (apenas heatmap e métricas)")
+    parser.add_argument('--decimate', action='store_true',
+                        help="Decimação temporal automática na leitura (fator escolhido por f_high e decimation_margin)")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    params = load_params(args.params)
+    if args.no_video:
+        params['render_video'] = False
+    if args.decimate:
+        params['decimation'] = 'auto'
+
+    videos = discover_videos(args.inputs, recursive=args.recursive)
+    if not videos:
+        print("Nenhum vídeo encontrado.", file=sys.stderr)
+        return 2
+
+    max_memory_bytes = None if args.max_memory_mb is None else int(args.max_memory_mb * 1024 ** 2)
+    print(f"{len(videos)} vídeo(s), até {args.jobs} processo(s) simultâneo(s)")
+    manifest = run_batch(
+        videos, params, args.output,
+        jobs=args.jobs,
+        threads=args.threads,
+        max_memory_bytes=max_memory_bytes
+    )
+    summary = manifest['summary']
+    print(f"Concluído em {manifest['elapsed']:.1f} s: {summary['ok']} ok, {summary['error']} com erro. "
+          f"Manifesto: {os.path.join(args.output, 'manifest.json')}")
+    return 0 if summary['error'] == 0 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
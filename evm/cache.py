@@ -0,0 +1,149 @@
+"""Caches persistentes em disco: hashes de conteúdo e cache de etapas com LRU."""
+import os
+import hashlib
+import json
+import uuid
+import zipfile
+
+import numpy as np
+
+from evm.profiling import annotate
+from evm.storage import _remove_scratch_file
+
+
+# Diretório persistente de caches (transformações de estabilização, etc.)
+CACHE_DIR = os.environ.get("EVM_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "evm"))
+
+
+def hash_file(path, chunk_size=1024 * 1024):
+    """Hash SHA-256 do conteúdo de um arquivo, lido em blocos."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def params_key(**params):
+    """Chave curta e estável para um conjunto de parâmetros serializáveis em JSON."""
+    payload = json.dumps(params, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:32]
+
+
+class StageCache:
+    """
+    Cache de resultados de etapas do pipeline em disco, endereçado por conteúdo.
+    Cada entrada é um .npz com os arrays da etapa, identificado pela etapa e por
+    uma chave derivada do hash do vídeo e dos parâmetros relevantes (incluindo a
+    chave da etapa anterior). O diretório tem tamanho máximo e as entradas menos
+    usadas recentemente são removidas primeiro (LRU).
+    Entradas pequenas (mapas) são comprimidas; pilhas grandes são gravadas sem
+    compressão, pois o zlib custaria mais que recalcular a etapa.
+        Parâmetros:
+        - root: diretório do cache (None = CACHE_DIR/stages)
+        - max_bytes: tamanho máximo do diretório
+        - compress_limit: entradas até este tamanho são comprimidas
+        - enabled: False desativa leitura e escrita (get sempre falha)
+    """
+
+    def __init__(self, root=None, max_bytes=2 * 1024 ** 3, compress_limit=32 * 1024 ** 2, enabled=True):
+        self.root = root or os.path.join(CACHE_DIR, "stages")
+        self.max_bytes = int(max_bytes)
+        self.compress_limit = int(compress_limit)
+        self.enabled = enabled
+        self.stats = {}
+
+    def key(self, stage, **params):
+        return params_key(stage=stage, **params)
+
+    def _path(self, stage, key):
+        return os.path.join(self.root, f"{stage}_{key}.npz")
+
+    def _count(self, stage, outcome):
+        self.stats.setdefault(stage, {'hits': 0, 'misses': 0})[outcome] += 1
+
+    def get(self, stage, key):
+        """Retorna o dicionário de arrays da entrada, ou None (miss)."""
+        if not self.enabled:
+            return None
+        path = self._path(stage, key)
+        try:
+            with np.load(path) as data:
+                arrays = {name: data[name] for name in data.files}
+            # Marca a entrada como usada recentemente (ordem LRU)
+            os.utime(path)
+        except (OSError, ValueError, zipfile.BadZipFile):
+            self._count(stage, 'misses')
+            return None
+        self._count(stage, 'hits')
+        return arrays
+
+    def put(self, stage, key, arrays):
+        """Grava a entrada de forma atômica e aplica a política de remoção."""
+        if not self.enabled:
+            return
+        nbytes = sum(np.asarray(a).nbytes for a in arrays.values())
+        if nbytes > self.max_bytes:
+            return
+        path = self._path(stage, key)
+        try:
+            os.makedirs(self.root, exist_ok=True)
+            tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+            with open(tmp_path, 'wb') as f:
+                if nbytes <= self.compress_limit:
+                    np.savez_compressed(f, **arrays)
+                else:
+                    np.savez(f, **arrays)
+            os.replace(tmp_path, path)
+        except OSError:
+            return
+        self.evict()
+
+    def get_or_compute(self, stage, compute, **params):
+        """
+        Lê a etapa do cache ou executa compute() (que retorna um dicionário de
+        arrays) e grava o resultado.
+            Retorna:
+            - arrays: dicionário de arrays da etapa
+            - key: chave da entrada (para encadear nas etapas seguintes)
+        """
+        key = self.key(stage, **params)
+        arrays = self.get(stage, key)
+        annotate(**{f'cache_{stage}': 'miss' if arrays is None else 'hit'})
+        if arrays is None:
+            arrays = compute()
+            self.put(stage, key, arrays)
+        return arrays, key
+
+    def _entries(self):
+        entries = []
+        if not os.path.isdir(self.root):
+            return entries
+        for name in os.listdir(self.root):
+            if not name.endswith('.npz'):
+                continue
+            path = os.path.join(self.root, name)
+            try:
+                info = os.stat(path)
+            except OSError:
+                continue
+            entries.append((info.st_mtime, info.st_size, path))
+        return entries
+
+    def size(self):
+        """Tamanho total (bytes) das entradas no diretório."""
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self):
+        """Remove as entradas menos usadas recentemente até caber em max_bytes."""
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            _remove_scratch_file(path)
+            total -= size
+
+    def clear(self):
+        for _, _, path in self._entries():
+            _remove_scratch_file(path)
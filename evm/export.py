@@ -0,0 +1,134 @@
+"""
+Exportações binárias compactas: mapas RMS em .npy/.npz com metadados,
+imagens PNG/TIFF de 16 bits e a série temporal filtrada em blocos
+comprimidos (.npz), gravada em streaming para análise modal offline.
+"""
+import io
+import json
+import zipfile
+
+import numpy as np
+import cv2
+
+
+UINT16_MAX = 65535
+
+
+def npy_bytes(array):
+    """Array em formato .npy (bytes)."""
+    buffer = io.BytesIO()
+    np.save(buffer, np.asarray(array))
+    return buffer.getvalue()
+
+
+def npz_bytes(metadata=None, **arrays):
+    """
+    Arrays em um .npz comprimido (bytes). Os metadados (dicionário
+    serializável em JSON) ficam no array 'metadata':
+    json.loads(np.load(arquivo)['metadata'].item()).
+    """
+    buffer = io.BytesIO()
+    if metadata is not None:
+        arrays['metadata'] = np.array(json.dumps(metadata, ensure_ascii=False))
+    np.savez_compressed(buffer, **arrays)
+    return buffer.getvalue()
+
+
+def map_to_uint16(rms_map):
+    """
+    Quantiza o mapa em 16 bits linearmente de 0 ao máximo.
+        Retorna:
+        - (mapa uint16, escala), com valor = pixel * escala / 65535
+    """
+    rms_map = np.asarray(rms_map, dtype=np.float32)
+    scale = float(np.max(rms_map)) if rms_map.size else 0.0
+    if not np.isfinite(scale) or scale <= 0:
+        return np.zeros(rms_map.shape, dtype=np.uint16), 0.0
+    quantized = np.rint(np.clip(rms_map, 0, scale) * (UINT16_MAX / scale))
+    return quantized.astype(np.uint16), scale
+
+
+def map_image16_bytes(rms_map, ext='.png'):
+    """
+    Mapa bruto (sem normalização por percentis nem colormap) como imagem de
+    16 bits em tons de cinza.
+        Parâmetros:
+        - rms_map: mapa (H, W)
+        - ext: '.png' ou '.tiff'
+
+        Retorna:
+        - (bytes da imagem, escala), com valor = pixel * escala / 65535
+    """
+    quantized, scale = map_to_uint16(rms_map)
+    ok, buffer = cv2.imencode(ext, quantized)
+    if not ok:
+        raise ValueError(f"Falha ao codificar o mapa em {ext}")
+    return buffer.tobytes(), scale
+
+
+class TimeSeriesWriter:
+    """
+    Grava a série temporal filtrada (T, H, W) em um .npz, frame a frame, em
+    blocos de chunk_frames frames comprimidos ('frames_00000', 'frames_00001',
+    ...), sem acumular a série em memória. O arquivo é lido com np.load; a
+    série completa é np.concatenate dos blocos na ordem das chaves.
+        Parâmetros:
+        - path: arquivo .npz de saída
+        - chunk_frames: frames por bloco
+        - dtype: tipo gravado (float16 reduz o arquivo pela metade)
+        - metadata: dicionário serializável em JSON (fps, banda, ...)
+        - compresslevel: nível do deflate (1 = rápido)
+    """
+
+    def __init__(self, path, chunk_frames=32, dtype=np.float32, metadata=None, compresslevel=1):
+        self.path = path
+        self.chunk_frames = int(chunk_frames)
+        self.dtype = np.dtype(dtype)
+        self.metadata = dict(metadata or {})
+        self.n_frames = 0
+        self.n_chunks = 0
+        self._pending = []
+        self._zip = zipfile.ZipFile(path, mode='w', compression=zipfile.ZIP_DEFLATED, compresslevel=compresslevel)
+
+    def _write_array(self, name, array):
+        with self._zip.open(f"{name}.npy", mode='w', force_zip64=True) as f:
+            np.lib.format.write_array(f, np.ascontiguousarray(array), allow_pickle=False)
+
+    def _flush(self):
+        if self._pending:
+            self._write_array(f"frames_{self.n_chunks:05d}", np.stack(self._pending).astype(self.dtype, copy=False))
+            self.n_chunks += 1
+            self._pending = []
+
+    def write(self, frame):
+        self._pending.append(np.asarray(frame))
+        self.n_frames += 1
+        if len(self._pending) >= self.chunk_frames:
+            self._flush()
+
+    def close(self):
+        """Grava o último bloco e os metadados; retorna o caminho do arquivo."""
+        if self._zip is None:
+            return self.path
+        self._flush()
+        metadata = dict(self.metadata, frames=self.n_frames, chunk_frames=self.chunk_frames, dtype=self.dtype.name)
+        self._write_array('metadata', np.array(json.dumps(metadata, ensure_ascii=False)))
+        self._zip.close()
+        self._zip = None
+        return self.path
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+def load_time_series(path):
+    """Lê a série gravada por TimeSeriesWriter: retorna (array (T, H, W), metadados)."""
+    with np.load(path) as data:
+        names = sorted(name for name in data.files if name.startswith('frames_'))
+        frames = np.concatenate([data[name] for name in names]) if names else np.empty((0,))
+        metadata = json.loads(data['metadata'].item()) if 'metadata' in data.files else {}
+    return frames, metadata
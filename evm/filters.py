@@ -0,0 +1,490 @@
+"""Filtros temporais passa-banda (fase zero, causal em blocos e FFT) e mapa RMS."""
+import numpy as np
+import cv2
+
+from evm.storage import allocate_frames
+from evm.tiling import TILE_BYTES, iter_row_tiles, resolve_workers, rows_per_tile, run_tiles
+
+
+def design_bandpass_sos(fps, f_low, f_high, order=5):
+    """
+    Projeta o filtro passa-banda Butterworth em seções de segunda ordem (SOS).
+        Parâmetros:
+        - fps: taxa de quadros
+        - f_low: frequência baixa (Hz)
+        - f_high: frequência alta (Hz)
+        - order: ordem do filtro
+
+        Retorna:
+        - sos: array (n_seções, 6)
+    """
+    nyquist = fps / 2.0
+    
+    if f_high >= nyquist:
+        raise ValueError(f"f_high ({f_high} Hz) deve ser menor que a frequência de Nyquist ({nyquist} Hz).")
+    
+    # Normaliza frequências
+    low = f_low / nyquist
+    high = f_high / nyquist
+    
+    # Cria filtro Butterworth (scipy.signal importado sob demanda)
+    from scipy import signal
+    return signal.butter(order, [low, high], btype='band', output='sos')
+
+
+def apply_bandpass_filter(frames_gray, fps, f_low, f_high, order=5, progress_bar=None, workers=1, out=None):
+    """
+    Aplica filtro passa-banda temporal Butterworth.
+        Parâmetros:
+        - frames_gray: array (T, H, W) normalizado [0, 1], ou FrameStore
+        - fps: taxa de quadros
+        - f_low: frequência baixa (Hz)
+        - f_high: frequência alta (Hz)
+        - order: ordem do filtro
+        - progress_bar: barra de progresso do Streamlit (opcional)
+        - workers: threads concorrentes (None = todos os núcleos). O resultado é
+          idêntico bit a bit ao caminho serial.
+        - out: pilha de saída pré-alocada (pode ser a própria entrada, para
+          filtrar no lugar sem cópia adicional)
+        
+        Retorna:
+        - filtered: array filtrado (T, H, W) (FrameStore se a entrada for FrameStore)
+    """
+    from scipy import signal
+
+    sos = design_bandpass_sos(fps, f_low, f_high, order)
+    
+    T, H, W = frames_gray.shape
+    if out is None:
+        filtered = allocate_frames(frames_gray.shape, frames_gray.dtype, like=frames_gray)
+    else:
+        filtered = out
+    workers = resolve_workers(workers)
+
+    def filter_tile(y0, y1):
+        # Processa todos os pixels do bloco de uma vez (sosfiltfilt trabalha em float64)
+        pixel_signals = frames_gray[:, y0:y1, :]
+        filtered[:, y0:y1, :] = signal.sosfiltfilt(sos, pixel_signals, axis=0)
+
+    # Blocos de linhas dividem o orçamento de memória entre as threads
+    rows = rows_per_tile(frames_gray, itemsize=8, budget=TILE_BYTES // workers)
+    if workers > 1:
+        # Pelo menos ~4 blocos por thread para balancear a carga
+        rows = max(1, min(rows, -(-H // (4 * workers))))
+    run_tiles(filter_tile, list(iter_row_tiles(H, rows)), workers, progress_bar)
+    return filtered
+
+
+def fft_bandpass_filter(frames_gray, fps, f_low, f_high, return_filtered=True, gain=1.0,
+                        workers=1, progress_bar=None, out=None):
+    """
+    Filtro passa-banda ideal no domínio da frequência (rfft -> máscara -> irfft),
+    alternativa em lote a apply_bandpass_filter para clipes de duração fixa.
+    Pelo teorema de Parseval o RMS da banda sai direto do espectro, sem a
+    transformada inversa; a inversa só é calculada se return_filtered=True.
+    Na mesma passada são obtidos o mapa de frequência dominante e o de potência
+    na banda. O corte abrupto da máscara pode gerar ringing temporal no sinal
+    filtrado (não afeta o RMS).
+        Parâmetros:
+        - frames_gray: array (T, H, W) normalizado [0, 1], ou FrameStore
+        - fps: taxa de quadros
+        - f_low: frequência baixa (Hz)
+        - f_high: frequência alta (Hz)
+        - return_filtered: calcula também a pilha filtrada (T, H, W)
+        - gain: ganho aplicado ao RMS (equivalente a amplificar o sinal)
+        - workers: threads usadas pelo scipy.fft (None = todos os núcleos)
+        - progress_bar: barra de progresso do Streamlit (opcional)
+        - out: pilha de saída pré-alocada para a pilha filtrada (pode ser a
+          própria entrada, para filtrar no lugar sem cópia adicional)
+
+        Retorna dicionário com:
+        - filtered: array filtrado (T, H, W), ou None
+        - rms: mapa RMS da banda (H, W), multiplicado por gain
+        - dominant_freq: frequência (Hz) de maior potência dentro da banda (H, W)
+        - band_power: potência média (média dos quadrados) na banda (H, W)
+        - band_fraction: fração da potência AC do pixel contida na banda (H, W)
+    """
+    nyquist = fps / 2.0
+    if f_high >= nyquist:
+        raise ValueError(f"f_high ({f_high} Hz) deve ser menor que a frequência de Nyquist ({nyquist} Hz).")
+
+    from scipy import fft as sp_fft
+
+    T, H, W = frames_gray.shape
+    workers = resolve_workers(workers)
+    freqs = sp_fft.rfftfreq(T, d=1.0 / fps)
+    band = (freqs >= f_low) & (freqs <= f_high)
+    if not np.any(band):
+        raise ValueError(f"Nenhuma raia espectral em [{f_low}, {f_high}] Hz com {T} frames a {fps:.2f} FPS.")
+
+    # Pesos de Parseval para o espectro unilateral: DC e Nyquist contam uma vez
+    weights = np.full(freqs.shape, 2.0, dtype=np.float32)
+    weights[0] = 1.0
+    if T % 2 == 0:
+        weights[-1] = 1.0
+    band_idx = np.flatnonzero(band)
+    band_weights = (weights[band_idx] / T ** 2)[:, None, None]
+    ac_weights = (weights[1:] / T ** 2)[:, None, None]
+
+    filtered = None
+    if return_filtered:
+        filtered = allocate_frames(frames_gray.shape, frames_gray.dtype, like=frames_gray) if out is None else out
+    band_power = np.empty((H, W), dtype=np.float32)
+    band_fraction = np.empty((H, W), dtype=np.float32)
+    dominant_freq = np.empty((H, W), dtype=np.float32)
+
+    # Espectro complexo (T/2+1) por pixel + temporários em float32
+    rows = rows_per_tile(frames_gray, itemsize=16)
+    tiles = list(iter_row_tiles(H, rows))
+    for done, (y0, y1) in enumerate(tiles, start=1):
+        tile = np.asarray(frames_gray[:, y0:y1, :], dtype=np.float32)
+        spectrum = sp_fft.rfft(tile, axis=0, workers=workers)
+        power = spectrum.real ** 2 + spectrum.imag ** 2
+
+        in_band = power[band_idx]
+        band_power[y0:y1] = np.sum(in_band * band_weights, axis=0)
+        ac_power = np.sum(power[1:] * ac_weights, axis=0)
+        band_fraction[y0:y1] = np.divide(
+            band_power[y0:y1], ac_power,
+            out=np.zeros_like(ac_power), where=ac_power > 0
+        )
+        dominant_freq[y0:y1] = freqs[band_idx[np.argmax(in_band, axis=0)]]
+
+        if return_filtered:
+            spectrum[~band] = 0
+            filtered[:, y0:y1, :] = sp_fft.irfft(spectrum, n=T, axis=0, workers=workers)
+
+        if progress_bar is not None:
+            progress_bar.progress(done / len(tiles))
+
+    return {
+        'filtered': filtered,
+        'rms': gain * np.sqrt(band_power),
+        'dominant_freq': dominant_freq,
+        'band_power': band_power,
+        'band_fraction': band_fraction,
+    }
+
+
+class CausalBandpassRMS:
+    """
+    Filtro passa-banda causal em blocos com estado (zi) carregado entre blocos
+    e acumulação online da soma dos quadrados por pixel.
+    A memória é O(H·W·ordem), independente do número de frames.
+        Parâmetros:
+        - sos: filtro de design_bandpass_sos
+        - warmup_frames: frames iniciais descartados do RMS (transiente do filtro)
+    """
+
+    def __init__(self, sos, warmup_frames=0):
+        self.sos = sos
+        self.warmup_frames = int(warmup_frames)
+        self.zi = None
+        self.sum_sq = None
+        self.n_frames = 0
+        self.n_accumulated = 0
+
+    def update(self, chunk):
+        """
+        Filtra um bloco (t, H, W) de frames consecutivos e acumula seus quadrados.
+        Retorna o bloco filtrado (t, H, W) em float32.
+        """
+        from scipy import signal
+
+        chunk = np.asarray(chunk, dtype=np.float32)
+        if self.zi is None:
+            # Estado inicial em regime permanente para o primeiro frame (evita degrau de DC)
+            zi0 = signal.sosfilt_zi(self.sos).astype(np.float32)
+            self.zi = zi0[:, :, None, None] * chunk[0][None, None]
+            self.sum_sq = np.zeros(chunk.shape[1:], dtype=np.float64)
+
+        filtered, self.zi = signal.sosfilt(self.sos, chunk, axis=0, zi=self.zi)
+        filtered = filtered.astype(np.float32, copy=False)
+
+        skip = min(max(self.warmup_frames - self.n_frames, 0), filtered.shape[0])
+        if skip < filtered.shape[0]:
+            valid = filtered[skip:]
+            self.sum_sq += np.einsum('thw,thw->hw', valid, valid, dtype=np.float64)
+            self.n_accumulated += valid.shape[0]
+        self.n_frames += filtered.shape[0]
+        return filtered
+
+    def rms(self, gain=1.0):
+        """Mapa RMS (H, W) dos frames acumulados até agora, multiplicado por gain."""
+        if self.sum_sq is None or self.n_accumulated == 0:
+            raise ValueError("Nenhum frame acumulado após o descarte de aquecimento.")
+        return (gain * np.sqrt(self.sum_sq / self.n_accumulated)).astype(np.float32)
+
+
+def iter_frame_chunks(frames, chunk_size=32):
+    """
+    Gera blocos temporais (t, H, W) consecutivos a partir de uma pilha
+    (array ou FrameStore) ou de qualquer iterável de frames (ex.: decodificador).
+    """
+    if hasattr(frames, 'shape'):
+        for t0 in range(0, frames.shape[0], chunk_size):
+            yield frames[t0:t0 + chunk_size]
+        return
+    buffer = []
+    for frame in frames:
+        buffer.append(frame)
+        if len(buffer) == chunk_size:
+            yield np.stack(buffer)
+            buffer = []
+    if buffer:
+        yield np.stack(buffer)
+
+
+def iter_causal_bandpass(frames, fps, f_low, f_high, order=5, chunk_size=32):
+    """
+    Gera os frames filtrados (H, W) um a um pelo filtro causal em blocos,
+    sem manter a pilha filtrada em memória.
+    """
+    sos = design_bandpass_sos(fps, f_low, f_high, order)
+    engine = CausalBandpassRMS(sos)
+    for chunk in iter_frame_chunks(frames, chunk_size):
+        yield from engine.update(chunk)
+
+
+def causal_bandpass_rms(frames, fps, f_low, f_high, order=5, chunk_size=32,
+                        warmup_frames=0, gain=1.0, total_frames=None, progress_bar=None):
+    """
+    Calcula o mapa RMS passa-banda em uma única passada causal em blocos.
+    Alternativa de memória constante a apply_bandpass_filter + compute_rms_map.
+
+    Comparação com o modo de fase zero (sosfiltfilt):
+    - sosfiltfilt aplica o filtro duas vezes (ida e volta): resposta |H(f)|^2,
+      fase nula, mas exige a série temporal inteira.
+    - O modo causal aplica o filtro uma vez: resposta |H(f)|, com atraso de fase.
+      O atraso não altera o RMS de sinais estacionários; a diferença vem da
+      banda de transição mais suave (ganho |H| em vez de |H|^2 fora da banda)
+      e do transiente inicial, removido com warmup_frames.
+    - Para tons dentro da banda o RMS coincide; fora dela o modo causal atenua
+      menos. compare_bandpass_modes quantifica a diferença para um vídeo.
+
+        Parâmetros:
+        - frames: array (T, H, W), FrameStore ou iterável de frames (H, W)
+        - fps, f_low, f_high, order: como em apply_bandpass_filter
+        - chunk_size: frames por bloco
+        - warmup_frames: frames iniciais descartados do RMS
+        - gain: ganho aplicado ao RMS (equivalente a amplificar o sinal)
+        - total_frames: número de frames esperado (para a barra de progresso
+          quando frames é um iterável)
+        - progress_bar: barra de progresso do Streamlit (opcional)
+
+        Retorna:
+        - rms_map: array (H, W) float32
+    """
+    sos = design_bandpass_sos(fps, f_low, f_high, order)
+    engine = CausalBandpassRMS(sos, warmup_frames=warmup_frames)
+    if total_frames is None and hasattr(frames, 'shape'):
+        total_frames = frames.shape[0]
+    for chunk in iter_frame_chunks(frames, chunk_size):
+        engine.update(chunk)
+        if progress_bar is not None and total_frames:
+            progress_bar.progress(min(engine.n_frames / total_frames, 1.0))
+    return engine.rms(gain)
+
+
+def compare_bandpass_modes(frames, fps, f_low, f_high, order=5, warmup_frames=0):
+    """
+    Compara os mapas RMS dos modos de fase zero e causal para a mesma pilha.
+        Retorna dicionário com:
+        - rms_zero_phase, rms_causal: mapas (H, W)
+        - rel_error: erro relativo médio |causal - zero| / média(zero)
+        - correlation: correlação de Pearson entre os dois mapas
+    """
+    rms_zero = compute_rms_map(apply_bandpass_filter(frames, fps, f_low, f_high, order)).astype(np.float32)
+    rms_causal = causal_bandpass_rms(frames, fps, f_low, f_high, order, warmup_frames=warmup_frames)
+    rel_error = float(np.mean(np.abs(rms_causal - rms_zero)) / (np.mean(rms_zero) + 1e-12))
+    correlation = float(np.corrcoef(rms_zero.ravel(), rms_causal.ravel())[0, 1])
+    return {
+        'rms_zero_phase': rms_zero,
+        'rms_causal': rms_causal,
+        'rel_error': rel_error,
+        'correlation': correlation,
+    }
+
+
+DECIMATION_METHODS = ('fir', 'mean')
+
+
+def decimation_factor(fps, f_high, margin=2.0, max_factor=None):
+    """
+    Fator de decimação temporal para a banda: o maior inteiro q tal que a
+    nova frequência de Nyquist (fps / 2q) seja pelo menos margin · f_high.
+    Acima de f_high só há ruído para o filtro passa-banda, então descartá-lo
+    na leitura reduz T (e o custo de todas as etapas seguintes) por q.
+        Parâmetros:
+        - fps: taxa de quadros do vídeo
+        - f_high: maior frequência analisada (Hz)
+        - margin: folga entre f_high e a nova Nyquist (> 1; a banda de
+          transição do anti-aliasing fica nessa folga, ver TemporalDecimator)
+        - max_factor: limite superior do fator (None = sem limite)
+
+        Retorna:
+        - q >= 1 (1 = sem decimação)
+    """
+    if margin <= 1:
+        raise ValueError(f"A margem da decimação deve ser maior que 1: {margin}")
+    if f_high <= 0:
+        return 1
+    factor = max(1, int(np.floor(fps / (2.0 * margin * f_high))))
+    if max_factor is not None:
+        factor = min(factor, int(max_factor))
+    return factor
+
+
+class TemporalDecimator:
+    """
+    Decimação temporal em streaming: cada frame de entrada é somado, com o
+    peso do filtro anti-aliasing, aos frames de saída que dependem dele, e
+    um frame de saída é emitido a cada `factor` de entrada (decomposição
+    polifásica). A memória é a dos acumuladores abertos (~len(taps) / factor
+    frames), independente do número de frames do vídeo.
+    Nas bordas do vídeo os pesos disponíveis são renormalizados.
+        Parâmetros:
+        - factor: fator de decimação (>= 1)
+        - method: 'fir' (passa-baixas FIR com janela de Kaiser, centrado no
+          frame de saída: banda passante plana até nova Nyquist / margin e
+          rejeição de attenuation_db a partir da nova Nyquist) ou 'mean'
+          (média de cada bloco de `factor` frames: mais barato, mas atenua
+          a banda e rejeita menos o aliasing)
+        - margin: como em decimation_factor (> 1); a transição do FIR ocupa
+          a faixa entre f_high e a nova Nyquist, e o número de coeficientes
+          cresce quando a margem se aproxima de 1 (~12·factor com margem 2,
+          ~30·factor com 1.25)
+        - attenuation_db: rejeição mínima na banda de rejeição (dB)
+    """
+
+    def __init__(self, factor, method='fir', margin=2.0, attenuation_db=50.0):
+        if method not in DECIMATION_METHODS:
+            raise ValueError(f"method deve ser um de {DECIMATION_METHODS}: {method}")
+        self.factor = int(factor)
+        if self.factor < 1:
+            raise ValueError(f"Fator de decimação inválido: {factor}")
+        if method == 'mean' or self.factor == 1:
+            self.taps = np.full(self.factor, 1.0 / self.factor)
+            self.delay = 0
+        else:
+            from scipy import signal
+
+            if margin <= 1:
+                raise ValueError(f"A margem da decimação deve ser maior que 1: {margin}")
+            # Frequências normalizadas pela Nyquist da entrada: banda passante
+            # até a nova Nyquist / margin, rejeição a partir da nova Nyquist
+            stop_edge = 1.0 / self.factor
+            pass_edge = stop_edge / margin
+            numtaps, beta = signal.kaiserord(attenuation_db, stop_edge - pass_edge)
+            numtaps |= 1  # ímpar: atraso inteiro, centrado no frame de saída
+            self.taps = signal.firwin(numtaps, 0.5 * (pass_edge + stop_edge), window=('kaiser', beta))
+            self.delay = numtaps // 2
+        self.method = method
+        self.n_in = 0
+        self.n_out = 0
+        # Índice do frame de saída -> [soma ponderada (H, W) float32, soma dos pesos]
+        self._acc = {}
+
+    def push(self, frame):
+        """
+        Acrescenta o próximo frame (H, W) de entrada.
+        Retorna a lista (possivelmente vazia) de frames de saída concluídos,
+        em float32 na escala da entrada.
+        """
+        frame = np.asarray(frame, dtype=np.float32)
+        n, q, L = self.n_in, self.factor, len(self.taps)
+        # Saída m usa as entradas n com 0 <= n - m·q + delay < L
+        m_first = max(0, -(-(n + self.delay - L + 1) // q))
+        for m in range(m_first, (n + self.delay) // q + 1):
+            weight = float(self.taps[n - m * q + self.delay])
+            acc = self._acc.get(m)
+            if acc is None:
+                self._acc[m] = [frame * np.float32(weight), weight]
+            else:
+                # Multiplica e acumula no lugar (sem temporário do tamanho do frame)
+                cv2.scaleAdd(frame, weight, acc[0], dst=acc[0])
+                acc[1] += weight
+        self.n_in += 1
+        # A saída m está completa quando a última entrada que a afeta chegou
+        return self._emit(lambda m: m * q - self.delay + L - 1 <= n)
+
+    def flush(self):
+        """Emite as saídas pendentes no fim do vídeo (uma por bloco de entrada iniciado)."""
+        return self._emit(lambda m: m * self.factor < self.n_in, drop_rest=True)
+
+    def _emit(self, ready, drop_rest=False):
+        out = []
+        while self.n_out in self._acc and ready(self.n_out):
+            total, weight = self._acc.pop(self.n_out)
+            if weight != 1.0:
+                total /= np.float32(weight)
+            out.append(total)
+            self.n_out += 1
+        if drop_rest:
+            self._acc.clear()
+        return out
+
+
+def iter_decimated(frames, factor, method='fir', margin=2.0):
+    """
+    Gera os frames decimados (float32) de um iterável de frames (H, W),
+    em streaming. Com factor = 1 os frames passam sem alteração.
+    """
+    if factor == 1:
+        yield from frames
+        return
+    decimator = TemporalDecimator(factor, method, margin)
+    for frame in frames:
+        yield from decimator.push(frame)
+    yield from decimator.flush()
+
+
+def compute_rms_map(filtered_frames, gain=1.0):
+    """
+    Calcula mapa RMS (Root Mean Square) ao longo do tempo.
+        Parâmetros:
+        - filtered_frames: array (T, H, W), ou FrameStore
+        - gain: ganho do sinal; como RMS(gain * x) = |gain| * RMS(x), é
+          aplicado só ao mapa final, sem copiar a pilha amplificada
+
+        Retorna:
+        - rms_map: array (H, W) float32
+    """
+    T, H, W = filtered_frames.shape
+    rms_map = np.empty((H, W), dtype=np.float32)
+    # Soma dos quadrados por blocos de linhas, direto da pilha (sem cópias do bloco)
+    rows = rows_per_tile(filtered_frames, itemsize=4)
+    for y0, y1 in iter_row_tiles(H, rows):
+        tile = np.asarray(filtered_frames[:, y0:y1, :])
+        if tile.dtype != np.float32:
+            tile = tile.astype(np.float32)
+        np.einsum('tyx,tyx->yx', tile, tile, out=rms_map[y0:y1])
+    rms_map /= max(T, 1)
+    np.sqrt(rms_map, out=rms_map)
+    rms_map *= abs(gain)
+    return rms_map
+
+
+def normalize_map(rms_map, p_low=5, p_high=95, mask=None):
+    """
+    Normaliza mapa por percentis.
+    Com mask (ex.: cobertura das ROIs), os percentis usam apenas os pixels
+    da máscara, sem o zero de fora das ROIs.
+    Retorna array normalizado [0, 1].
+    """
+    values = rms_map if mask is None or not np.any(mask) else np.asarray(rms_map)[mask]
+    p5 = np.percentile(values, p_low)
+    p95 = np.percentile(values, p_high)
+    denom = p95 - p5
+    # Se p5 == p95 ou denom ~ 0, normaliza pelo valor máximo
+    if np.isclose(denom, 0) or not np.isfinite(denom):
+        max_val = np.max(rms_map)
+        if max_val > 0:
+            normalized = rms_map / max_val
+        else:
+            normalized = np.zeros_like(rms_map)
+    else:
+        normalized = (rms_map - p5) / denom
+        normalized = np.clip(normalized, 0, 1)
+        normalized = np.nan_to_num(normalized, nan=0.0, posinf=1.0, neginf=0.0)
+    return normalized
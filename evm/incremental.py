@@ -0,0 +1,111 @@
+"""
+Reprocessamento incremental: grafo de dependências entre as etapas do
+pipeline e o mapeamento de cada parâmetro para a etapa que ele afeta. Após
+uma mudança de parâmetros, só as etapas a jusante da mais afetada precisam
+ser recalculadas.
+"""
+
+# Etapa -> etapas das quais depende diretamente
+STAGE_DEPENDENCIES = {
+    'decode': (),
+    'stabilize': ('decode',),
+    'filter': ('stabilize',),
+    'rms': ('filter',),
+    'tensors': ('rms',),
+    'normalize': ('tensors',),
+    'display': ('tensors',),
+    'video': ('filter', 'tensors', 'display'),
+}
+
+# Etapas em ordem topológica
+STAGES = ('decode', 'stabilize', 'filter', 'rms', 'tensors', 'normalize', 'display', 'video')
+
+# Nomes das etapas na interface
+STAGE_LABELS = {
+    'decode': 'leitura',
+    'stabilize': 'estabilização',
+    'filter': 'filtro',
+    'rms': 'escala do RMS',
+    'tensors': 'tensores',
+    'normalize': 'normalização',
+    'display': 'exibição',
+    'video': 'vídeo de saída',
+}
+
+# Etapas baratas, refeitas a partir dos mapas guardados (sem a pilha de frames)
+INCREMENTAL_STAGES = ('rms', 'tensors', 'normalize', 'display')
+
+# Parâmetro -> etapa que o usa diretamente
+PARAM_STAGES = {
+    'video': 'decode',
+    'max_frames': 'decode',
+    'decimation': 'decode',
+    'decimation_margin': 'decode',
+    'decimation_method': 'decode',
+    'target_size': 'decode',
+    'memory_budget_mb': 'decode',
+    'on_disk': 'decode',
+    'rois': 'decode',
+    'stabilize': 'stabilize',
+    'stabilization_method': 'stabilize',
+    'f_low': 'filter',
+    'f_high': 'filter',
+    'filter_order': 'filter',
+    'filter_mode': 'filter',
+    'warmup_frames': 'filter',
+    'multiresolution': 'filter',
+    'coarse_levels': 'filter',
+    'refine_percentile': 'filter',
+    'sweep_bands': 'filter',
+    'sweep_orders': 'filter',
+    'output_mode': 'filter',
+    # O RMS da banda é linear no ganho: RMS(alpha·x) = |alpha|·RMS(x)
+    'alpha': 'rms',
+    'visual_gain': 'tensors',
+    'colormap': 'display',
+    'overlay_alpha': 'display',
+    # Percentis só entram no PNG normalizado, não no overlay do vídeo
+    'p_low': 'normalize',
+    'p_high': 'normalize',
+    'export_filtered': 'video',
+}
+
+
+def param_stages(output_mode='heatmap', decimation=False):
+    """
+    Mapeamento parâmetro -> etapa para o tipo de resultado. No EVM Laplaciano
+    o ganho amplifica os níveis filtrados da pirâmide, então alpha afeta o
+    filtro e não só a escala do RMS. Com decimação automática, o fator vem da
+    maior f_high (banda e varredura), que passa a afetar a leitura.
+    """
+    stages = dict(PARAM_STAGES)
+    if output_mode == 'laplacian':
+        stages['alpha'] = 'filter'
+    if decimation:
+        stages.update(f_high='decode', sweep_bands='decode')
+    return stages
+
+
+def downstream_stages(stages):
+    """Etapas dadas mais todas as que dependem delas, em ordem topológica."""
+    invalid = set(stages)
+    for stage in STAGES:
+        if any(dep in invalid for dep in STAGE_DEPENDENCIES[stage]):
+            invalid.add(stage)
+    return [stage for stage in STAGES if stage in invalid]
+
+
+def changed_params(previous, current):
+    """Nomes dos parâmetros com valor diferente (ou ausentes em um dos lados)."""
+    return sorted(name for name in set(previous) | set(current) if previous.get(name) != current.get(name))
+
+
+def invalidated_stages(previous, current, output_mode='heatmap'):
+    """
+    Etapas a recalcular quando os parâmetros mudam de `previous` para `current`.
+    Parâmetros fora do mapeamento invalidam tudo (por segurança).
+        Retorna:
+        - lista de etapas invalidadas, em ordem topológica (vazia = nada mudou)
+    """
+    stages = param_stages(output_mode, decimation=bool(previous.get('decimation') or current.get('decimation')))
+    return downstream_stages({stages.get(name, STAGES[0]) for name in changed_params(previous, current)})
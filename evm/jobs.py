@@ -0,0 +1,380 @@
+"""
+Fila local de jobs: executa o pipeline em processos de trabalho, fora da
+thread do script do Streamlit, com limite global de jobs simultâneos e de
+memória, fila por prioridade (FIFO dentro da mesma prioridade), progresso
+por etapa e cancelamento. Cada job tem um diretório próprio:
+
+    <raiz>/<job_id>/job.json        estado do job (fila, execução, término)
+    <raiz>/<job_id>/progress.jsonl  início/fim de cada etapa do pipeline
+    <raiz>/<job_id>/result.json     entrada de resultado (run_clip)
+    <raiz>/<job_id>/output/         heatmap, métricas, vídeo...
+    <raiz>/<job_id>/scratch/        pilhas em disco (memmap) do processo de trabalho
+
+Não depende de serviços externos: só processos locais e arquivos.
+"""
+import os
+import json
+import time
+import uuid
+import heapq
+import shutil
+import itertools
+import threading
+import warnings
+import multiprocessing
+
+from evm.cache import CACHE_DIR
+from evm.planner import default_memory_budget
+
+
+# Estados finais de um job
+FINISHED_STATUSES = ('done', 'error', 'cancelled', 'interrupted')
+
+
+def _write_json(path, data):
+    """Grava JSON de forma atômica (arquivo temporário + os.replace)."""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2, ensure_ascii=False, default=str)
+    os.replace(tmp_path, path)
+
+
+def _read_json(path):
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def read_progress(job_dir):
+    """
+    Lê o progresso gravado pelo processo de trabalho.
+        Retorna:
+        - (etapas concluídas [{'stage', 'wall'}], etapa em andamento ou None)
+    """
+    done = []
+    current = None
+    try:
+        with open(os.path.join(job_dir, 'progress.jsonl'), encoding='utf-8') as f:
+            lines = f.readlines()
+    except OSError:
+        return done, current
+    for line in lines:
+        try:
+            event = json.loads(line)
+        except ValueError:
+            # Última linha ainda sendo gravada
+            continue
+        if event['event'] == 'start':
+            current = event['stage']
+        else:
+            done.append({'stage': event['stage'], 'wall': event['wall']})
+            if current == event['stage']:
+                current = None
+    return done, current
+
+
+def _job_main(job_dir, video_path, params, threads):
+    """Processo de trabalho: executa o pipeline e grava o resultado do job."""
+    # Diretório de trabalho próprio: terminate() (SIGTERM) pula o atexit e os
+    # finalizadores que apagariam as pilhas em disco; o agendador o remove
+    os.environ["EVM_SCRATCH_DIR"] = os.path.join(job_dir, 'scratch')
+    from evm.batch import run_clip
+    from evm.profiling import Profiler
+
+    progress_file = open(os.path.join(job_dir, 'progress.jsonl'), 'a', encoding='utf-8')
+
+    def listener(event, span):
+        # Só as etapas de primeiro nível: subetapas em blocos seriam ruído na fila
+        if span.depth != 0:
+            return
+        record = {'event': event, 'stage': span.name, 'time': time.time()}
+        if event == 'end':
+            record['wall'] = span.wall
+        progress_file.write(json.dumps(record, ensure_ascii=False) + '\n')
+        progress_file.flush()
+
+    try:
+        entry = run_clip(
+            video_path, params, os.path.join(job_dir, 'output'),
+            threads=threads, profiler=Profiler(listener=listener)
+        )
+    finally:
+        progress_file.close()
+    _write_json(os.path.join(job_dir, 'result.json'), entry)
+
+
+class JobManager:
+    """
+    Agenda jobs do pipeline em processos de trabalho ('spawn').
+    Um novo job só é iniciado quando há vaga (max_concurrent) e a soma das
+    estimativas de RAM dos jobs em execução (estimate_job_bytes) mais a dele
+    cabe em max_memory_bytes; um job que sozinho excede o limite roda
+    isoladamente. O primeiro da fila bloqueia os seguintes, para que jobs
+    pequenos não passem indefinidamente à frente de um grande.
+        Parâmetros:
+        - root: diretório dos jobs (None = EVM_JOBS_DIR ou CACHE_DIR/jobs)
+        - max_concurrent: jobs simultâneos (None = EVM_MAX_JOBS ou 1)
+        - max_memory_bytes: limite global de RAM (None = EVM_JOBS_MAX_MEMORY_MB
+          ou default_memory_budget())
+        - threads: threads por job nas etapas em blocos
+        - poll_interval: intervalo (s) com que o agendador verifica os processos
+    """
+
+    def __init__(self, root=None, max_concurrent=None, max_memory_bytes=None, threads=1, poll_interval=0.5):
+        self.root = root or os.environ.get("EVM_JOBS_DIR") or os.path.join(CACHE_DIR, "jobs")
+        if max_concurrent is None:
+            max_concurrent = int(os.environ.get("EVM_MAX_JOBS", 1))
+        if max_memory_bytes is None:
+            env_mb = os.environ.get("EVM_JOBS_MAX_MEMORY_MB")
+            max_memory_bytes = int(float(env_mb) * 1024 ** 2) if env_mb else default_memory_budget()
+        self.max_concurrent = max(1, int(max_concurrent))
+        self.max_memory_bytes = int(max_memory_bytes)
+        self.threads = threads
+        self.poll_interval = poll_interval
+        os.makedirs(self.root, exist_ok=True)
+
+        self._context = multiprocessing.get_context('spawn')
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._queue = []
+        self._seq = itertools.count()
+        self._jobs = {}
+        self._running = {}
+        self._closed = False
+        self._recover()
+        self._thread = threading.Thread(target=self._scheduler, name='evm-jobs', daemon=True)
+        self._thread.start()
+
+    # Estado em disco
+
+    def _job_dir(self, job_id):
+        return os.path.join(self.root, job_id)
+
+    def _save(self, job):
+        _write_json(os.path.join(self._job_dir(job['id']), 'job.json'), job)
+
+    def _recover(self):
+        """Carrega jobs anteriores; os que estavam na fila ou rodando foram interrompidos."""
+        for name in sorted(os.listdir(self.root)):
+            job = _read_json(os.path.join(self.root, name, 'job.json'))
+            if job is None:
+                continue
+            if job['status'] not in FINISHED_STATUSES:
+                job.update(status='interrupted', finished=time.time(), error="Servidor encerrado durante o job")
+                self._save(job)
+                shutil.rmtree(os.path.join(self.root, name, 'scratch'), ignore_errors=True)
+            self._jobs[job['id']] = job
+
+    # API
+
+    def submit(self, video_path, params, priority=0, owner=None, label=None, copy_video=False, threads=None):
+        """
+        Enfileira o processamento de um vídeo.
+            Parâmetros:
+            - video_path: caminho do vídeo
+            - params: parâmetros do pipeline (load_params)
+            - priority: jobs de prioridade maior saem da fila antes
+            - owner: identificador de quem enviou (ex.: sessão do Streamlit)
+            - label: nome exibido (padrão: nome do arquivo)
+            - copy_video: copia o vídeo para o diretório do job (arquivos
+              temporários podem ser removidos antes de o job começar)
+            - threads: threads do job nas etapas em blocos (None = self.threads)
+
+            Retorna:
+            - id do job
+        """
+        from evm.pipeline import estimate_job_bytes
+
+        threads = self.threads if threads is None else int(threads)
+        job_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        label = label or os.path.basename(video_path)
+        job_dir = self._job_dir(job_id)
+        os.makedirs(os.path.join(job_dir, 'output'))
+        if copy_video:
+            copied = os.path.join(job_dir, 'input' + os.path.splitext(video_path)[1])
+            shutil.copyfile(video_path, copied)
+            video_path = copied
+
+        # Cada job planeja a resolução para a sua fração do limite global
+        share = self.max_memory_bytes / self.max_concurrent / 1024 ** 2
+        params = dict(params, memory_budget_mb=min(params.get('memory_budget_mb') or share, share))
+        with warnings.catch_warnings():
+            # Avisos de leitura são registrados quando o job for processado
+            warnings.simplefilter("ignore")
+            try:
+                estimated_bytes = int(estimate_job_bytes(video_path, params, workers=threads))
+            except Exception:
+                estimated_bytes = 0
+
+        job = {
+            'id': job_id,
+            'label': label,
+            'owner': owner,
+            'video': video_path,
+            'params': params,
+            'priority': priority,
+            'threads': threads,
+            'estimated_bytes': estimated_bytes,
+            'status': 'queued',
+            'created': time.time(),
+            'started': None,
+            'finished': None,
+            'pid': None,
+            'error': None,
+        }
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("A fila de jobs foi encerrada.")
+            self._save(job)
+            self._jobs[job_id] = job
+            heapq.heappush(self._queue, (-priority, next(self._seq), job_id))
+        self._wake.set()
+        return job_id
+
+    def cancel(self, job_id):
+        """
+        Cancela um job: sai da fila, ou o processo de trabalho é terminado.
+            Retorna:
+            - True se o job estava na fila ou em execução
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job['status'] in FINISHED_STATUSES:
+                return False
+            if job['status'] == 'queued':
+                self._queue = [item for item in self._queue if item[2] != job_id]
+                heapq.heapify(self._queue)
+                job.update(status='cancelled', finished=time.time())
+                self._save(job)
+            else:
+                job['cancel_requested'] = True
+                self._save(job)
+                self._running[job_id].terminate()
+        self._wake.set()
+        return True
+
+    def status(self, job_id):
+        """
+        Estado do job com o progresso: 'stages_done' (etapas concluídas e
+        tempos), 'stage' (etapa em andamento), 'queue_position' (na fila)
+        e 'result' (entrada de run_clip, quando terminado).
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            job = dict(job)
+            if job['status'] == 'queued':
+                order = [item[2] for item in sorted(self._queue)]
+                job['queue_position'] = order.index(job_id) + 1
+        job_dir = self._job_dir(job_id)
+        job['output_dir'] = os.path.join(job_dir, 'output')
+        job['stages_done'], job['stage'] = read_progress(job_dir)
+        if job['status'] in FINISHED_STATUSES:
+            job['result'] = _read_json(os.path.join(job_dir, 'result.json'))
+        return job
+
+    def list_jobs(self, owner=None):
+        """Estados dos jobs (de um owner, se dado), do mais recente ao mais antigo."""
+        with self._lock:
+            ids = [job['id'] for job in self._jobs.values() if owner is None or job['owner'] == owner]
+        jobs = [self.status(job_id) for job_id in ids]
+        return sorted((job for job in jobs if job is not None), key=lambda job: job['created'], reverse=True)
+
+    def remove(self, job_id):
+        """Apaga o diretório de um job terminado. Retorna False se ainda não terminou."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job['status'] not in FINISHED_STATUSES:
+                return False
+            del self._jobs[job_id]
+        shutil.rmtree(self._job_dir(job_id), ignore_errors=True)
+        return True
+
+    def shutdown(self, cancel=True):
+        """Encerra o agendador; com cancel, termina os jobs em execução."""
+        with self._lock:
+            self._closed = True
+            if cancel:
+                for job_id, process in self._running.items():
+                    self._jobs[job_id]['cancel_requested'] = True
+                    process.terminate()
+        self._wake.set()
+        self._thread.join()
+
+    # Agendador
+
+    def _scheduler(self):
+        while True:
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+            with self._lock:
+                self._reap()
+                if self._closed:
+                    if not self._running:
+                        return
+                    continue
+                self._start_ready()
+
+    def _reap(self):
+        """Registra o término dos processos que saíram."""
+        for job_id, process in list(self._running.items()):
+            if process.is_alive():
+                continue
+            process.join()
+            del self._running[job_id]
+            job = self._jobs[job_id]
+            result = _read_json(os.path.join(self._job_dir(job_id), 'result.json'))
+            if job.pop('cancel_requested', False):
+                job['status'] = 'cancelled'
+            elif result is None:
+                job.update(status='error', error=f"Processo de trabalho encerrado (código {process.exitcode})")
+            elif result['status'] == 'ok':
+                job['status'] = 'done'
+            else:
+                job.update(status='error', error=result.get('error'))
+            job['finished'] = time.time()
+            self._save(job)
+            # Pilhas em disco deixadas por um processo terminado ou com erro; um
+            # job cancelado também não guarda saídas parciais (ex.: vídeo incompleto)
+            shutil.rmtree(os.path.join(self._job_dir(job_id), 'scratch'), ignore_errors=True)
+            if job['status'] == 'cancelled':
+                shutil.rmtree(os.path.join(self._job_dir(job_id), 'output'), ignore_errors=True)
+
+    def _start_ready(self):
+        """Inicia jobs da fila enquanto houver vaga e memória."""
+        while self._queue and len(self._running) < self.max_concurrent:
+            job = self._jobs[self._queue[0][2]]
+            reserved = sum(self._jobs[job_id]['estimated_bytes'] for job_id in self._running)
+            if self._running and reserved + job['estimated_bytes'] > self.max_memory_bytes:
+                break
+            heapq.heappop(self._queue)
+            process = self._context.Process(
+                target=_job_main,
+                args=(self._job_dir(job['id']), job['video'], job['params'], job['threads']),
+                name=f"evm-job-{job['id']}",
+                daemon=True,
+            )
+            process.start()
+            self._running[job['id']] = process
+            job.update(status='running', started=time.time(), pid=process.pid)
+            self._save(job)
+
+
+_MANAGER = None
+_MANAGER_LOCK = threading.Lock()
+
+
+def get_job_manager(**kwargs):
+    """
+    Gerenciador de jobs do processo, criado no primeiro uso (compartilhado por
+    todas as sessões do Streamlit). kwargs são repassados a JobManager apenas
+    na criação.
+    """
+    global _MANAGER
+    with _MANAGER_LOCK:
+        if _MANAGER is None:
+            _MANAGER = JobManager(**kwargs)
+        return _MANAGER
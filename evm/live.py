@@ -0,0 +1,240 @@
+"""
+Modo ao vivo: frames de um cv2.VideoCapture (câmera, URL ou arquivo
+reproduzido no FPS nativo) passam por um filtro passa-banda causal e o mapa
+RMS de uma janela deslizante, guardada em um buffer circular de tamanho
+fixo, é atualizado incrementalmente na taxa de atualização pedida.
+"""
+import time
+
+import numpy as np
+import cv2
+
+from evm.filters import CausalBandpassRMS, design_bandpass_sos
+from evm.render import create_heatmap_overlay
+from evm.video_io import open_video
+
+
+class FrameRingBuffer:
+    """
+    Buffer circular de frames (capacidade, H, W) pré-alocado: ao encher, cada
+    novo frame sobrescreve o mais antigo, sem realocações.
+        Parâmetros:
+        - capacity: número máximo de frames
+        - frame_shape: (H, W)
+        - dtype: tipo dos frames
+    """
+
+    def __init__(self, capacity, frame_shape, dtype=np.float32):
+        self.capacity = int(capacity)
+        self.frames = np.zeros((self.capacity,) + tuple(frame_shape), dtype=dtype)
+        self.timestamps = np.zeros(self.capacity, dtype=np.float64)
+        self.count = 0
+        self.head = 0  # próxima posição de escrita
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def full(self):
+        return self.count == self.capacity
+
+    def oldest(self):
+        """Frame mais antigo (o próximo a ser sobrescrito quando cheio)."""
+        return self.frames[self.head if self.full else 0]
+
+    def push(self, frame, timestamp=0.0):
+        self.frames[self.head] = frame
+        self.timestamps[self.head] = timestamp
+        self.head = (self.head + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def ordered(self):
+        """Cópia (n, H, W) dos frames do mais antigo ao mais recente."""
+        if not self.full:
+            return self.frames[:self.count].copy()
+        return np.roll(self.frames, -self.head, axis=0)
+
+
+class SlidingWindowRMS:
+    """
+    RMS passa-banda em janela deslizante: o filtro causal (CausalBandpassRMS)
+    processa os blocos recebidos e os quadrados dos frames filtrados entram em
+    um FrameRingBuffer. A soma da janela é atualizada em O(H·W) por frame
+    (soma o novo, subtrai o que sai) e recalculada do buffer a cada volta
+    completa para não acumular erro de arredondamento.
+        Parâmetros:
+        - frame_shape: (H, W)
+        - fps, f_low, f_high, order: como em design_bandpass_sos
+        - window_frames: tamanho da janela (frames)
+        - warmup_frames: frames iniciais ignorados (transiente do filtro)
+    """
+
+    def __init__(self, frame_shape, fps, f_low, f_high, order=5, window_frames=120, warmup_frames=30):
+        self.engine = CausalBandpassRMS(design_bandpass_sos(fps, f_low, f_high, order))
+        self.squares = FrameRingBuffer(window_frames, frame_shape)
+        self.sum_sq = np.zeros(frame_shape, dtype=np.float64)
+        self.warmup_frames = int(warmup_frames)
+        self.n_frames = 0
+        self._pushes = 0
+
+    def update(self, chunk, timestamps=None):
+        """
+        Filtra um bloco (t, H, W) de frames consecutivos e desliza a janela.
+        Retorna o bloco filtrado (t, H, W) float32.
+        """
+        filtered = self.engine.update(chunk)
+        for i, frame in enumerate(filtered):
+            self.n_frames += 1
+            if self.n_frames <= self.warmup_frames:
+                continue
+            square = frame * frame
+            if self.squares.full:
+                self.sum_sq -= self.squares.oldest()
+            self.squares.push(square, 0.0 if timestamps is None else timestamps[i])
+            self.sum_sq += square
+            self._pushes += 1
+            if self._pushes % self.squares.capacity == 0:
+                self.sum_sq = self.squares.frames[:len(self.squares)].sum(axis=0, dtype=np.float64)
+        return filtered
+
+    @property
+    def ready(self):
+        return len(self.squares) > 0
+
+    def rms(self, gain=1.0):
+        """Mapa RMS (H, W) float32 da janela atual, multiplicado por |gain|."""
+        if not self.ready:
+            raise ValueError("Nenhum frame na janela após o descarte de aquecimento.")
+        mean_sq = np.maximum(self.sum_sq, 0.0) / len(self.squares)
+        return (abs(gain) * np.sqrt(mean_sq)).astype(np.float32)
+
+
+class StreamingNormalizer:
+    """
+    Normalização por percentis para mapas atualizados continuamente. Os
+    percentis são estimados em uma amostra regular de até max_samples pixels
+    e suavizados por média móvel exponencial, em vez de ordenar o mapa
+    inteiro a cada atualização (e sem a cintilação de limites recalculados).
+        Parâmetros:
+        - p_low, p_high: percentis mapeados para 0 e 1
+        - smoothing: peso da nova estimativa na média móvel (0, 1]
+        - max_samples: tamanho máximo da amostra
+    """
+
+    def __init__(self, p_low=5, p_high=95, smoothing=0.3, max_samples=4096):
+        self.p_low = p_low
+        self.p_high = p_high
+        self.smoothing = smoothing
+        self.max_samples = max_samples
+        self.low = None
+        self.high = None
+
+    def update(self, values):
+        flat = np.asarray(values).ravel()
+        sample = flat[::max(1, flat.size // self.max_samples)]
+        low, high = np.percentile(sample, [self.p_low, self.p_high])
+        if self.low is None:
+            self.low, self.high = float(low), float(high)
+        else:
+            self.low += self.smoothing * (float(low) - self.low)
+            self.high += self.smoothing * (float(high) - self.high)
+
+    def normalize(self, values):
+        """Mapa [0, 1] com os limites atuais (update deve ter sido chamado)."""
+        normalized = (np.asarray(values, dtype=np.float32) - self.low) / (self.high - self.low + 1e-8)
+        return np.clip(normalized, 0, 1, out=normalized)
+
+
+def iter_live_heatmap(source, f_low, f_high, order=5, window_seconds=4.0, refresh_hz=2.0,
+                      gain=1.0, p_low=5, p_high=95, colormap_name='inferno', overlay_alpha=0.5,
+                      warmup_frames=30, target_size=None, realtime=None, max_frames=None,
+                      max_seconds=None, should_stop=None):
+    """
+    Gerador do modo ao vivo: lê frames da fonte, atualiza o RMS da janela
+    deslizante e produz um heatmap a cada 1/refresh_hz segundos de vídeo.
+        Parâmetros:
+        - source: índice da câmera (int), URL ou caminho de arquivo
+        - f_low, f_high, order: banda e ordem do filtro causal
+        - window_seconds: duração da janela deslizante
+        - refresh_hz: atualizações do heatmap por segundo de vídeo
+        - gain: ganho aplicado ao RMS
+        - p_low, p_high: percentis da normalização (StreamingNormalizer)
+        - colormap_name, overlay_alpha: como em create_heatmap_overlay
+        - warmup_frames: frames iniciais ignorados (transiente do filtro)
+        - target_size: (largura, altura) máxima; frames maiores são reduzidos
+        - realtime: reproduz arquivos no FPS nativo (None = sim para arquivos,
+          não para câmeras, que já entregam frames em tempo real)
+        - max_frames, max_seconds: limites da sessão (None = sem limite)
+        - should_stop: função sem argumentos; True encerra a sessão
+
+        Gera:
+        - dicionário por atualização com 'overlay' (BGR), 'rms', 'normalized',
+          'frame_index', 'window_frames', 'fps', 'input_fps', 'latency_s'
+          (captura do frame mais recente -> heatmap atualizado),
+          'latency_max_s' (idem, frame mais antigo da atualização) e
+          'processing_s' (tempo de cálculo da atualização)
+    """
+    if realtime is None:
+        realtime = not isinstance(source, int)
+    cap, fps, _ = open_video(source)
+    if f_high >= fps / 2.0:
+        cap.release()
+        raise ValueError(f"f_high ({f_high} Hz) deve ser menor que FPS/2 ({fps / 2.0:.2f} Hz).")
+    window_frames = max(2, int(round(window_seconds * fps)))
+    frames_per_refresh = max(1, int(round(fps / refresh_hz)))
+
+    tracker = None
+    normalizer = StreamingNormalizer(p_low, p_high)
+    pending, timestamps = [], []
+    frame_bgr = None
+    n = 0
+    t_start = time.perf_counter()
+    try:
+        while max_frames is None or n < max_frames:
+            if should_stop is not None and should_stop():
+                break
+            if realtime:
+                # Arquivo como substituto de câmera: entrega cada frame no seu instante
+                delay = t_start + n / fps - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            ret, frame_bgr = cap.read()
+            t_capture = time.perf_counter()
+            if not ret or (max_seconds is not None and t_capture - t_start > max_seconds):
+                break
+            if target_size is not None and (frame_bgr.shape[1] > target_size[0] or frame_bgr.shape[0] > target_size[1]):
+                frame_bgr = cv2.resize(frame_bgr, tuple(target_size), interpolation=cv2.INTER_AREA)
+            gray = cv2.cvtColor(frame_bgr, cv2.COLOR_BGR2GRAY).astype(np.float32) / 255.0
+            if tracker is None:
+                tracker = SlidingWindowRMS(gray.shape, fps, f_low, f_high, order, window_frames, warmup_frames)
+            pending.append(gray)
+            timestamps.append(t_capture)
+            n += 1
+
+            if len(pending) < frames_per_refresh:
+                continue
+            t0 = time.perf_counter()
+            tracker.update(np.stack(pending), timestamps)
+            oldest_capture, newest_capture = timestamps[0], timestamps[-1]
+            pending, timestamps = [], []
+            if not tracker.ready:
+                continue
+            rms_map = tracker.rms(gain)
+            normalizer.update(rms_map)
+            normalized = normalizer.normalize(rms_map)
+            overlay = create_heatmap_overlay(frame_bgr, normalized, colormap_name, overlay_alpha)
+            t_done = time.perf_counter()
+            yield {
+                'overlay': overlay,
+                'rms': rms_map,
+                'normalized': normalized,
+                'frame_index': n,
+                'window_frames': len(tracker.squares),
+                'fps': fps,
+                'input_fps': n / max(t_done - t_start, 1e-9),
+                'latency_s': t_done - newest_capture,
+                'latency_max_s': t_done - oldest_capture,
+                'processing_s': t_done - t0,
+            }
+    finally:
+        cap.release()
@@ -0,0 +1,128 @@
+"""
+Análise RMS multirresolução (grosso -> fino): o mapa RMS da banda é
+calculado em um nível grosso da pirâmide Gaussiana e só as regiões quentes
+são refinadas na resolução de trabalho.
+"""
+import numpy as np
+import cv2
+
+from evm.filters import apply_bandpass_filter, compute_rms_map
+from evm.profiling import annotate, stage
+from evm.tiling import TILE_BYTES, resolve_workers, run_tiles
+
+
+def gaussian_downsample_stack(frames, levels=2, workers=1):
+    """
+    Reduz cada frame `levels` vezes com cv2.pyrDown (nível da pirâmide Gaussiana).
+        Parâmetros:
+        - frames: array (T, H, W) float32, ou FrameStore
+        - levels: número de reduções por 2
+        - workers: threads que processam blocos de frames em paralelo
+
+        Retorna:
+        - coarse: array (T, h, w) float32
+    """
+    T, H, W = frames.shape
+    h, w = H, W
+    for _ in range(levels):
+        h, w = (h + 1) // 2, (w + 1) // 2
+    coarse = np.empty((T, h, w), dtype=np.float32)
+
+    def reduce_range(t0, t1):
+        for t in range(t0, t1):
+            current = np.asarray(frames[t], dtype=np.float32)
+            for _ in range(levels):
+                current = cv2.pyrDown(current)
+            coarse[t] = current
+
+    workers = resolve_workers(workers)
+    chunk = max(1, -(-T // (4 * workers)))
+    run_tiles(reduce_range, [(t0, min(T, t0 + chunk)) for t0 in range(0, T, chunk)], workers)
+    return coarse
+
+
+def hot_tile_regions(hot_mask, tile_size, max_pixels):
+    """
+    Regiões retangulares (y0, y1, x0, x1) a refinar: blocos tile_size x tile_size
+    com algum pixel quente, com blocos vizinhos da mesma faixa unidos até
+    max_pixels pixels por região.
+    """
+    H, W = hot_mask.shape
+    regions = []
+    max_tiles = max(1, max_pixels // (tile_size * tile_size))
+    for y0 in range(0, H, tile_size):
+        y1 = min(H, y0 + tile_size)
+        band = hot_mask[y0:y1]
+        start = None
+        for x0 in range(0, W, tile_size):
+            hot = bool(band[:, x0:x0 + tile_size].any())
+            if hot and start is None:
+                start = x0
+            if start is not None and (not hot or (x0 - start) // tile_size >= max_tiles):
+                regions.append((y0, y1, start, x0))
+                start = x0 if hot else None
+        if start is not None:
+            regions.append((y0, y1, start, W))
+    return regions
+
+
+def coarse_to_fine_rms(frames_gray, fps, f_low, f_high, order=5, gain=1.0, coarse_levels=2,
+                       hot_percentile=90, dilation=2, tile_size=64, workers=1, progress_bar=None):
+    """
+    Mapa RMS passa-banda grosso -> fino. O filtro é temporal e independente por
+    pixel, então os blocos refinados são idênticos aos do processamento do
+    quadro inteiro; fora deles o mapa é o RMS grosso interpolado (média
+    espacial do sinal, sem o detalhe fino).
+        Parâmetros:
+        - frames_gray: array (T, H, W) normalizado [0, 1], ou FrameStore
+        - fps, f_low, f_high, order: como em apply_bandpass_filter
+        - gain: ganho aplicado ao RMS (como em compute_rms_map)
+        - coarse_levels: reduções por 2 do nível grosso (2 = 1/16 dos pixels)
+        - hot_percentile: percentil do RMS grosso acima do qual a região é quente
+        - dilation: dilatação da máscara quente, em pixels do nível grosso
+        - tile_size: lado (px) dos blocos refinados na resolução de trabalho
+        - workers: threads
+        - progress_bar: barra de progresso do Streamlit (opcional)
+
+        Retorna:
+        - dicionário com 'rms' (H, W) float32, 'coarse_rms' (h, w),
+          'refined_mask' (H, W) bool e 'refined_fraction' (fração refinada)
+    """
+    T, H, W = frames_gray.shape
+    workers = resolve_workers(workers)
+
+    with stage('RMS grosso', levels=coarse_levels):
+        coarse = gaussian_downsample_stack(frames_gray, coarse_levels, workers)
+        apply_bandpass_filter(coarse, fps, f_low, f_high, order, workers=workers, out=coarse)
+        coarse_rms = compute_rms_map(coarse, gain=gain)
+        del coarse
+        annotate(coarse=coarse_rms)
+
+    hot = (coarse_rms >= np.percentile(coarse_rms, hot_percentile)).astype(np.uint8)
+    if dilation > 0:
+        hot = cv2.dilate(hot, np.ones((2 * dilation + 1, 2 * dilation + 1), np.uint8))
+    hot_full = cv2.resize(hot, (W, H), interpolation=cv2.INTER_NEAREST).astype(bool)
+
+    rms_map = cv2.resize(coarse_rms, (W, H), interpolation=cv2.INTER_LINEAR)
+    refined_mask = np.zeros((H, W), dtype=bool)
+    # Cada região, em float64 no sosfiltfilt, cabe na fatia de memória da thread
+    max_pixels = TILE_BYTES // workers // max(T * 8, 1)
+    regions = hot_tile_regions(hot_full, tile_size, max_pixels)
+
+    def refine(y0, y1, x0, x1):
+        region = np.array(frames_gray[:, y0:y1, x0:x1], dtype=np.float32)
+        apply_bandpass_filter(region, fps, f_low, f_high, order, out=region)
+        rms_map[y0:y1, x0:x1] = compute_rms_map(region, gain=gain)
+        refined_mask[y0:y1, x0:x1] = True
+
+    with stage('refinamento', regions=len(regions), tile_size=tile_size):
+        run_tiles(refine, regions, workers, progress_bar)
+        refined_fraction = float(np.mean(refined_mask))
+        annotate(refined_fraction=refined_fraction)
+
+    return {
+        'rms': rms_map,
+        'coarse_rms': coarse_rms,
+        'refined_mask': refined_mask,
+        'refined_fraction': refined_fraction,
+    }
@@ -0,0 +1,513 @@
+"""
+Pipeline EVM completo para um vídeo, sem interface: leitura, estabilização,
+filtragem, mapa RMS, heatmap, métricas e vídeo de saída gravados em disco.
+"""
+import os
+import json
+import warnings
+from contextlib import nullcontext
+
+import numpy as np
+import cv2
+
+from evm.cache import hash_file
+from evm.export import TimeSeriesWriter
+from evm.filters import (
+    apply_bandpass_filter,
+    causal_bandpass_rms,
+    compute_rms_map,
+    DECIMATION_METHODS,
+    decimation_factor,
+    fft_bandpass_filter,
+    iter_causal_bandpass,
+    normalize_map,
+)
+from evm.multires import coarse_to_fine_rms
+from evm.planner import describe_plan, plan_processing
+from evm.profiling import Profiler, annotate, stage
+from evm.pyramid import iter_laplacian_reconstruction, laplacian_evm
+from evm.render import HeatmapRenderer, apply_colormap_lut
+from evm.stabilization import stabilize_video
+from evm.sweep import parse_bands, sweep_bandpass_rms, sweep_grid, sweep_npz_bytes, sweep_summary
+from evm.tensors import principal_tensor_field
+from evm.roi import (
+    composite_rms,
+    composite_tensor_field,
+    iter_composite_filtered,
+    parse_rois,
+    process_rois,
+    roi_area_fraction,
+    roi_coverage,
+    scale_rois,
+)
+from evm.video_io import StreamingVideoWriter, iter_gray_frames, open_video, read_video_crops, read_video_stack
+
+
+# Parâmetros padrão (mesmos valores iniciais da interface Streamlit)
+DEFAULT_PARAMS = {
+    'f_low': 0.5,
+    'f_high': 3.0,
+    'alpha': 20,
+    'filter_order': 5,
+    'filter_mode': 'zero_phase',        # 'zero_phase', 'causal' ou 'fft'
+    'warmup_frames': 30,                # apenas no modo causal
+    'multiresolution': False,           # RMS grosso -> fino (apenas no modo zero_phase)
+    'coarse_levels': 2,
+    'refine_percentile': 90,
+    'stabilize': True,
+    'stabilization_method': 'lk',       # 'lk' ou 'orb'
+    'max_frames': None,
+    'decimation': None,                 # decimação temporal na leitura: None/1 = não; 'auto' = por f_high; ou fator inteiro
+    'decimation_margin': 2.0,           # nova Nyquist >= margem · maior f_high analisado ('auto'); banda plana do FIR
+    'decimation_method': 'fir',         # 'fir' (anti-aliasing) ou 'mean' (média por bloco)
+    'target_size': None,                # (largura, altura) máxima; None = decidida pelo orçamento
+    'memory_budget_mb': None,           # None = fração da RAM disponível
+    'p_low': 5,
+    'p_high': 95,
+    'output_mode': 'heatmap',           # 'heatmap' ou 'laplacian'
+    'colormap': 'inferno',
+    'overlay_alpha': 0.5,
+    'visual_gain': 1.0,
+    'n_levels': 4,
+    'render_video': True,
+    'export_filtered': False,           # série filtrada em blocos (filtered_series.npz, modo heatmap)
+    'on_disk': None,                    # None = decidido pelo orçamento; True/False força
+    'rois': None,                       # [[x0, y0, x1, y1] ou [[x, y], ...], ...] em pixels do vídeo
+    'sweep_bands': None,                # varredura: "0.5-3, 3-6" ou [[f_low, f_high], ...] (sem ROIs)
+    'sweep_orders': None,               # ordens da varredura; None = [filter_order]
+}
+
+FILTER_MODES = ('zero_phase', 'causal', 'fft')
+OUTPUT_MODES = ('heatmap', 'laplacian')
+
+
+def load_params(path=None, **overrides):
+    """
+    Lê o arquivo de parâmetros (JSON ou YAML) e completa com DEFAULT_PARAMS.
+        Parâmetros:
+        - path: arquivo .json, .yaml ou .yml (None = apenas os padrões)
+        - overrides: valores que substituem os do arquivo
+
+        Retorna:
+        - dicionário de parâmetros validado
+    """
+    params = dict(DEFAULT_PARAMS)
+    if path is not None:
+        with open(path, 'r', encoding='utf-8') as f:
+            if os.path.splitext(path)[1].lower() in ('.yaml', '.yml'):
+                try:
+                    import yaml
+                except ImportError as e:
+                    raise ImportError("Arquivos YAML requerem o pacote PyYAML (pip install pyyaml).") from e
+                loaded = yaml.safe_load(f) or {}
+            else:
+                loaded = json.load(f)
+        if not isinstance(loaded, dict):
+            raise ValueError(f"Arquivo de parâmetros deve conter um objeto/mapa: {path}")
+        unknown = sorted(set(loaded) - set(DEFAULT_PARAMS))
+        if unknown:
+            raise ValueError(f"Parâmetros desconhecidos em {path}: {', '.join(unknown)}")
+        params.update(loaded)
+    params.update({k: v for k, v in overrides.items() if v is not None})
+
+    if params['filter_mode'] not in FILTER_MODES:
+        raise ValueError(f"filter_mode deve ser um de {FILTER_MODES}: {params['filter_mode']}")
+    if params['output_mode'] not in OUTPUT_MODES:
+        raise ValueError(f"output_mode deve ser um de {OUTPUT_MODES}: {params['output_mode']}")
+    if params['multiresolution'] and params['filter_mode'] != 'zero_phase':
+        raise ValueError("multiresolution requer filter_mode = zero_phase")
+    if params['decimation_method'] not in DECIMATION_METHODS:
+        raise ValueError(f"decimation_method deve ser um de {DECIMATION_METHODS}: {params['decimation_method']}")
+    decimation = params['decimation']
+    if decimation is not None and decimation != 'auto' and (isinstance(decimation, bool) or int(decimation) < 1):
+        raise ValueError(f"decimation deve ser None, 'auto' ou um inteiro >= 1: {decimation}")
+    if not params['decimation_margin'] > 1:
+        raise ValueError(f"decimation_margin deve ser maior que 1: {params['decimation_margin']}")
+    parse_rois(params['rois'])
+    _sweep_variants(params)
+    if not 0 < params['f_low'] < params['f_high']:
+        raise ValueError(f"Banda inválida: f_low={params['f_low']} Hz, f_high={params['f_high']} Hz")
+    return params
+
+
+def _sweep_variants(params):
+    """Variantes (banda x ordem) da varredura; o modo 'fft' usa uma por banda."""
+    orders = params['sweep_orders'] or [params['filter_order']]
+    if params['filter_mode'] == 'fft':
+        orders = [params['filter_order']]
+    return sweep_grid(parse_bands(params['sweep_bands']), orders)
+
+
+def video_decimation(params, fps):
+    """
+    Fator de decimação temporal da leitura para um vídeo de `fps` quadros/s.
+    Em 'auto' o fator vem da maior f_high analisada (banda principal e
+    bandas da varredura), para que todas fiquem abaixo da nova Nyquist.
+    """
+    decimation = params.get('decimation')
+    if decimation is None:
+        return 1
+    if decimation == 'auto':
+        f_high = max([params['f_high']] + [v['f_high'] for v in _sweep_variants(params)])
+        return decimation_factor(fps, f_high, params['decimation_margin'])
+    return int(decimation)
+
+
+def _check_nyquist(f_high, fps, decimation=1):
+    """Valida f_high contra a Nyquist da taxa efetiva (após a decimação)."""
+    if f_high >= fps / 2.0:
+        detail = f" após decimação por {decimation}" if decimation > 1 else ""
+        raise ValueError(f"f_high ({f_high} Hz) deve ser menor que FPS/2 ({fps / 2.0:.2f} Hz{detail}).")
+
+
+def probe_video(video_path, params):
+    """
+    Lê apenas o cabeçalho do vídeo.
+        Retorna:
+        - (T, H, W, fps) considerando max_frames, target_size e a decimação
+          temporal (T e fps efetivos), antes do planejamento de memória
+    """
+    cap, fps, frame_count = open_video(video_path)
+    try:
+        W = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        H = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    finally:
+        cap.release()
+    target_size = params.get('target_size')
+    if target_size is not None and (W > target_size[0] or H > target_size[1]):
+        W, H = int(target_size[0]), int(target_size[1])
+    T = frame_count if params.get('max_frames') is None else min(frame_count, params['max_frames'])
+    decimation = video_decimation(params, fps)
+    return -(-int(T) // decimation), H, W, fps / decimation
+
+
+def plan_video(video_path, params, workers=1):
+    """
+    Plano de memória do vídeo (ver evm.planner.plan_processing): resolução
+    de trabalho e pilhas em RAM ou em disco dentro de memory_budget_mb.
+    """
+    T, H, W, _ = probe_video(video_path, params)
+    area_fraction = 1.0
+    if params.get('rois') and params['output_mode'] == 'heatmap':
+        _, H0, W0, _ = probe_video(video_path, {'target_size': None, 'max_frames': None})
+        area_fraction = roi_area_fraction(parse_rois(params['rois']), W0, H0)
+    budget_mb = params.get('memory_budget_mb')
+    return plan_processing(
+        T, H, W,
+        budget_bytes=None if budget_mb is None else int(budget_mb * 1024 ** 2),
+        on_disk=params.get('on_disk'),
+        filter_mode=params['filter_mode'],
+        output_mode=params['output_mode'],
+        stabilize=params['stabilize'],
+        workers=workers,
+        filter_order=params['filter_order'],
+        n_levels=params['n_levels'],
+        multiresolution=params['multiresolution'],
+        area_fraction=area_fraction,
+    )
+
+
+def estimate_job_bytes(video_path, params, workers=1):
+    """
+    Estimativa do pico de RAM do processamento de um vídeo segundo o plano
+    de memória: pilhas em RAM (lida, estabilizada, filtrada ou pirâmide)
+    mais os blocos de trabalho das threads.
+    """
+    return plan_video(video_path, params, workers)['estimated_bytes']
+
+
+def _rms_stats(rms_map, p_low, p_high):
+    return {
+        'min': float(np.min(rms_map)),
+        'max': float(np.max(rms_map)),
+        'mean': float(np.mean(rms_map)),
+        'std': float(np.std(rms_map)),
+        f'p{p_low:g}': float(np.percentile(rms_map, p_low)),
+        f'p{p_high:g}': float(np.percentile(rms_map, p_high)),
+    }
+
+
+def process_video(video_path, params, output_dir, workers=1, profiler=None):
+    """
+    Executa o pipeline EVM em um vídeo e grava os resultados em output_dir:
+    heatmap_rms.png (heatmap normalizado e colorido), heatmap_rms.npy (mapa
+    RMS com ganho visual), metrics.json, profile.json (trace do Chrome com
+    as etapas) e o vídeo de saída (se render_video).
+        Parâmetros:
+        - video_path: caminho do vídeo
+        - params: dicionário de parâmetros (ver load_params)
+        - output_dir: diretório de saída do clipe (criado se necessário)
+        - workers: threads por vídeo nas etapas em blocos
+        - profiler: Profiler que registra as etapas (None = novo, sem medir memória)
+
+        Retorna:
+        - dicionário de métricas (o mesmo gravado em metrics.json)
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    if profiler is None:
+        profiler = Profiler()
+    with profiler.activate():
+        metrics = _run_pipeline(video_path, params, output_dir, workers)
+
+    metrics['timings'] = profiler.totals()
+    metrics['outputs']['profile'] = profiler.save_chrome_trace(os.path.join(output_dir, 'profile.json'))
+    with open(os.path.join(output_dir, 'metrics.json'), 'w', encoding='utf-8') as f:
+        json.dump(metrics, f, indent=2, ensure_ascii=False)
+    return metrics
+
+
+def _stabilization_key(video_hash, decimation, method, margin):
+    """
+    Chave do cache de transformações: frames decimados diferem dos originais.
+    Compartilhada com a interface, que já tem o hash do vídeo enviado.
+    """
+    if decimation == 1:
+        return video_hash
+    return f"{video_hash}_dec{decimation}{method}" + (f"{margin:g}" if method == 'fir' else "")
+
+
+def _run_pipeline(video_path, params, output_dir, workers):
+    outputs = {}
+    _, _, _, source_fps = probe_video(video_path, {'target_size': None, 'max_frames': None})
+    decimation = video_decimation(params, source_fps)
+    decimate = dict(decimation=decimation, decimation_method=params['decimation_method'],
+                    decimation_margin=params['decimation_margin'])
+    # Validação antes da leitura, já na taxa efetiva
+    f_low, f_high, order, alpha = params['f_low'], params['f_high'], params['filter_order'], params['alpha']
+    _check_nyquist(f_high, source_fps / decimation, decimation)
+    if decimation > 1 and f_high > source_fps / (2.0 * decimation * params['decimation_margin']):
+        warnings.warn(f"⚠️ f_high ({f_high} Hz) fica na transição do anti-aliasing da decimação por {decimation}: "
+                      f"o topo da banda é atenuado (use um fator menor ou 'auto').")
+    with stage('plano de memória'):
+        plan = plan_video(video_path, params, workers)
+        annotate(strategy=plan['strategy'], estimated_mb=plan['estimated_bytes'] / 1024 ** 2)
+    if not plan['fits']:
+        warnings.warn(f"⚠️ Plano de memória: {describe_plan(plan)}")
+
+    # ROIs: apenas os recortes são lidos e processados (modo heatmap)
+    use_rois = bool(params['rois']) and params['output_mode'] == 'heatmap'
+    if params['rois'] and not use_rois:
+        warnings.warn("⚠️ ROIs são usadas apenas no modo heatmap; o EVM Laplaciano processa o quadro inteiro.")
+
+    with stage('leitura'):
+        target_size = (plan['width'], plan['height'])
+        if use_rois:
+            _, H0, W0, _ = probe_video(video_path, {'target_size': None, 'max_frames': None})
+            rois = scale_rois(parse_rois(params['rois']), plan['width'] / W0, plan['height'] / H0,
+                              plan['width'], plan['height'])
+            crops, fps, (W, H) = read_video_crops(
+                video_path, [roi['box'] for roi in rois],
+                max_frames=params['max_frames'],
+                target_size=target_size,
+                on_disk=plan['on_disk'],
+                **decimate
+            )
+            T = crops[0].shape[0]
+            annotate(rois=len(rois), fps=fps, decimation=decimation)
+        else:
+            frames_gray, _, fps = read_video_stack(
+                video_path,
+                max_frames=params['max_frames'],
+                target_size=target_size,
+                on_disk=plan['on_disk'],
+                **decimate
+            )
+            annotate(frames=frames_gray, fps=fps, decimation=decimation)
+            T, H, W = frames_gray.shape
+
+    _check_nyquist(f_high, fps, decimation)
+
+    # Pilha em cinza não estabilizada, usada na renderização. O EVM Laplaciano
+    # só usa essa pilha: a estabilização fica restrita ao heatmap e à varredura
+    frames_gray_raw = None if use_rois else frames_gray
+    sweep_variants = _sweep_variants(params)
+    needs_stabilized = params['output_mode'] == 'heatmap' or bool(sweep_variants)
+    if params['stabilize'] and not use_rois and needs_stabilized:
+        with stage('estabilização', method=params['stabilization_method']):
+            frames_gray = stabilize_video(
+                frames_gray,
+                method=params['stabilization_method'],
+                video_hash=_stabilization_key(hash_file(video_path), decimation, params['decimation_method'], params['decimation_margin'])
+            )
+
+    metrics = {
+        'video': os.path.abspath(video_path),
+        'frames': int(T),
+        'width': int(W),
+        'height': int(H),
+        'fps': float(fps),
+        'source_fps': float(source_fps),
+        'decimation': int(decimation),
+        'memory_plan': plan,
+        'params': params,
+        'outputs': outputs,
+    }
+
+    # Varredura: todas as variantes a partir da mesma pilha lida e estabilizada,
+    # antes do filtro principal (que pode filtrar essa pilha no lugar)
+    if sweep_variants and not use_rois:
+        with stage('varredura', variants=len(sweep_variants)):
+            sweep_results = sweep_bandpass_rms(
+                frames_gray, fps, sweep_variants,
+                gain=alpha,
+                filter_mode=params['filter_mode'],
+                warmup_frames=params['warmup_frames'],
+                workers=workers
+            )
+        outputs['sweep_npz'] = os.path.join(output_dir, 'sweep_rms.npz')
+        with open(outputs['sweep_npz'], 'wb') as f:
+            f.write(sweep_npz_bytes(sweep_results, video=metrics['video'], fps=float(fps), filter_mode=params['filter_mode']))
+        metrics['sweep'] = sweep_summary(sweep_results, params['p_low'], params['p_high'])
+    elif sweep_variants:
+        warnings.warn("⚠️ A varredura usa o quadro inteiro e é ignorada com ROIs.")
+
+    render_video = params['render_video']
+    preview_frame = None
+
+    if params['output_mode'] == 'heatmap':
+        filtered = None
+        with stage('filtro + RMS', mode=params['filter_mode'], order=order):
+            if use_rois:
+                # Cada ROI é estabilizada, filtrada e reduzida de forma independente
+                roi_results = process_rois(
+                    crops, rois, fps, f_low, f_high,
+                    workers=workers,
+                    video_hash=_stabilization_key(hash_file(video_path), decimation, params['decimation_method'], params['decimation_margin']),
+                    order=order,
+                    gain=alpha,
+                    filter_mode=params['filter_mode'],
+                    stabilize=params['stabilize'],
+                    stabilization_method=params['stabilization_method'],
+                    warmup_frames=params['warmup_frames'],
+                    multiresolution=params['multiresolution'],
+                    keep_filtered=render_video or params['export_filtered']
+                )
+                del crops
+                rms_map = composite_rms(rois, roi_results, W, H)
+                metrics['rois'] = [list(roi['box']) for roi in rois]
+            elif params['filter_mode'] == 'causal':
+                rms_map = causal_bandpass_rms(
+                    frames_gray, fps, f_low, f_high, order,
+                    warmup_frames=params['warmup_frames'], gain=alpha
+                )
+            elif params['filter_mode'] == 'fft':
+                fft_result = fft_bandpass_filter(
+                    frames_gray, fps, f_low, f_high,
+                    return_filtered=render_video, workers=workers
+                )
+                filtered = fft_result['filtered']
+                rms_map = alpha * fft_result['rms']
+                metrics['dominant_freq_median'] = float(np.median(fft_result['dominant_freq']))
+                metrics['band_fraction_mean'] = float(np.mean(fft_result['band_fraction']))
+            elif params['multiresolution']:
+                # Sem pilha filtrada: o overlay usa o filtro causal em streaming
+                multires = coarse_to_fine_rms(
+                    frames_gray, fps, f_low, f_high, order, gain=alpha,
+                    coarse_levels=params['coarse_levels'],
+                    hot_percentile=params['refine_percentile'],
+                    workers=workers
+                )
+                rms_map = multires['rms']
+                metrics['refined_fraction'] = multires['refined_fraction']
+            else:
+                with stage('passa-banda'):
+                    # A pilha estabilizada não é mais usada: filtra no lugar
+                    in_place = plan['in_place'] and frames_gray is not frames_gray_raw
+                    filtered = apply_bandpass_filter(
+                        frames_gray, fps, f_low, f_high, order, workers=workers,
+                        out=frames_gray if in_place else None
+                    )
+                with stage('RMS'):
+                    rms_map = compute_rms_map(filtered, gain=alpha)
+            annotate(rms=rms_map)
+
+        with stage('tensores'):
+            heatmap_map = np.asarray(rms_map, dtype=np.float32) * params['visual_gain']
+            # Com ROIs, percentis, estatísticas e tensores ignoram o zero de fora das ROIs
+            coverage = roi_coverage(rois, W, H) if use_rois else None
+            heatmap_normalized = normalize_map(heatmap_map, params['p_low'], params['p_high'], mask=coverage)
+            if use_rois:
+                tensor_field = composite_tensor_field(rois, heatmap_map)
+            else:
+                tensor_field = principal_tensor_field(heatmap_map)
+        metrics['rms'] = _rms_stats(heatmap_map if coverage is None else heatmap_map[coverage],
+                                    params['p_low'], params['p_high'])
+        anisotropy = tensor_field['anisotropy']
+        metrics['anisotropy_mean'] = float(np.mean(anisotropy if coverage is None else anisotropy[tensor_field['valid']]))
+        peak = np.unravel_index(np.argmax(tensor_field['principal_abs']), tensor_field['principal_abs'].shape)
+        metrics['principal_peak'] = {
+            'x': int(peak[1]),
+            'y': int(peak[0]),
+            'value': float(tensor_field['principal'][peak]),
+            'orientation_deg': float(np.degrees(tensor_field['orientation'][peak])),
+        }
+
+        outputs['heatmap_npy'] = os.path.join(output_dir, 'heatmap_rms.npy')
+        np.save(outputs['heatmap_npy'], heatmap_map)
+        outputs['heatmap_png'] = os.path.join(output_dir, 'heatmap_rms.png')
+        cv2.imwrite(outputs['heatmap_png'], apply_colormap_lut(heatmap_normalized, params['colormap']))
+
+        if render_video or params['export_filtered']:
+            with stage('renderização', video=render_video, series=params['export_filtered']):
+                renderer = HeatmapRenderer(
+                    tensor_field,
+                    colormap_name=params['colormap'],
+                    overlay_alpha=params['overlay_alpha'],
+                    gain=alpha
+                )
+                # No modo causal os frames filtrados são regenerados em streaming;
+                # com ROIs o quadro inteiro é decodificado de novo em streaming
+                if use_rois:
+                    frames_gray_raw = iter_gray_frames(video_path, params['max_frames'], target_size, **decimate)
+                    filtered_frames = iter_composite_filtered(rois, roi_results, W, H, fps, f_low, f_high, order)
+                elif filtered is None:
+                    filtered_frames = iter_causal_bandpass(frames_gray, fps, f_low, f_high, order)
+                else:
+                    filtered_frames = iter(filtered)
+                video_writer = nullcontext()
+                if render_video:
+                    video_writer = StreamingVideoWriter(fps, (W, H), os.path.join(output_dir, 'heatmap_overlay'))
+                series_writer = nullcontext()
+                if params['export_filtered']:
+                    # Série filtrada (sem ganho) gravada na mesma passada da renderização
+                    series_writer = TimeSeriesWriter(
+                        os.path.join(output_dir, 'filtered_series.npz'),
+                        dtype=np.float16,
+                        metadata={'fps': float(fps), 'f_low': f_low, 'f_high': f_high,
+                                  'filter_mode': params['filter_mode'], 'gain_applied': False}
+                    )
+                with video_writer as writer, series_writer as series:
+                    for frame_gray, filtered_frame in zip(frames_gray_raw, filtered_frames):
+                        if series is not None:
+                            series.write(filtered_frame)
+                        if writer is not None:
+                            overlay = renderer.render(frame_gray, filtered_frame)
+                            if preview_frame is None:
+                                preview_frame = overlay
+                            writer.write(overlay)
+                if writer is not None:
+                    outputs['video'] = writer.path
+                if series is not None:
+                    outputs['filtered_series'] = series.path
+    else:
+        # Libera a pilha estabilizada da varredura antes de montar a pirâmide
+        frames_gray = frames_gray_raw
+        with stage('EVM Laplaciano', engine='fft' if params['filter_mode'] == 'fft' else 'butterworth'):
+            filtered_pyrs, lowpass_stack = laplacian_evm(
+                frames_gray_raw, fps, f_low, f_high, order, alpha,
+                n_levels=params['n_levels'],
+                engine='fft' if params['filter_mode'] == 'fft' else 'butterworth',
+                workers=workers
+            )
+        with stage('renderização'):
+            with StreamingVideoWriter(fps, (W, H), os.path.join(output_dir, 'laplacian_evm')) as writer:
+                for recon_bgr in iter_laplacian_reconstruction(frames_gray_raw, filtered_pyrs, lowpass_stack):
+                    if preview_frame is None:
+                        preview_frame = recon_bgr
+                    writer.write(recon_bgr)
+            outputs['video'] = writer.path
+
+    if preview_frame is not None:
+        outputs['preview_png'] = os.path.join(output_dir, 'preview.png')
+        cv2.imwrite(outputs['preview_png'], preview_frame)
+    return metrics
@@ -0,0 +1,209 @@
+"""
+Planejamento de memória: estima o pico de RAM do pipeline a partir de
+(T, H, W) e do modo escolhido e decide, dentro de um orçamento, entre
+resolução nativa em RAM, pilhas em disco (memmap, processadas em blocos)
+ou redução de resolução na leitura.
+"""
+import os
+import shutil
+
+import numpy as np
+
+from evm.storage import get_scratch_dir
+from evm.tiling import TILE_BYTES, resolve_workers
+
+
+# Menor largura de trabalho aceita ao reduzir a resolução
+MIN_WIDTH = 160
+# Fração da RAM disponível usada como orçamento padrão
+DEFAULT_BUDGET_FRACTION = 0.6
+
+
+def available_memory_bytes():
+    """
+    Memória física disponível (bytes), ou None se não for possível medir.
+    Usa psutil se instalado; senão /proc/meminfo (Linux) ou os.sysconf.
+    """
+    try:
+        import psutil
+        return int(psutil.virtual_memory().available)
+    except ImportError:
+        pass
+    try:
+        with open('/proc/meminfo', 'r', encoding='ascii') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        return int(os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE'))
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def default_memory_budget(fraction=DEFAULT_BUDGET_FRACTION, fallback=4 * 1024 ** 3):
+    """Orçamento padrão: fração da memória disponível (fallback se não medida)."""
+    available = available_memory_bytes()
+    if available is None:
+        return int(fallback)
+    return int(available * fraction)
+
+
+def estimate_peak_bytes(T, H, W, filter_mode='zero_phase', output_mode='heatmap', stabilize=True,
+                        on_disk=False, in_place=True, workers=1, filter_order=5, n_levels=4,
+                        multiresolution=False, area_fraction=1.0, dtype=np.float32):
+    """
+    Estima o pico de memória do pipeline para uma pilha (T, H, W).
+    O pico é o maior entre a fase de filtragem (pilha lida, estabilizada e
+    filtrada) e a fase do EVM Laplaciano (pilha lida e pirâmide). Pilhas em
+    disco (on_disk) não contam: ficam no cache de páginas, que o sistema
+    libera sob pressão. Os blocos de trabalho das threads contam sempre.
+        Parâmetros:
+        - T, H, W: dimensões de trabalho da pilha
+        - filter_mode: 'zero_phase', 'causal' ou 'fft'
+        - output_mode: 'heatmap' ou 'laplacian'
+        - stabilize: se há pilha estabilizada separada da pilha lida
+        - on_disk: pilhas em memmap
+        - in_place: o filtro de fase zero escreve sobre a pilha estabilizada
+        - workers: threads nas etapas em blocos
+        - filter_order: ordem do Butterworth (estados do modo causal)
+        - n_levels: níveis da pirâmide Laplaciana
+        - multiresolution: RMS grosso -> fino (sem pilha filtrada completa)
+        - area_fraction: fração do quadro mantida nas pilhas (recortes de ROIs)
+        - dtype: tipo das pilhas de trabalho
+
+        Retorna:
+        - dicionário com 'stack_bytes', 'resident_bytes' (pilhas em RAM),
+          'working_bytes' (blocos temporários) e 'total_bytes'
+    """
+    frame_bytes = H * W * np.dtype(dtype).itemsize
+    stack_bytes = int(T * frame_bytes * area_fraction)
+    workers = resolve_workers(workers)
+
+    # Fase de filtragem: pilhas simultâneas, em unidades de pilha
+    filter_stacks = 1.0 + float(stabilize)
+    if filter_mode == 'zero_phase' and not multiresolution:
+        filter_stacks += 0.0 if (in_place and stabilize) else 1.0
+    elif filter_mode == 'fft':
+        # Inversa só quando o overlay do heatmap usa os frames filtrados
+        filter_stacks += 1.0 if output_mode == 'heatmap' else 0.0
+    # Decodificação: quadro BGR e cinza uint8 transitórios (desprezíveis);
+    # com o cache de etapas a pilha uint8 (1/4 da float32) coexiste com a float32
+    filter_stacks = max(filter_stacks, 1.25)
+
+    # Fase Laplaciana: pilha lida + níveis (1 + 1/4 + 1/16 + ...) + residual passa-baixa
+    laplacian_stacks = 0.0
+    if output_mode == 'laplacian':
+        laplacian_stacks = 1.0 + sum(0.25 ** level for level in range(n_levels + 1))
+
+    resident_stacks = max(filter_stacks, laplacian_stacks)
+    resident_bytes = 0 if on_disk else int(resident_stacks * stack_bytes)
+
+    # Blocos de trabalho: sosfiltfilt/rfft em float64/complex64 com cópias internas
+    # (entrada estendida, ida e volta); modo causal guarda estados e um bloco de frames
+    if filter_mode == 'causal':
+        working_bytes = int((2 * 32 + 2 * filter_order + 2) * frame_bytes * area_fraction)
+    else:
+        # Um bloco nunca é maior que a pilha inteira em float64
+        working_bytes = workers * min(4 * TILE_BYTES, 8 * stack_bytes)
+    working_bytes += 3 * 3 * frame_bytes  # quadros BGR de renderização em voo
+
+    return {
+        'stack_bytes': int(stack_bytes),
+        'resident_bytes': int(resident_bytes),
+        'working_bytes': int(working_bytes),
+        'total_bytes': int(resident_bytes + working_bytes),
+    }
+
+
+def _disk_free_bytes():
+    try:
+        return shutil.disk_usage(get_scratch_dir()).free
+    except OSError:
+        return 0
+
+
+def plan_processing(T, H, W, budget_bytes=None, on_disk=None, allow_downscale=True,
+                    min_width=MIN_WIDTH, **estimate_kwargs):
+    """
+    Escolhe a estratégia de execução que cabe no orçamento de memória,
+    preferindo sempre a maior resolução possível:
+    1. 'full': resolução nativa, pilhas em RAM;
+    2. 'disk': resolução nativa, pilhas em disco processadas em blocos
+       (se permitido e houver espaço livre no diretório de trabalho);
+    3. 'downscale': maior resolução (mesma proporção, dimensões pares)
+       que cabe no orçamento.
+        Parâmetros:
+        - T, H, W: dimensões nativas (T já limitado por max_frames)
+        - budget_bytes: orçamento de memória (None = default_memory_budget())
+        - on_disk: None = decide; True = sempre em disco; False = nunca
+        - allow_downscale: permite reduzir a resolução
+        - min_width: largura mínima ao reduzir
+        - estimate_kwargs: repassados a estimate_peak_bytes (modo, workers...)
+
+        Retorna:
+        - dicionário com 'strategy', 'target_size' ((largura, altura) ou None
+          para nativa), 'width', 'height', 'on_disk', 'in_place',
+          'estimated_bytes', 'budget_bytes' e 'fits' (False se nem a menor
+          resolução cabe no orçamento)
+    """
+    if budget_bytes is None:
+        budget_bytes = default_memory_budget()
+    in_place = estimate_kwargs.pop('in_place', True)
+    T = max(int(T), 1)
+
+    def make_plan(strategy, width, height, disk):
+        estimate = estimate_peak_bytes(T, height, width, on_disk=disk, in_place=in_place, **estimate_kwargs)
+        return {
+            'strategy': strategy,
+            'target_size': None if (width, height) == (W, H) else (width, height),
+            'width': int(width),
+            'height': int(height),
+            'on_disk': bool(disk),
+            'in_place': bool(in_place),
+            'estimated_bytes': estimate['total_bytes'],
+            'budget_bytes': int(budget_bytes),
+            'fits': estimate['total_bytes'] <= budget_bytes,
+        }
+
+    if on_disk:
+        plan = make_plan('disk', W, H, True)
+    else:
+        plan = make_plan('full', W, H, False)
+        if not plan['fits'] and on_disk is None:
+            disk_plan = make_plan('disk', W, H, True)
+            stacks_bytes = estimate_peak_bytes(T, H, W, in_place=in_place, **estimate_kwargs)['resident_bytes']
+            if disk_plan['fits'] and stacks_bytes <= _disk_free_bytes():
+                plan = disk_plan
+    if plan['fits'] or not allow_downscale:
+        return plan
+
+    # As pilhas escalam com a área: parte da escala pela razão orçamento/estimativa
+    # e reduz 5% por passo até caber
+    scale = min(1.0, np.sqrt(budget_bytes / max(plan['estimated_bytes'], 1)))
+    min_scale = min(1.0, min_width / max(W, 1))
+    while True:
+        scale = max(scale, min_scale)
+        width = max(2, int(W * scale) // 2 * 2)
+        height = max(2, int(H * scale) // 2 * 2)
+        downscaled = make_plan('downscale', width, height, bool(on_disk))
+        if downscaled['fits'] or scale <= min_scale:
+            return downscaled
+        scale *= 0.95
+
+
+def describe_plan(plan):
+    """Texto curto do plano para a interface e os logs."""
+    mb = 1024 ** 2
+    size = f"{plan['width']}x{plan['height']}"
+    where = {
+        'full': f"resolução nativa {size} em RAM",
+        'disk': f"resolução nativa {size} com pilhas em disco (blocos)",
+        'downscale': f"resolução reduzida para {size}",
+    }[plan['strategy']]
+    text = (f"{where}; pico estimado {plan['estimated_bytes'] / mb:.0f} MB "
+            f"de {plan['budget_bytes'] / mb:.0f} MB")
+    if not plan['fits']:
+        text += " (excede o orçamento mesmo na menor resolução)"
+    return text
@@ -0,0 +1,293 @@
+"""
+Instrumentação do pipeline: etapas e subetapas com tempo de parede, tempo de
+CPU, pico de memória alocada e tamanhos de arrays, exportáveis como tabela
+ou trace do Chrome (chrome://tracing, ui.perfetto.dev). Inclui o limitador
+de frequência das barras de progresso.
+"""
+import os
+import json
+import time
+import threading
+import contextvars
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+import numpy as np
+
+
+_ACTIVE = contextvars.ContextVar('evm_profiler', default=None)
+# Etapa aberta mais interna no contexto atual (por thread / cópia de contexto)
+_CURRENT_SPAN = contextvars.ContextVar('evm_span', default=None)
+
+
+class Span:
+    """Intervalo medido de uma etapa (use Profiler.stage para criar)."""
+
+    def __init__(self, name, parent, depth, args):
+        self.name = name
+        self.parent = parent
+        self.depth = depth
+        self.args = dict(args)
+        self.profiler = None
+        self.thread_id = threading.get_ident()
+        self.start = time.perf_counter()
+        self.cpu_start = time.process_time()
+        self.end = None
+        self.cpu_end = None
+        self.mem_base = None
+        self.mem_peak_abs = 0
+        self.peak_bytes = None
+
+    @property
+    def wall(self):
+        return (self.end if self.end is not None else time.perf_counter()) - self.start
+
+    @property
+    def cpu(self):
+        return (self.cpu_end if self.cpu_end is not None else time.process_time()) - self.cpu_start
+
+
+def describe(value):
+    """Resumo serializável de um valor anotado (arrays viram forma, dtype e MB)."""
+    if hasattr(value, 'shape') and hasattr(value, 'dtype'):
+        return {
+            'shape': list(value.shape),
+            'dtype': str(value.dtype),
+            'mb': round(int(getattr(value, 'nbytes', 0)) / 1024 ** 2, 3),
+        }
+    if isinstance(value, (np.floating, np.integer)):
+        return value.item()
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    return str(value)
+
+
+class Profiler:
+    """
+    Registra etapas aninhadas de uma execução do pipeline.
+    A etapa aberta é guardada por contexto (contextvars): etapas abertas em
+    threads de trabalho (run_tiles copia o contexto para cada bloco) viram
+    subetapas da etapa que despachou o trabalho, sem se misturar entre threads.
+    O tempo de CPU é o do processo inteiro (soma de todas as threads): CPU
+    maior que o tempo de parede indica trabalho paralelo na etapa.
+        Parâmetros:
+        - track_memory: mede o pico de memória alocada por etapa com
+          tracemalloc (inclui os buffers do NumPy). O rastreamento torna as
+          etapas com muitos arrays temporários até ~2x mais lentas.
+        - listener: função chamada com (evento, span) ao abrir ('start') e
+          fechar ('end') cada etapa (ex.: progresso de jobs em outro processo)
+    """
+
+    def __init__(self, track_memory=False, listener=None):
+        self.track_memory = track_memory
+        self.listener = listener
+        self.spans = []
+        # Etapas abertas (todas as threads), na ordem de abertura
+        self._stack = []
+        self._lock = threading.Lock()
+        self._started_tracemalloc = False
+        self.origin = time.perf_counter()
+
+    @contextmanager
+    def activate(self):
+        """Torna este profiler o ativo para evm.profiling.stage/annotate no contexto atual."""
+        if self.track_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+        token = _ACTIVE.set(self)
+        try:
+            yield self
+        finally:
+            _ACTIVE.reset(token)
+            while self._stack:
+                self._close(self._stack[0])
+            if self._started_tracemalloc:
+                tracemalloc.stop()
+                self._started_tracemalloc = False
+
+    @contextmanager
+    def stage(self, name, **args):
+        """Mede uma etapa; etapas abertas dentro dela viram subetapas."""
+        span = self._open(name, args)
+        try:
+            yield span
+        finally:
+            self._close(span)
+
+    def annotate(self, **values):
+        """Anexa valores (arrays são resumidos em forma/dtype/MB) à etapa aberta mais interna do contexto."""
+        span = self._current_span()
+        if span is not None:
+            span.args.update({k: describe(v) for k, v in values.items()})
+
+    def _current_span(self):
+        # Etapa aberta mais interna deste profiler no contexto atual
+        span = _CURRENT_SPAN.get()
+        while span is not None and (span.end is not None or span.profiler is not self):
+            span = span.parent
+        return span
+
+    def _open(self, name, args):
+        parent = self._current_span()
+        with self._lock:
+            depth = 0 if parent is None else parent.depth + 1
+            span = Span(name, parent, depth, {k: describe(v) for k, v in args.items()})
+            span.profiler = self
+            if self.track_memory and tracemalloc.is_tracing():
+                current, peak = tracemalloc.get_traced_memory()
+                # Preserva o pico já atingido pelas etapas abertas antes de zerá-lo
+                for open_span in self._stack:
+                    open_span.mem_peak_abs = max(open_span.mem_peak_abs, peak)
+                tracemalloc.reset_peak()
+                span.mem_base = current
+                span.mem_peak_abs = current
+            self._stack.append(span)
+            self.spans.append(span)
+        _CURRENT_SPAN.set(span)
+        if self.listener is not None:
+            self.listener('start', span)
+        return span
+
+    def _close(self, span):
+        with self._lock:
+            if span.end is not None:
+                return
+            # Fecha também subetapas deixadas abertas por exceções
+            for open_span in [s for s in reversed(self._stack) if _is_descendant(s, span)]:
+                self._stack.remove(open_span)
+                self._finish(open_span)
+            self._stack.remove(span)
+            self._finish(span)
+        current = _CURRENT_SPAN.get()
+        if current is span or (current is not None and _is_descendant(current, span)):
+            _CURRENT_SPAN.set(span.parent)
+        if self.listener is not None:
+            self.listener('end', span)
+
+    def _finish(self, span):
+        span.end = time.perf_counter()
+        span.cpu_end = time.process_time()
+        if span.mem_base is not None and tracemalloc.is_tracing():
+            peak = max(span.mem_peak_abs, tracemalloc.get_traced_memory()[1])
+            span.peak_bytes = peak - span.mem_base
+            for open_span in self._stack:
+                open_span.mem_peak_abs = max(open_span.mem_peak_abs, peak)
+
+    def rows(self):
+        """Uma linha por etapa, na ordem de início (para tabelas na interface)."""
+        rows = []
+        for span in self.spans:
+            rows.append({
+                'etapa': '    ' * span.depth + span.name,
+                'parede (s)': round(span.wall, 3),
+                'CPU (s)': round(span.cpu, 3),
+                'pico alocado (MB)': None if span.peak_bytes is None else round(span.peak_bytes / 1024 ** 2, 1),
+                'detalhes': ', '.join(f"{k}={_format_arg(v)}" for k, v in span.args.items()),
+            })
+        return rows
+
+    def totals(self):
+        """Tempo de parede por etapa de primeiro nível (segundos)."""
+        totals = {}
+        for span in self.spans:
+            if span.depth == 0:
+                totals[span.name] = totals.get(span.name, 0.0) + span.wall
+        return totals
+
+    def chrome_trace(self):
+        """Trace no formato de eventos do Chrome (eventos completos 'X', tempos em µs)."""
+        pid = os.getpid()
+        events = []
+        for span in self.spans:
+            args = dict(span.args)
+            args['cpu_s'] = round(span.cpu, 6)
+            if span.peak_bytes is not None:
+                args['peak_alloc_mb'] = round(span.peak_bytes / 1024 ** 2, 3)
+            events.append({
+                'name': span.name,
+                'cat': 'evm',
+                'ph': 'X',
+                'ts': (span.start - self.origin) * 1e6,
+                'dur': span.wall * 1e6,
+                'pid': pid,
+                'tid': span.thread_id,
+                'args': args,
+            })
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def chrome_trace_json(self):
+        return json.dumps(self.chrome_trace(), indent=1)
+
+    def save_chrome_trace(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(self.chrome_trace_json())
+        return path
+
+
+def _is_descendant(span, ancestor):
+    parent = span.parent
+    while parent is not None:
+        if parent is ancestor:
+            return True
+        parent = parent.parent
+    return False
+
+
+def _format_arg(value):
+    if isinstance(value, dict) and 'shape' in value:
+        return f"{'x'.join(map(str, value['shape']))} {value['dtype']} ({value['mb']:.1f} MB)"
+    if isinstance(value, float):
+        return f"{value:.4g}"
+    return str(value)
+
+
+def active_profiler():
+    """Profiler ativo no contexto atual (None se nenhum)."""
+    return _ACTIVE.get()
+
+
+def stage(name, **args):
+    """Etapa no profiler ativo; sem profiler ativo não mede nada."""
+    profiler = _ACTIVE.get()
+    if profiler is None:
+        return nullcontext()
+    return profiler.stage(name, **args)
+
+
+def annotate(**values):
+    """Anota a etapa aberta do profiler ativo (sem efeito se não houver)."""
+    profiler = _ACTIVE.get()
+    if profiler is not None:
+        profiler.annotate(**values)
+
+
+class ThrottledProgress:
+    """
+    Limita as atualizações de uma barra de progresso (ex.: st.progress): repassa
+    um valor apenas se passou min_interval segundos desde o último repasse, se
+    avançou ao menos min_step, ou ao atingir 1.0. As funções do núcleo chamam
+    .progress() por bloco ou por frame; cada atualização no Streamlit custa uma
+    mensagem ao navegador.
+    """
+
+    def __init__(self, progress_bar, min_interval=0.1, min_step=0.02):
+        self.progress_bar = progress_bar
+        self.min_interval = min_interval
+        self.min_step = min_step
+        self._last_value = None
+        self._last_time = 0.0
+        self._lock = threading.Lock()
+
+    def progress(self, value):
+        now = time.perf_counter()
+        with self._lock:
+            if (
+                self._last_value is not None
+                and value < 1.0
+                and now - self._last_time < self.min_interval
+                and abs(value - self._last_value) < self.min_step
+            ):
+                return
+            self._last_value = value
+            self._last_time = now
+        self.progress_bar.progress(value)
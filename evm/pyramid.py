@@ -0,0 +1,132 @@
+"""EVM Laplaciano: pirâmide por nível, filtragem temporal e reconstrução."""
+import numpy as np
+import cv2
+
+from evm.filters import apply_bandpass_filter, fft_bandpass_filter
+from evm.profiling import annotate, stage
+from evm.tiling import iter_row_tiles, resolve_workers, run_tiles
+
+
+def build_laplacian_pyramid_stack(frames, n_levels=4, workers=1):
+    """
+    Constrói a pirâmide Laplaciana de todos os frames em uma única passada,
+    gravando cada nível diretamente em um array contíguo (T, h, w).
+        Parâmetros:
+        - frames: array (T, H, W) float32, ou FrameStore
+        - n_levels: número de níveis Laplacianos
+        - workers: threads que processam blocos de frames em paralelo
+
+        Retorna:
+        - levels: lista com n_levels arrays Laplacianos (T, h_l, w_l) seguida
+          do nível passa-baixa (T, h_N, w_N)
+    """
+    T, H, W = frames.shape
+    shapes = []
+    h, w = H, W
+    for _ in range(n_levels + 1):
+        shapes.append((h, w))
+        h, w = (h + 1) // 2, (w + 1) // 2
+    levels = [np.empty((T,) + shape, dtype=np.float32) for shape in shapes]
+
+    def build_range(t0, t1):
+        for t in range(t0, t1):
+            current = np.asarray(frames[t], dtype=np.float32)
+            for level in range(n_levels):
+                next_ = cv2.pyrDown(current)
+                up = cv2.pyrUp(next_, dstsize=(current.shape[1], current.shape[0]))
+                np.subtract(current, up, out=levels[level][t])
+                current = next_
+            levels[n_levels][t] = current  # nível mais baixo
+
+    chunk = max(1, -(-T // (4 * resolve_workers(workers))))
+    run_tiles(build_range, [(t0, min(T, t0 + chunk)) for t0 in range(0, T, chunk)], resolve_workers(workers))
+    return levels
+
+
+def laplacian_evm(frames_gray, fps, f_low, f_high, order=5, alpha=20, n_levels=4, kernel_size=5,
+                  engine='butterworth', workers=1, progress_bar=None):
+    """
+    EVM Laplaciano: decompõe os frames em pirâmide, filtra cada nível no tempo,
+    suaviza com média móvel temporal e amplifica por alpha. Os níveis são
+    filtrados um a um, no lugar (sem cópias da pilha), com todas as threads
+    distribuídas entre os blocos de linhas de cada nível.
+        Parâmetros:
+        - frames_gray: array (T, H, W) normalizado [0, 1], ou FrameStore
+        - fps, f_low, f_high, order: como em apply_bandpass_filter
+        - alpha: ganho de amplificação dos níveis Laplacianos
+        - n_levels: número de níveis da pirâmide
+        - kernel_size: janela (ímpar) da média móvel temporal, O(T) por pixel
+        - engine: 'butterworth' (apply_bandpass_filter) ou 'fft' (fft_bandpass_filter)
+        - workers: threads (distribuídas entre os blocos de cada nível)
+        - progress_bar: barra de progresso do Streamlit (opcional)
+
+        Retorna:
+        - filtered_levels: lista de n_levels arrays amplificados (T, h_l, w_l)
+        - lowpass: nível passa-baixa (T, h_N, w_N), sem amplificação
+    """
+    from scipy.ndimage import uniform_filter1d
+
+    workers = resolve_workers(workers)
+    with stage('pirâmide', n_levels=n_levels):
+        levels = build_laplacian_pyramid_stack(frames_gray, n_levels, workers)
+        annotate(**{f'nível_{i}': level for i, level in enumerate(levels)})
+    filtered_levels = levels[:n_levels]
+    lowpass = levels[n_levels]
+
+    def smooth_and_amplify(stack, y0, y1):
+        block = stack[:, y0:y1]
+        # Suavização temporal extra para transições suaves (borda replicada)
+        if kernel_size > 1:
+            uniform_filter1d(block, kernel_size, axis=0, mode='nearest', output=block)
+        # Amplifica
+        block *= alpha
+
+    with stage('filtrar níveis', engine=engine):
+        for level, stack in enumerate(filtered_levels):
+            if engine == 'fft':
+                fft_bandpass_filter(stack, fps, f_low, f_high, workers=workers, out=stack)
+            else:
+                apply_bandpass_filter(stack, fps, f_low, f_high, order, workers=workers, out=stack)
+            rows = max(1, -(-stack.shape[1] // workers))
+            tasks = [(stack, y0, y1) for y0, y1 in iter_row_tiles(stack.shape[1], rows)]
+            run_tiles(smooth_and_amplify, tasks, workers)
+            if progress_bar is not None:
+                progress_bar.progress((level + 1) / n_levels)
+    return filtered_levels, lowpass
+
+
+def iter_laplacian_reconstruction(frames_gray, filtered_levels, lowpass, top_percent=10):
+    """
+    Reconstrói os frames amplificados um a um e destaca em vermelho os pixels
+    com maior deslocamento amplificado sobre o frame original em cinza.
+        Parâmetros:
+        - frames_gray: array (T, H, W) original normalizado [0, 1]
+        - filtered_levels, lowpass: saída de laplacian_evm
+        - top_percent: porcentagem de pixels destacados por frame
+
+        Gera:
+        - frames BGR uint8 (H, W, 3)
+    """
+    T = lowpass.shape[0]
+    for t in range(T):
+        # Começa pelo nível mais baixo (sem amplificação)
+        recon = lowpass[t]
+        for level in reversed(range(len(filtered_levels))):
+            recon = cv2.pyrUp(recon, dstsize=filtered_levels[level][t].shape[::-1])
+            recon += filtered_levels[level][t]
+        np.clip(recon, 0, 1, out=recon)
+
+        # recon >= 0: normalizar pelo máximo não altera a ordem dos pixels.
+        # Seleção parcial em O(n) da estatística de ordem ceil((n - 1) * q), o
+        # primeiro valor não inferior ao percentil com interpolação linear
+        k = min(recon.size - 1, int(np.ceil((recon.size - 1) * (100 - top_percent) / 100)))
+        threshold = np.partition(recon.ravel(), k)[k]
+        mask = recon >= threshold
+
+        # Cria imagem BGR em tons de cinza do frame original
+        luminance = np.clip(frames_gray[t], 0, 1)
+        recon_bgr = cv2.cvtColor((luminance * 255).astype(np.uint8), cv2.COLOR_GRAY2BGR)
+
+        # Destaca apenas os tensores de deslocamento (pixels da máscara) em vermelho puro
+        recon_bgr[mask] = (0, 0, 255)
+        yield recon_bgr
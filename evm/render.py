@@ -0,0 +1,171 @@
+"""Renderização do heatmap: colormaps por LUT, overlay e setas dos tensores."""
+import numpy as np
+import cv2
+
+
+_COLORMAP_LUTS = {}
+
+
+def colormap_lut(colormap_name):
+    """
+    Tabela de consulta (256, 3) uint8 em BGR para um colormap do matplotlib.
+    Equivale a cmap(x) para x em [0, 1] (o matplotlib também quantiza em 256 cores).
+    """
+    lut = _COLORMAP_LUTS.get(colormap_name)
+    if lut is None:
+        # matplotlib só é carregado na primeira LUT de cada processo
+        import matplotlib
+        cmap = matplotlib.colormaps[colormap_name].resampled(256)
+        rgb = (cmap(np.arange(256))[:, :3] * 255).astype(np.uint8)
+        lut = np.ascontiguousarray(rgb[:, ::-1])
+        _COLORMAP_LUTS[colormap_name] = lut
+    return lut
+
+
+def apply_colormap_lut(heatmap_normalized, colormap_name='inferno'):
+    """Aplica o colormap via LUT a um mapa [0, 1] (H, W); retorna BGR uint8 (H, W, 3)."""
+    idx = np.nan_to_num(np.asarray(heatmap_normalized, dtype=np.float32) * 256, nan=0.0)
+    idx = np.clip(idx, 0, 255).astype(np.uint8)
+    return colormap_lut(colormap_name)[idx]
+
+
+def create_heatmap_overlay(frame_bgr, heatmap_normalized, colormap_name='inferno', alpha=0.5):
+    """
+    Cria overlay do heatmap sobre o frame original.
+        Parâmetros:
+        - frame_bgr: frame original BGR (H, W, 3)
+        - heatmap_normalized: mapa normalizado [0, 1] (H, W), ou camada BGR
+          uint8 (H, W, 3) já colorida por apply_colormap_lut
+        - colormap_name: nome do colormap matplotlib
+        - alpha: opacidade do overlay [0, 1]
+        
+        Retorna:
+        - overlay: frame com heatmap sobreposto (H, W, 3)
+    """
+    # Garante que alpha está entre 0 e 1
+    alpha = np.clip(alpha, 0, 1)
+
+    # Aplica colormap via LUT (BGR), exceto se a camada já vier colorida
+    if heatmap_normalized.ndim == 3:
+        heatmap_bgr = heatmap_normalized
+    else:
+        heatmap_bgr = apply_colormap_lut(heatmap_normalized, colormap_name)
+
+    # Garante que o frame é uint8
+    if not np.issubdtype(frame_bgr.dtype, np.uint8):
+        frame_bgr = np.clip(frame_bgr * 255, 0, 255).astype(np.uint8)
+
+    # Blend
+    overlay = cv2.addWeighted(frame_bgr, 1 - alpha, heatmap_bgr, alpha, 0)
+    return overlay
+
+
+def select_significant_tensors(tensor_field, max_vectors=30, percentile=99, seed=42):
+    """
+    Seleciona os pixels com tensores mais significativos (acima do percentil)
+    e amostra no máximo max_vectors deles de forma reprodutível. Se o campo
+    tiver 'valid' (composite_tensor_field), só esses pixels são considerados.
+        Retorna:
+        - idxs: array (N, 2) de coordenadas (y, x)
+        - crit: (y, x) do tensor mais crítico, ou None
+    """
+    eigvals_abs = tensor_field['principal_abs']
+    valid = tensor_field.get('valid')
+    if valid is None:
+        idxs = np.argwhere(eigvals_abs >= np.percentile(eigvals_abs, percentile))
+    elif np.any(valid):
+        idxs = np.argwhere(valid & (eigvals_abs >= np.percentile(eigvals_abs[valid], percentile)))
+    else:
+        idxs = np.empty((0, 2), dtype=np.intp)
+    if idxs.shape[0] > max_vectors:
+        rng = np.random.default_rng(seed=seed)
+        selected = rng.choice(idxs.shape[0], size=max_vectors, replace=False)
+        idxs = idxs[selected]
+    crit = None
+    if len(idxs) > 0:
+        y_crit, x_crit = idxs[np.argmax(eigvals_abs[tuple(idxs.T)])]
+        crit = (int(y_crit), int(x_crit))
+    return idxs, crit
+
+
+def draw_tensor_arrows(tensor_field, idxs, crit=None):
+    """
+    Desenha as setas dos tensores selecionados em uma camada estática.
+    Cor de azul (menor) a vermelho (maior) em HSV; o tensor crítico em vermelho puro.
+        Retorna:
+        - layer: camada BGR uint8 (H, W, 3) com as setas
+        - mask: máscara booleana (H, W) dos pixels desenhados
+    """
+    eigvecs = tensor_field['principal_vec']
+    eigvals_abs = tensor_field['principal_abs']
+    H, W = eigvals_abs.shape
+    layer = np.zeros((H, W, 3), dtype=np.uint8)
+    mask = np.zeros((H, W), dtype=np.uint8)
+    if len(idxs) == 0:
+        return layer, mask.astype(bool)
+
+    vals = eigvals_abs[tuple(idxs.T)]
+    min_val, max_val = np.min(vals), np.max(vals)
+    t = (vals - min_val) / (max_val - min_val) if max_val > min_val else np.zeros_like(vals)
+    hsv = np.stack([
+        (120 * (1 - t)).astype(int),  # 120=azul, 0=vermelho
+        (200 + 55 * t).astype(int),
+        (200 + 55 * t).astype(int),
+    ], axis=-1)
+    for j, (y, x) in enumerate(idxs):
+        if crit is not None and (y, x) == crit:
+            hsv[j] = (0, 255, 255)
+    colors = cv2.cvtColor(hsv.astype(np.uint8)[:, None, :], cv2.COLOR_HSV2BGR)[:, 0]
+
+    scale = 0.1 * np.sqrt(H ** 2 + W ** 2)
+    for (y, x), color in zip(idxs, colors):
+        v = eigvecs[y, x]
+        if np.linalg.norm(v) == 0:
+            continue
+        start = (int(x), int(y))
+        end = (int(round(x + v[0] * scale)), int(round(y + v[1] * scale)))
+        cv2.arrowedLine(layer, start, end, tuple(int(c) for c in color), thickness=2, tipLength=0.2)
+        cv2.arrowedLine(mask, start, end, 255, thickness=2, tipLength=0.2)
+    return layer, mask.astype(bool)
+
+
+class HeatmapRenderer:
+    """
+    Renderizador do modo Heatmap RMS com camadas estáticas pré-calculadas:
+    heatmap colorido (LUT de 256 cores), setas dos tensores e máscara de
+    amplificação já multiplicada pelo ganho. Por frame restam apenas a
+    amplificação, um único blend e a cópia das setas.
+        Parâmetros:
+        - tensor_field: saída de principal_tensor_field
+        - colormap_name: nome do colormap matplotlib
+        - overlay_alpha: opacidade do overlay [0, 1]
+        - gain: ganho alpha aplicado ao sinal filtrado nas regiões dos tensores
+        - max_vectors: número máximo de setas
+    """
+
+    def __init__(self, tensor_field, colormap_name='inferno', overlay_alpha=0.5, gain=1.0, max_vectors=30):
+        self.overlay_alpha = float(np.clip(overlay_alpha, 0, 1))
+        self.heatmap_bgr = apply_colormap_lut(tensor_field['principal_norm'], colormap_name)
+        self.idxs, self.crit = select_significant_tensors(tensor_field, max_vectors=max_vectors)
+        self.arrow_layer, self.arrow_mask = draw_tensor_arrows(tensor_field, self.idxs, self.crit)
+        self.arrow_pixels = np.nonzero(self.arrow_mask)
+
+        # Máscara para amplificar apenas nos tensores máximos, suavizada para evitar artefatos
+        H, W = tensor_field['principal_abs'].shape
+        mask_amplify = np.zeros((H, W), dtype=np.float32)
+        if len(self.idxs) > 0:
+            mask_amplify[tuple(self.idxs.T)] = 1.0
+        self.amplify_gain = cv2.GaussianBlur(mask_amplify, (7, 7), 0) * gain
+
+    def render(self, frame_gray, filtered_frame):
+        """
+        Renderiza um frame: frame em cinza [0, 1] amplificado pelo sinal filtrado
+        nas regiões selecionadas, heatmap sobreposto e setas por cima.
+        Retorna BGR uint8 (H, W, 3).
+        """
+        amplified = frame_gray + filtered_frame * self.amplify_gain
+        np.clip(amplified, 0, 1, out=amplified)
+        amplified_bgr = cv2.cvtColor((amplified * 255).astype(np.uint8), cv2.COLOR_GRAY2BGR)
+        overlay = cv2.addWeighted(amplified_bgr, 1 - self.overlay_alpha, self.heatmap_bgr, self.overlay_alpha, 0)
+        overlay[self.arrow_pixels] = self.arrow_layer[self.arrow_pixels]
+        return overlay
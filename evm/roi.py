@@ -0,0 +1,265 @@
+"""
+Regiões de interesse (ROIs) retangulares ou poligonais. Cada ROI é recortada
+na leitura, estabilizada, filtrada e reduzida ao mapa RMS de forma
+independente (ROIs em paralelo), e os resultados são compostos de volta nas
+coordenadas do quadro inteiro.
+"""
+import numpy as np
+import cv2
+
+from evm.filters import (
+    apply_bandpass_filter,
+    causal_bandpass_rms,
+    compute_rms_map,
+    fft_bandpass_filter,
+    iter_causal_bandpass,
+)
+from evm.multires import coarse_to_fine_rms
+from evm.profiling import annotate, stage
+from evm.stabilization import stabilize_video
+from evm.tensors import principal_tensor_field
+from evm.tiling import resolve_workers, run_tiles
+
+
+def parse_rois(spec):
+    """
+    Converte a especificação de ROIs (parâmetros, JSON da interface) em ROIs.
+    Formatos aceitos por item, em pixels do vídeo original:
+    - [x0, y0, x1, y1] ou {'box': [x0, y0, x1, y1]}: retângulo
+    - [[x, y], [x, y], ...] ou {'polygon': [[x, y], ...]}: polígono (3+ vértices)
+        Parâmetros:
+        - spec: lista de itens (None ou vazia = sem ROI)
+
+        Retorna:
+        - lista de dicionários {'box': (x0, y0, x1, y1), 'polygon': array (N, 2) ou None}
+    """
+    rois = []
+    for item in spec or []:
+        if isinstance(item, dict):
+            if 'polygon' in item:
+                item = item['polygon']
+            elif 'box' in item:
+                item = item['box']
+            else:
+                raise ValueError(f"ROI deve ter 'box' ou 'polygon': {item}")
+        values = np.asarray(item, dtype=np.float64)
+        if values.shape == (4,):
+            x0, y0, x1, y1 = values
+            if x1 <= x0 or y1 <= y0:
+                raise ValueError(f"Retângulo de ROI vazio: {list(item)}")
+            rois.append({'box': (float(x0), float(y0), float(x1), float(y1)), 'polygon': None})
+        elif values.ndim == 2 and values.shape[1] == 2 and values.shape[0] >= 3:
+            x0, y0 = values.min(axis=0)
+            x1, y1 = values.max(axis=0)
+            rois.append({'box': (float(x0), float(y0), float(x1), float(y1)), 'polygon': values})
+        else:
+            raise ValueError(f"ROI inválida (use [x0, y0, x1, y1] ou lista de vértices [x, y]): {item}")
+    return rois
+
+
+def scale_rois(rois, scale_x, scale_y, width, height):
+    """
+    Leva as ROIs das coordenadas do vídeo original para as de trabalho
+    (resolução escolhida pelo plano de memória), com caixas inteiras
+    recortadas ao quadro. ROIs totalmente fora do quadro geram ValueError.
+    """
+    scaled = []
+    for roi in rois:
+        x0, y0, x1, y1 = roi['box']
+        box = (
+            int(np.clip(np.floor(x0 * scale_x), 0, width)),
+            int(np.clip(np.floor(y0 * scale_y), 0, height)),
+            int(np.clip(np.ceil(x1 * scale_x), 0, width)),
+            int(np.clip(np.ceil(y1 * scale_y), 0, height)),
+        )
+        if box[2] - box[0] < 2 or box[3] - box[1] < 2:
+            raise ValueError(f"ROI fora do quadro ou menor que 2 px: {roi['box']}")
+        polygon = None
+        if roi['polygon'] is not None:
+            polygon = roi['polygon'] * np.array([scale_x, scale_y])
+        scaled.append({'box': box, 'polygon': polygon})
+    return scaled
+
+
+def roi_area_fraction(rois, width, height):
+    """Fração do quadro coberta pelas caixas das ROIs (sobreposições contadas uma vez por ROI)."""
+    area = sum((x1 - x0) * (y1 - y0) for x0, y0, x1, y1 in (roi['box'] for roi in rois))
+    return min(1.0, area / max(width * height, 1))
+
+
+def roi_mask(roi):
+    """Máscara booleana (h, w) da ROI dentro da sua caixa (toda True para retângulos)."""
+    x0, y0, x1, y1 = roi['box']
+    if roi['polygon'] is None:
+        return np.ones((y1 - y0, x1 - x0), dtype=bool)
+    mask = np.zeros((y1 - y0, x1 - x0), dtype=np.uint8)
+    points = np.round(roi['polygon'] - np.array([x0, y0])).astype(np.int32)
+    cv2.fillPoly(mask, [points], 1)
+    return mask.astype(bool)
+
+
+def roi_coverage(rois, width, height, inset=0):
+    """
+    Máscara booleana (H, W) dos pixels cobertos pelas ROIs. Com inset > 0, a
+    faixa de inset pixels junto à borda de cada ROI fica de fora.
+    """
+    coverage = np.zeros((height, width), dtype=bool)
+    for roi in rois:
+        x0, y0, x1, y1 = roi['box']
+        coverage[y0:y1, x0:x1] |= _roi_interior(roi, inset)
+    return coverage
+
+
+def _roi_interior(roi, inset):
+    mask = roi_mask(roi)
+    if inset <= 0:
+        return mask
+    kernel = np.ones((2 * inset + 1, 2 * inset + 1), dtype=np.uint8)
+    # Fora da caixa conta como fora da ROI: a borda da caixa também é excluída
+    return cv2.erode(mask.astype(np.uint8), kernel, borderType=cv2.BORDER_CONSTANT, borderValue=0).astype(bool)
+
+
+def process_roi(frames, fps, f_low, f_high, order=5, gain=1.0, filter_mode='zero_phase',
+                stabilize=True, stabilization_method='lk', warmup_frames=0, multiresolution=False,
+                keep_filtered=True, video_hash=None):
+    """
+    Estabiliza, filtra e reduz ao mapa RMS a pilha recortada de uma ROI.
+        Parâmetros:
+        - frames: pilha (T, h, w) float32 da ROI (nunca modificada; a pilha
+          estabilizada é filtrada no lugar quando não é mais usada)
+        - fps, f_low, f_high, order: como em apply_bandpass_filter
+        - gain: ganho aplicado ao RMS
+        - filter_mode: 'zero_phase', 'causal' ou 'fft'
+        - stabilize, stabilization_method: estabilização da ROI
+        - warmup_frames: frames descartados no modo causal
+        - multiresolution: RMS grosso -> fino (modo zero_phase)
+        - keep_filtered: mantém os frames filtrados (overlay do heatmap)
+        - video_hash: chave do cache de transformações desta ROI (opcional)
+
+        Retorna:
+        - dicionário com 'rms' (h, w), 'frames' (pilha estabilizada, sem
+          filtro; None se foi filtrada no lugar) e 'filtered' (pilha filtrada,
+          ou None se deve ser regenerada em streaming a partir de 'frames')
+    """
+    stabilized = frames
+    if stabilize:
+        stabilized = stabilize_video(frames, method=stabilization_method, video_hash=video_hash)
+    # Só a pilha estabilizada própria (não o recorte recebido) pode ser filtrada no
+    # lugar, e apenas se a pilha filtrada for mantida: sem ela, a renderização
+    # refiltra 'frames' em streaming
+    in_place = stabilized is not frames and keep_filtered
+    frames = stabilized
+    filtered = None
+    if filter_mode == 'causal':
+        rms = causal_bandpass_rms(frames, fps, f_low, f_high, order, warmup_frames=warmup_frames, gain=gain)
+    elif filter_mode == 'fft':
+        result = fft_bandpass_filter(frames, fps, f_low, f_high, return_filtered=keep_filtered)
+        rms = gain * result['rms']
+        filtered = result['filtered']
+    elif multiresolution:
+        rms = coarse_to_fine_rms(frames, fps, f_low, f_high, order, gain=gain)['rms']
+    else:
+        filtered = apply_bandpass_filter(frames, fps, f_low, f_high, order, out=frames if in_place else None)
+        rms = compute_rms_map(filtered, gain=gain)
+        if in_place:
+            frames = None
+        if not keep_filtered:
+            filtered = None
+    return {'rms': np.asarray(rms, dtype=np.float32), 'frames': frames, 'filtered': filtered}
+
+
+def process_rois(crops, rois, fps, f_low, f_high, workers=1, progress_bar=None, video_hash=None, **kwargs):
+    """
+    Processa as ROIs em paralelo (uma thread por ROI; OpenCV, SciPy e NumPy
+    liberam o GIL). Os demais parâmetros são os de process_roi.
+        Retorna:
+        - lista de resultados de process_roi, na ordem das ROIs
+    """
+    results = [None] * len(crops)
+
+    def run(i):
+        roi_hash = None
+        if video_hash is not None:
+            roi_hash = f"{video_hash}_roi_{'_'.join(map(str, rois[i]['box']))}"
+        results[i] = process_roi(crops[i], fps, f_low, f_high, video_hash=roi_hash, **kwargs)
+
+    workers = min(resolve_workers(workers), max(len(crops), 1))
+    with stage('ROIs', count=len(crops), workers=workers):
+        run_tiles(run, [(i,) for i in range(len(crops))], workers, progress_bar)
+        annotate(**{f'roi_{i}': crop for i, crop in enumerate(crops)})
+    return results
+
+
+def composite_rms(rois, results, width, height):
+    """
+    Compõe os mapas RMS das ROIs no quadro inteiro (H, W). Fora das ROIs o
+    mapa é zero; em sobreposições prevalece o maior valor.
+    """
+    rms_map = np.zeros((height, width), dtype=np.float32)
+    for roi, result in zip(rois, results):
+        x0, y0, x1, y1 = roi['box']
+        local = np.where(roi_mask(roi), result['rms'], 0).astype(np.float32)
+        np.maximum(rms_map[y0:y1, x0:x1], local, out=rms_map[y0:y1, x0:x1])
+    return rms_map
+
+
+def composite_tensor_field(rois, heatmap):
+    """
+    Campo de tensores (como principal_tensor_field) calculado no recorte de
+    cada ROI e composto no quadro inteiro. No mapa composto o RMS salta para
+    zero na borda das ROIs, e esse degrau dominaria o gradiente; por isso a
+    faixa de 1 pixel junto à borda e o exterior das ROIs ficam com tensor
+    nulo. Em sobreposições prevalece o tensor de maior |principal|.
+        Parâmetros:
+        - rois: ROIs nas coordenadas de heatmap
+        - heatmap: mapa composto (H, W)
+
+        Retorna:
+        - dicionário de principal_tensor_field, com 'valid': máscara (H, W)
+          dos pixels com tensor calculado
+    """
+    heatmap = np.asarray(heatmap, dtype=np.float32)
+    H, W = heatmap.shape
+    field = None
+    for roi in rois:
+        x0, y0, x1, y1 = roi['box']
+        local = principal_tensor_field(heatmap[y0:y1, x0:x1])
+        if field is None:
+            field = {key: np.zeros((H, W) + value.shape[2:], dtype=value.dtype) for key, value in local.items()}
+            field['valid'] = np.zeros((H, W), dtype=bool)
+        take = _roi_interior(roi, 1) & (
+            ~field['valid'][y0:y1, x0:x1] | (local['principal_abs'] > field['principal_abs'][y0:y1, x0:x1])
+        )
+        for key, value in local.items():
+            field[key][y0:y1, x0:x1][take] = value[take]
+        field['valid'][y0:y1, x0:x1] |= take
+    if field is None:
+        field = principal_tensor_field(heatmap)
+        field['valid'] = np.ones((H, W), dtype=bool)
+    field['principal_norm'] = field['principal_abs'] / (field['principal_abs'].max() + 1e-8)
+    return field
+
+
+def iter_composite_filtered(rois, results, width, height, fps, f_low, f_high, order=5):
+    """
+    Gerador de frames filtrados do quadro inteiro (zero fora das ROIs) para a
+    renderização do overlay. ROIs sem pilha filtrada (modo causal,
+    multirresolução) são filtradas de novo em streaming, de forma causal.
+    """
+    sources = []
+    for roi, result in zip(rois, results):
+        if result['filtered'] is not None:
+            sources.append(iter(result['filtered']))
+        else:
+            sources.append(iter_causal_bandpass(result['frames'], fps, f_low, f_high, order))
+    masks = [roi_mask(roi) for roi in rois]
+    while True:
+        frame = np.zeros((height, width), dtype=np.float32)
+        for roi, mask, source in zip(rois, masks, sources):
+            try:
+                local = next(source)
+            except StopIteration:
+                return
+            x0, y0, x1, y1 = roi['box']
+            np.copyto(frame[y0:y1, x0:x1], local, where=mask)
+        yield frame
@@ -0,0 +1,274 @@
+"""Estabilização de vídeo (LK piramidal e ORB) com cache de transformações."""
+import os
+import uuid
+import warnings
+
+import numpy as np
+import cv2
+
+from evm.cache import CACHE_DIR, params_key
+from evm.profiling import annotate, stage
+from evm.storage import allocate_frames
+
+
+# Largura máxima do proxy reduzido usado na estimativa de movimento (método 'lk')
+PROXY_WIDTH = 320
+
+
+def _to_uint8(frame):
+    """Converte frame em cinza para uint8 (frames float são assumidos em [0, 1])."""
+    if frame.dtype == np.uint8:
+        return frame
+    return np.clip(np.asarray(frame, dtype=np.float32) * 255.0, 0, 255).astype(np.uint8)
+
+
+def estimate_transforms_orb(frames, progress_bar=None):
+    """
+    Estima a transformação afim de cada frame para o primeiro frame usando
+    detecção e matching de features ORB em resolução de trabalho.
+        Parâmetros:
+        - frames: array (T, H, W) de frames em escala de cinza, ou FrameStore
+        - progress_bar: barra de progresso do Streamlit (opcional)
+
+        Retorna:
+        - transforms: array (T, 2, 3) float32 (identidade onde a estimativa falha)
+    """
+    T = frames.shape[0]
+    transforms = np.tile(np.eye(2, 3, dtype=np.float32), (T, 1, 1))
+    
+    # Frame de referência (primeiro frame)
+    reference_frame = _to_uint8(frames[0])
+    
+    # Detector ORB
+    orb = cv2.ORB_create(nfeatures=500)
+    
+    # Detecta keypoints e descritores no frame de referência
+    kp_ref, des_ref = orb.detectAndCompute(reference_frame, None)
+    
+    if des_ref is None or len(kp_ref) < 10:
+        warnings.warn("⚠️ Poucos features detectados. Usando frames originais.")
+        return transforms
+    
+    # Matcher
+    bf = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True)
+    
+    for i in range(1, T):
+        current_frame = _to_uint8(frames[i])
+        
+        # Detecta keypoints no frame atual
+        kp_curr, des_curr = orb.detectAndCompute(current_frame, None)
+        
+        if des_curr is not None and len(kp_curr) >= 10:
+            # Matching
+            try:
+                matches = bf.match(des_ref, des_curr)
+                matches = sorted(matches, key=lambda x: x.distance)
+                
+                if len(matches) >= 10:
+                    # Extrai pontos correspondentes
+                    src_pts = np.float32([kp_ref[m.queryIdx].pt for m in matches[:50]]).reshape(-1, 1, 2)
+                    dst_pts = np.float32([kp_curr[m.trainIdx].pt for m in matches[:50]]).reshape(-1, 1, 2)
+                    
+                    # Estima transformação afim
+                    M, mask = cv2.estimateAffinePartial2D(dst_pts, src_pts)
+                    if M is not None:
+                        transforms[i] = M
+            except cv2.error:
+                pass
+        
+        # Atualiza barra de progresso
+        if progress_bar is not None:
+            progress_bar.progress((i + 1) / T)
+    
+    return transforms
+
+
+def estimate_transforms_lk(frames, proxy_scale=None, max_corners=100, min_features=30, progress_bar=None):
+    """
+    Estima a transformação afim de cada frame para o primeiro frame rastreando
+    um conjunto fixo de features com fluxo óptico Lucas-Kanade piramidal.
+    O movimento é estimado em uma versão reduzida (proxy) dos frames e a
+    transformação é escalada para a resolução de trabalho. As features só são
+    redetectadas quando restam menos que min_features.
+        Parâmetros:
+        - frames: array (T, H, W) de frames em escala de cinza, ou FrameStore
+        - proxy_scale: fator de escala do proxy de movimento (0 < s <= 1;
+          None = largura do proxy limitada a PROXY_WIDTH pixels)
+        - max_corners: número máximo de features rastreadas
+        - min_features: mínimo de features antes de redetectar
+        - progress_bar: barra de progresso do Streamlit (opcional)
+
+        Retorna:
+        - transforms: array (T, 2, 3) float32 (identidade onde a estimativa falha)
+    """
+    T, H, W = frames.shape
+    transforms = np.tile(np.eye(2, 3, dtype=np.float32), (T, 1, 1))
+    if proxy_scale is None:
+        proxy_scale = min(1.0, PROXY_WIDTH / W)
+    proxy_size = (max(int(round(W * proxy_scale)), 16), max(int(round(H * proxy_scale)), 16))
+    sx = proxy_size[0] / W
+    sy = proxy_size[1] / H
+
+    def proxy(i):
+        return cv2.resize(_to_uint8(frames[i]), proxy_size, interpolation=cv2.INTER_AREA)
+
+    def detect(image):
+        pts = cv2.goodFeaturesToTrack(image, maxCorners=max_corners, qualityLevel=0.01, minDistance=7, blockSize=7)
+        return np.empty((0, 1, 2), dtype=np.float32) if pts is None else pts.astype(np.float32)
+
+    lk_params = dict(winSize=(15, 15), maxLevel=2,
+                     criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 20, 0.03))
+
+    prev = proxy(0)
+    # Pontos rastreados no frame anterior e seus correspondentes no frame de referência
+    prev_pts = detect(prev)
+    ref_pts = prev_pts.copy()
+    if len(prev_pts) < 10:
+        warnings.warn("⚠️ Poucos features detectados. Usando frames originais.")
+        return transforms
+
+    M_proxy = np.eye(2, 3, dtype=np.float32)
+    for i in range(1, T):
+        current = proxy(i)
+        if len(prev_pts) > 0:
+            next_pts, status, _ = cv2.calcOpticalFlowPyrLK(prev, current, prev_pts, None, **lk_params)
+            good = status.reshape(-1) == 1
+            prev_pts, ref_pts = next_pts[good], ref_pts[good]
+
+        if len(prev_pts) >= 10:
+            M, inliers = cv2.estimateAffinePartial2D(prev_pts, ref_pts)
+            if M is not None:
+                M_proxy = M.astype(np.float32)
+                keep = inliers.reshape(-1) == 1
+                prev_pts, ref_pts = prev_pts[keep], ref_pts[keep]
+
+        # Escala a transformação do proxy para a resolução de trabalho
+        M_full = M_proxy.copy()
+        M_full[0, 1] *= sy / sx
+        M_full[1, 0] *= sx / sy
+        M_full[0, 2] /= sx
+        M_full[1, 2] /= sy
+        transforms[i] = M_full
+
+        if len(prev_pts) < min_features:
+            # Redetecta no frame atual e leva os pontos ao referencial pela última transformação
+            prev_pts = detect(current)
+            ref_pts = cv2.transform(prev_pts, M_proxy) if len(prev_pts) else prev_pts
+
+        prev = current
+        if progress_bar is not None:
+            progress_bar.progress((i + 1) / T)
+
+    return transforms
+
+
+def apply_transforms(frames, transforms, progress_bar=None):
+    """
+    Aplica as transformações afins (T, 2, 3) aos frames com cv2.warpAffine.
+    Frames com transformação identidade são copiados sem interpolação.
+        Retorna:
+        - frames_stabilized: array estabilizado (FrameStore se a entrada for FrameStore)
+    """
+    T, H, W = frames.shape
+    frames_stabilized = allocate_frames(frames.shape, frames.dtype, like=frames)
+    identity = np.eye(2, 3, dtype=np.float32)
+    for i in range(T):
+        if np.allclose(transforms[i], identity, atol=1e-6):
+            frames_stabilized[i] = frames[i]
+        else:
+            frames_stabilized[i] = cv2.warpAffine(np.asarray(frames[i]), transforms[i], (W, H))
+        if progress_bar is not None:
+            progress_bar.progress((i + 1) / T)
+    return frames_stabilized
+
+
+def _transform_cache_path(video_hash, shape, method, proxy_scale):
+    key = params_key(video=video_hash, shape=list(shape), method=method, proxy_scale=proxy_scale)
+    return os.path.join(CACHE_DIR, "transforms", f"{key}.npy")
+
+
+def load_cached_transforms(video_hash, shape, method, proxy_scale=None):
+    """
+    Lê as transformações (T, 2, 3) salvas para o vídeo, resolução de trabalho e
+    configuração do estabilizador. Retorna None se não houver entrada válida.
+    """
+    path = _transform_cache_path(video_hash, shape, method, proxy_scale)
+    try:
+        transforms = np.load(path)
+    except (OSError, ValueError):
+        return None
+    if transforms.shape != (shape[0], 2, 3):
+        return None
+    return transforms
+
+
+def save_cached_transforms(video_hash, shape, method, proxy_scale, transforms):
+    """Grava as transformações no cache de forma atômica (falhas de I/O são ignoradas)."""
+    path = _transform_cache_path(video_hash, shape, method, proxy_scale)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.save(f, transforms.astype(np.float32))
+        os.replace(tmp_path, path)
+    except OSError:
+        pass
+
+
+def stabilize_video(frames, progress_bar=None, method='lk', proxy_scale=None, video_hash=None):
+    """
+    Estabiliza sequência de frames, removendo movimento de câmera indesejado.
+        Parâmetros:
+        - frames: array (T, H, W) de frames em escala de cinza, ou FrameStore
+        - progress_bar: barra de progresso do Streamlit (opcional)
+        - method: 'lk' (Lucas-Kanade piramidal em proxy reduzido, rápido) ou
+          'orb' (features ORB em resolução de trabalho, referência)
+        - proxy_scale: fator de escala do proxy de movimento no método 'lk' (None = automático)
+        - video_hash: hash do conteúdo do vídeo (hash_file). Se informado, as
+          transformações são lidas/gravadas no cache em CACHE_DIR e execuções
+          seguintes apenas aplicam o warpAffine.
+        
+        Retorna:
+        - frames_stabilized: array estabilizado (FrameStore se a entrada for FrameStore)
+    """
+    transforms = None
+    if video_hash is not None:
+        transforms = load_cached_transforms(video_hash, frames.shape, method, proxy_scale)
+    annotate(transforms_cached=transforms is not None)
+
+    if transforms is None:
+        with stage('estimar transformações', method=method):
+            if method == 'orb':
+                transforms = estimate_transforms_orb(frames, progress_bar)
+            elif method == 'lk':
+                transforms = estimate_transforms_lk(frames, proxy_scale=proxy_scale, progress_bar=progress_bar)
+            else:
+                raise ValueError(f"Método de estabilização desconhecido: {method}")
+        if video_hash is not None:
+            save_cached_transforms(video_hash, frames.shape, method, proxy_scale, transforms)
+
+    if np.allclose(transforms, np.eye(2, 3, dtype=np.float32), atol=1e-6):
+        return frames
+    with stage('aplicar transformações'):
+        return apply_transforms(frames, transforms)
+
+
+def measure_residual_motion(frames, max_frames=None):
+    """
+    Mede o movimento residual de uma sequência como a diferença RMS de
+    intensidade entre cada frame e o primeiro, na região central (ignora as
+    bordas introduzidas pelo warpAffine). Quanto menor, melhor o alinhamento;
+    útil para comparar métodos de estabilização no mesmo vídeo.
+        Retorna:
+        - residual: diferença RMS média (mesma escala dos frames)
+    """
+    T, H, W = frames.shape
+    if max_frames is not None:
+        T = min(T, max_frames)
+    center = (slice(H // 4, 3 * H // 4), slice(W // 4, 3 * W // 4))
+    reference = np.asarray(frames[0][center], dtype=np.float32)
+    residuals = [
+        np.sqrt(np.mean((np.asarray(frames[i][center], dtype=np.float32) - reference) ** 2))
+        for i in range(1, T)
+    ]
+    return float(np.mean(residuals)) if residuals else 0.0
@@ -0,0 +1,111 @@
+"""Pilhas de frames em memória ou em disco (memmap) no diretório de trabalho."""
+import os
+import atexit
+import shutil
+import tempfile
+import uuid
+import weakref
+
+import numpy as np
+
+
+def get_scratch_dir():
+    """
+    Retorna (e cria, se necessário) o diretório de trabalho para pilhas em disco.
+    A base é EVM_SCRATCH_DIR, se definida, ou o diretório temporário do sistema.
+    Cada processo usa um subdiretório próprio, removido ao encerrar.
+    """
+    base_dir = os.environ.get("EVM_SCRATCH_DIR") or os.path.join(tempfile.gettempdir(), "evm_scratch")
+    scratch_dir = os.path.join(base_dir, f"pid_{os.getpid()}")
+    if not os.path.isdir(scratch_dir):
+        os.makedirs(scratch_dir, exist_ok=True)
+        atexit.register(shutil.rmtree, scratch_dir, ignore_errors=True)
+    return scratch_dir
+
+
+def _remove_scratch_file(path):
+    """Remove arquivo de trabalho, ignorando falhas (ex.: arquivo ainda mapeado no Windows)."""
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+class FrameStore:
+    """
+    Pilha de frames (T, H, W) em disco, mapeada em memória (.npy via np.memmap).
+    Permite processar gravações longas limitadas pelo disco e não pela RAM.
+    Suporta indexação e iteração como um np.ndarray; o arquivo é removido
+    quando o objeto deixa de ser referenciado.
+        Parâmetros:
+        - shape: formato da pilha (T, H, W)
+        - dtype: tipo dos elementos
+        - scratch_dir: diretório do arquivo (None = get_scratch_dir())
+    """
+
+    def __init__(self, shape, dtype=np.float32, scratch_dir=None):
+        scratch_dir = scratch_dir or get_scratch_dir()
+        self.path = os.path.join(scratch_dir, f"frames_{uuid.uuid4().hex}.npy")
+        self.array = np.lib.format.open_memmap(self.path, mode='w+', dtype=dtype, shape=tuple(shape))
+        self._finalizer = weakref.finalize(self, _remove_scratch_file, self.path)
+
+    @property
+    def shape(self):
+        return self.array.shape
+
+    @property
+    def dtype(self):
+        return self.array.dtype
+
+    @property
+    def ndim(self):
+        return self.array.ndim
+
+    @property
+    def nbytes(self):
+        return self.array.nbytes
+
+    def __len__(self):
+        return self.array.shape[0]
+
+    def __getitem__(self, key):
+        return self.array[key]
+
+    def __setitem__(self, key, value):
+        self.array[key] = value
+
+    def __iter__(self):
+        for t in range(len(self)):
+            yield self.array[t]
+
+    def __array__(self, dtype=None):
+        return np.asarray(self.array, dtype=dtype)
+
+    def truncate(self, n):
+        """Limita o comprimento lógico da pilha aos primeiros n frames."""
+        self.array = self.array[:n]
+
+    def flush(self):
+        self.array.flush()
+
+    def delete(self):
+        """Libera o mapeamento e remove o arquivo imediatamente."""
+        self.array = None
+        self._finalizer()
+
+
+def allocate_frames(shape, dtype=np.float32, on_disk=False, like=None):
+    """
+    Aloca uma pilha de frames em memória ou em disco.
+        Parâmetros:
+        - shape: formato da pilha
+        - dtype: tipo dos elementos
+        - on_disk: True para FrameStore, False para np.ndarray
+        - like: pilha de referência; se for FrameStore, a nova pilha também
+          fica em disco, no mesmo diretório
+    """
+    if isinstance(like, FrameStore):
+        return FrameStore(shape, dtype, scratch_dir=os.path.dirname(like.path))
+    if on_disk:
+        return FrameStore(shape, dtype)
+    return np.zeros(shape, dtype=dtype)
@@ -0,0 +1,152 @@
+"""
+Varredura de parâmetros: vários mapas RMS passa-banda (bandas x ordens)
+calculados a partir de uma única pilha lida e estabilizada. As variantes são
+avaliadas em blocos de linhas, concorrentemente, sem materializar as pilhas
+filtradas.
+"""
+import numpy as np
+
+from evm.export import npz_bytes
+from evm.filters import apply_bandpass_filter, causal_bandpass_rms, compute_rms_map
+from evm.profiling import stage
+from evm.tiling import TILE_BYTES, iter_row_tiles, resolve_workers, rows_per_tile, run_tiles
+
+
+def parse_bands(spec):
+    """
+    Lê bandas no formato "0.5-3, 3-6; 6-10" (Hz) ou como lista de pares
+    [[0.5, 3], [3, 6]] (arquivos de parâmetros).
+        Retorna:
+        - lista de (f_low, f_high)
+    """
+    if isinstance(spec, str):
+        items = [item.strip().split('-') for item in spec.replace(';', ',').split(',') if item.strip()]
+    else:
+        items = list(spec or [])
+    bands = []
+    for item in items:
+        try:
+            f_low, f_high = (float(v) for v in item)
+        except (TypeError, ValueError):
+            raise ValueError(f"Banda inválida (use f_low-f_high): {'-'.join(map(str, item))}") from None
+        if not 0 < f_low < f_high:
+            raise ValueError(f"Banda inválida: {f_low}-{f_high} Hz")
+        bands.append((f_low, f_high))
+    return bands
+
+
+def sweep_grid(bands, orders=(5,)):
+    """Todas as combinações banda x ordem, na ordem dada, como dicionários de variante."""
+    return [
+        {'f_low': float(f_low), 'f_high': float(f_high), 'order': int(order)}
+        for f_low, f_high in bands
+        for order in orders
+    ]
+
+
+def sweep_bandpass_rms(frames_gray, fps, variants, gain=1.0, filter_mode='zero_phase', warmup_frames=0,
+                       workers=1, progress_bar=None):
+    """
+    Calcula o mapa RMS de cada variante a partir da mesma pilha.
+    Cada tarefa (variante, bloco de linhas) filtra uma cópia do bloco e o reduz
+    com compute_rms_map: a memória é a de um bloco por thread, não a de uma
+    pilha filtrada por variante. No modo 'fft' um único espectro por bloco
+    serve a todas as bandas (a ordem não se aplica ao filtro ideal).
+        Parâmetros:
+        - frames_gray: array (T, H, W) normalizado [0, 1], ou FrameStore
+        - fps: taxa de quadros
+        - variants: lista de {'f_low', 'f_high', 'order'} (ver sweep_grid)
+        - gain: ganho aplicado aos mapas RMS
+        - filter_mode: 'zero_phase', 'causal' ou 'fft'
+        - warmup_frames: frames descartados no modo causal
+        - workers: threads concorrentes
+        - progress_bar: barra de progresso do Streamlit (opcional)
+
+        Retorna:
+        - lista de dicionários da variante com 'rms' (H, W) float32, na ordem de variants
+    """
+    T, H, W = frames_gray.shape
+    nyquist = fps / 2.0
+    for variant in variants:
+        if variant['f_high'] >= nyquist:
+            raise ValueError(f"f_high ({variant['f_high']} Hz) deve ser menor que FPS/2 ({nyquist:.2f} Hz).")
+    workers = resolve_workers(workers)
+    maps = [np.empty((H, W), dtype=np.float32) for _ in variants]
+
+    if filter_mode == 'fft':
+        from scipy import fft as sp_fft
+
+        freqs = sp_fft.rfftfreq(T, d=1.0 / fps)
+        # Pesos de Parseval do espectro unilateral, como em fft_bandpass_filter
+        weights = np.full(freqs.shape, 2.0, dtype=np.float32)
+        weights[0] = 1.0
+        if T % 2 == 0:
+            weights[-1] = 1.0
+        band_idx = [np.flatnonzero((freqs >= v['f_low']) & (freqs <= v['f_high'])) for v in variants]
+
+        def run(y0, y1):
+            tile = np.asarray(frames_gray[:, y0:y1, :], dtype=np.float32)
+            spectrum = sp_fft.rfft(tile, axis=0)
+            power = spectrum.real ** 2 + spectrum.imag ** 2
+            for rms_map, idx in zip(maps, band_idx):
+                band_power = np.tensordot(weights[idx] / T ** 2, power[idx], axes=(0, 0))
+                rms_map[y0:y1] = abs(gain) * np.sqrt(band_power)
+
+        rows = rows_per_tile(frames_gray, itemsize=16, budget=TILE_BYTES // workers)
+        tasks = list(iter_row_tiles(H, rows))
+    else:
+        def run(i, y0, y1):
+            v = variants[i]
+            if filter_mode == 'causal':
+                maps[i][y0:y1] = causal_bandpass_rms(
+                    frames_gray[:, y0:y1, :], fps, v['f_low'], v['f_high'], v['order'],
+                    warmup_frames=warmup_frames, gain=gain
+                )
+            else:
+                tile = np.array(frames_gray[:, y0:y1, :], dtype=np.float32)
+                apply_bandpass_filter(tile, fps, v['f_low'], v['f_high'], v['order'], out=tile)
+                maps[i][y0:y1] = compute_rms_map(tile, gain=gain)
+
+        # Blocos (em float64 no sosfiltfilt) dividem o orçamento entre as threads
+        rows = rows_per_tile(frames_gray, itemsize=8, budget=TILE_BYTES // workers)
+        tasks = [(i, y0, y1) for i in range(len(variants)) for y0, y1 in iter_row_tiles(H, rows)]
+
+    with stage('filtros da varredura', variants=len(variants), filter_mode=filter_mode, workers=workers):
+        run_tiles(run, tasks, workers, progress_bar)
+    return [dict(variant, rms=rms_map) for variant, rms_map in zip(variants, maps)]
+
+
+def variant_label(variant):
+    """Rótulo curto da variante (ex.: '0.5–3 Hz, ordem 5')."""
+    return f"{variant['f_low']:g}–{variant['f_high']:g} Hz, ordem {variant['order']}"
+
+
+def sweep_summary(results, p_low=5, p_high=95):
+    """Estatísticas por variante (sem os mapas), serializáveis em JSON."""
+    summary = []
+    for result in results:
+        rms_map = result['rms']
+        summary.append({
+            'f_low': result['f_low'],
+            'f_high': result['f_high'],
+            'order': result['order'],
+            'mean': float(np.mean(rms_map)),
+            'max': float(np.max(rms_map)),
+            f'p{p_low:g}': float(np.percentile(rms_map, p_low)),
+            f'p{p_high:g}': float(np.percentile(rms_map, p_high)),
+        })
+    return summary
+
+
+def sweep_npz_bytes(results, **metadata):
+    """
+    Exportação combinada da varredura (.npz comprimido): 'rms' (N, H, W) e
+    'f_low', 'f_high', 'order' (N,), mais metadados em JSON ('metadata').
+    """
+    return npz_bytes(
+        metadata,
+        rms=np.stack([r['rms'] for r in results]),
+        f_low=np.array([r['f_low'] for r in results], dtype=np.float32),
+        f_high=np.array([r['f_high'] for r in results], dtype=np.float32),
+        order=np.array([r['order'] for r in results], dtype=np.int32),
+    )
@@ -0,0 +1,101 @@
+"""Campo de tensores principais 2x2 do mapa RMS."""
+import numpy as np
+
+
+def principal_tensor_field(heatmap, tile_rows=None):
+    """
+    Calcula o campo completo de tensores de deformação 2x2 de forma vetorizada.
+    Os autovalores/autovetores do tensor simétrico [[gx, s], [s, gy]], com
+    s = 0.5 * (gx + gy), são obtidos em forma fechada para o mapa inteiro,
+    sem chamadas por pixel a np.linalg.eigh. O sinal dos autovetores é
+    canônico: componente x >= 0 (y >= 0 quando x == 0).
+        Parâmetros:
+        - heatmap: mapa (H, W)
+        - tile_rows: número de linhas por bloco (None = mapa inteiro de uma vez).
+          Limita a memória dos intermediários em mapas grandes.
+
+        Retorna dicionário com:
+        - lambda_max, lambda_min: autovalores (H, W), lambda_max >= lambda_min
+        - vec_max, vec_min: autovetores unitários correspondentes (H, W, 2)
+        - principal: autovalor de maior módulo (H, W)
+        - principal_vec: autovetor correspondente (H, W, 2)
+        - principal_abs: |principal| (H, W)
+        - principal_norm: principal_abs normalizado pelo máximo [0, 1] (H, W)
+        - anisotropy: (|l1| - |l2|) / (|l1| + |l2|), em [0, 1] (H, W)
+        - orientation: ângulo do autovetor principal em radianos [0, pi) (H, W)
+    """
+    heatmap = np.asarray(heatmap, dtype=np.float32)
+    grad_x = np.gradient(heatmap, axis=1)
+    grad_y = np.gradient(heatmap, axis=0)
+    H, W = heatmap.shape
+
+    field = {
+        'lambda_max': np.empty((H, W), dtype=np.float32),
+        'lambda_min': np.empty((H, W), dtype=np.float32),
+        'vec_max': np.empty((H, W, 2), dtype=np.float32),
+        'vec_min': np.empty((H, W, 2), dtype=np.float32),
+        'principal': np.empty((H, W), dtype=np.float32),
+        'principal_vec': np.empty((H, W, 2), dtype=np.float32),
+        'anisotropy': np.empty((H, W), dtype=np.float32),
+        'orientation': np.empty((H, W), dtype=np.float32),
+    }
+
+    step = H if not tile_rows else max(1, int(tile_rows))
+    for y0 in range(0, H, step):
+        y1 = min(H, y0 + step)
+        a = grad_x[y0:y1]
+        c = grad_y[y0:y1]
+        b = 0.5 * (a + c)
+
+        # Autovalores: m +/- r, com m = traço/2 e r = raio do círculo de Mohr
+        m = 0.5 * (a + c)
+        d = 0.5 * (a - c)
+        r = np.hypot(d, b)
+        l1 = m + r
+        l2 = m - r
+
+        # Autovetor de l1 forma ângulo theta = atan2(2b, a - c) / 2 com o eixo x;
+        # theta em (-pi/2, pi/2] já dá (cos, sin) com sinal canônico
+        theta = 0.5 * np.arctan2(b, d)
+        cos_t = np.cos(theta)
+        sin_t = np.sin(theta)
+        # Autovetor de l2, ortogonal: (-sin, cos) com o sinal invertido se x < 0;
+        # tensor isotrópico (r = 0): (1, 0), como a primeira coluna de eigh
+        flip = np.where((sin_t > 0) | ((sin_t == 0) & (cos_t < 0)), -1.0, 1.0)
+        min_x = np.where(r > 0, -sin_t * flip, 1.0)
+        min_y = np.where(r > 0, cos_t * flip, 0.0)
+
+        # Mesmo critério de desempate de argmax(|vals|) sobre eigh (ordem crescente)
+        use_max = np.abs(l1) > np.abs(l2)
+
+        field['lambda_max'][y0:y1] = l1
+        field['lambda_min'][y0:y1] = l2
+        field['vec_max'][y0:y1, :, 0] = cos_t
+        field['vec_max'][y0:y1, :, 1] = sin_t
+        field['vec_min'][y0:y1, :, 0] = min_x
+        field['vec_min'][y0:y1, :, 1] = min_y
+        field['principal'][y0:y1] = np.where(use_max, l1, l2)
+        field['principal_vec'][y0:y1, :, 0] = np.where(use_max, cos_t, min_x)
+        field['principal_vec'][y0:y1, :, 1] = np.where(use_max, sin_t, min_y)
+
+        abs_sum = np.abs(l1) + np.abs(l2)
+        field['anisotropy'][y0:y1] = np.divide(
+            np.abs(np.abs(l1) - np.abs(l2)), abs_sum,
+            out=np.zeros_like(abs_sum), where=abs_sum > 0
+        )
+        field['orientation'][y0:y1] = np.mod(np.where(use_max, theta, theta + np.pi / 2), np.pi)
+
+    field['principal_abs'] = np.abs(field['principal'])
+    field['principal_norm'] = field['principal_abs'] / (field['principal_abs'].max() + 1e-8)
+    return field
+
+
+def principal_tensor_vectors(heatmap, tile_rows=None):
+    """
+    Calcula o maior vetor próprio do tensor de deformação (gradiente) para cada pixel.
+    Retorna:
+        eigvals: autovalor máximo (H, W)
+        eigvecs: vetor próprio correspondente (H, W, 2)
+    """
+    field = principal_tensor_field(heatmap, tile_rows=tile_rows)
+    return field['principal'], field['principal_vec']
@@ -0,0 +1,55 @@
+"""Divisão em blocos (tiles) de linhas e execução paralela por threads."""
+import os
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+
+# Orçamento de memória por bloco (tile) nas etapas que percorrem a pilha inteira
+TILE_BYTES = 64 * 1024 ** 2
+
+
+def rows_per_tile(frames, itemsize=8, budget=TILE_BYTES):
+    """
+    Número de linhas por bloco espacial para que um bloco (T, linhas, W)
+    com elementos de itemsize bytes caiba no orçamento.
+    """
+    T, _, W = frames.shape[:3]
+    return max(1, int(budget // max(T * W * itemsize, 1)))
+
+
+def iter_row_tiles(H, rows):
+    """Gera fatias (y0, y1) cobrindo as H linhas em blocos de até `rows` linhas."""
+    for y0 in range(0, H, rows):
+        yield y0, min(H, y0 + rows)
+
+
+def resolve_workers(workers):
+    """Normaliza o número de workers (None ou <= 0 = todos os núcleos)."""
+    if workers is None or workers <= 0:
+        return os.cpu_count() or 1
+    return int(workers)
+
+
+def run_tiles(func, tiles, workers=1, progress_bar=None):
+    """
+    Executa func(*tile) para cada bloco, em série ou em um pool de threads.
+    As operações pesadas (SciPy/NumPy/OpenCV) liberam o GIL, então blocos
+    disjuntos escritos na mesma pilha de saída rodam em paralelo real.
+    A barra de progresso é atualizada uma vez por bloco concluído, sempre
+    a partir da thread do script. Cada bloco roda em uma cópia do contexto
+    de quem chamou (contextvars), para que as etapas de evm.profiling
+    abertas nas threads sejam registradas no profiler ativo.
+    """
+    total = len(tiles)
+    if workers <= 1 or total <= 1:
+        for done, tile in enumerate(tiles, start=1):
+            func(*tile)
+            if progress_bar is not None:
+                progress_bar.progress(done / total)
+        return
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(contextvars.copy_context().run, func, *tile) for tile in tiles]
+        for done, future in enumerate(as_completed(futures), start=1):
+            future.result()
+            if progress_bar is not None:
+                progress_bar.progress(done / total)
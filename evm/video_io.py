@@ -0,0 +1,427 @@
+"""Leitura de vídeo em streaming e escrita codificada em thread de fundo."""
+import os
+import queue
+import threading
+import uuid
+import warnings
+
+import numpy as np
+import cv2
+
+from evm.filters import TemporalDecimator, iter_decimated
+from evm.storage import FrameStore, allocate_frames, get_scratch_dir
+
+
+def open_video(video_path):
+    """
+    Abre o vídeo e valida o FPS reportado pelo container.
+        Parâmetros:
+        - video_path: caminho do arquivo de vídeo
+
+        Retorna:
+        - cap: cv2.VideoCapture aberto
+        - fps: taxa de quadros por segundo
+        - frame_count: número de frames reportado (0 se desconhecido)
+    """
+    cap = cv2.VideoCapture(video_path)
+
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    if fps <= 0 or fps > 1000:
+        warnings.warn(f"⚠️ FPS inválido detectado ({fps}). Usando 30 FPS como padrão.")
+        fps = 30.0
+
+    frame_count = int(max(cap.get(cv2.CAP_PROP_FRAME_COUNT), 0))
+    return cap, fps, frame_count
+
+
+def iter_video_frames(cap, max_frames=None):
+    """
+    Gerador que decodifica frames BGR um a um, sem acumulá-los em memória.
+        Parâmetros:
+        - cap: cv2.VideoCapture aberto (liberado ao final)
+        - max_frames: número máximo de frames (None = todos)
+    """
+    count = 0
+    try:
+        while max_frames is None or count < max_frames:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            yield frame
+            count += 1
+    finally:
+        cap.release()
+
+
+def _grow_buffer(buffer, capacity):
+    """Realoca buffer de frames preservando o conteúdo já decodificado."""
+    grown = allocate_frames((capacity,) + buffer.shape[1:], buffer.dtype, like=buffer)
+    for t0 in range(0, buffer.shape[0], 256):
+        grown[t0:t0 + 256] = buffer[t0:t0 + 256]
+    return grown
+
+
+def _truncate_frames(frames, n):
+    """Descarta a capacidade não utilizada ao final da pilha."""
+    if isinstance(frames, FrameStore):
+        frames.truncate(n)
+        return frames
+    return frames[:n]
+
+
+def _expected_frames(frame_count, max_frames, decimation=1):
+    """Capacidade inicial da pilha (frames de saída) a partir da contagem do container."""
+    expected = frame_count if frame_count > 0 else 256
+    if max_frames is not None:
+        expected = min(expected, max_frames) if frame_count > 0 else max_frames
+    return max(-(-int(expected) // decimation), 1)
+
+
+def _store_gray(stack, n, gray, dtype):
+    """Grava o frame em cinza (escala 0-255) na posição n da pilha, no dtype dela."""
+    if dtype == np.uint8:
+        if gray.dtype == np.uint8:
+            stack[n] = gray
+        else:
+            stack[n] = np.clip(np.rint(gray), 0, 255)
+    else:
+        np.divide(gray, 255.0, out=stack[n], casting='unsafe')
+
+
+def read_video_stack(video_path, max_frames=None, target_size=None, dtype=np.float32,
+                     keep_bgr=False, on_disk=False, progress_bar=None, decimation=1, decimation_method='fir',
+                     decimation_margin=2.0):
+    """
+    Lê vídeo em streaming diretamente para uma pilha pré-alocada em escala de cinza.
+    Redimensionamento, conversão para cinza e normalização são feitos frame a frame
+    durante a decodificação, sem cópias intermediárias da pilha inteira. Com
+    decimation > 1 os frames em cinza passam pelo anti-aliasing temporal
+    (TemporalDecimator) durante a leitura e só 1 a cada `decimation` é guardado.
+        Parâmetros:
+        - video_path: caminho do arquivo de vídeo
+        - max_frames: número máximo de frames (None = todos)
+        - target_size: (largura, altura) máxima de trabalho; frames maiores são
+          redimensionados (None = resolução nativa)
+        - dtype: np.float32 (normalizado [0, 1]) ou np.uint8 (valores brutos)
+        - keep_bgr: mantém também a pilha BGR (apenas se o modo de renderização precisar)
+        - on_disk: grava as pilhas em FrameStore (memmap) em vez de RAM
+        - progress_bar: barra de progresso do Streamlit (opcional)
+        - decimation: fator de decimação temporal (1 = todos os frames; ver
+          evm.filters.decimation_factor)
+        - decimation_method: 'fir' ou 'mean' (ver TemporalDecimator)
+        - decimation_margin: margem usada no fator; define a banda passante
+          do FIR (plana até a nova Nyquist / margem)
+
+        Retorna:
+        - frames_gray: array (T, H, W) no dtype pedido (FrameStore se on_disk)
+        - frames_bgr: array (T, H, W, 3) uint8, ou None se keep_bgr=False
+          (com decimação, o frame de entrada alinhado a cada frame de saída)
+        - fps: taxa de quadros por segundo (efetiva: fps do vídeo / decimation)
+    """
+    cap, fps, frame_count = open_video(video_path)
+    decimation = int(decimation)
+    decimator = TemporalDecimator(decimation, decimation_method, decimation_margin) if decimation > 1 else None
+    expected = _expected_frames(frame_count, max_frames, decimation)
+    max_out = None if max_frames is None else -(-max_frames // decimation)
+
+    frames_gray = None
+    frames_bgr = None
+    n = 0
+    n_in = 0
+
+    def ensure_capacity(stack, index):
+        # Contagem do container subestimada: dobra a capacidade
+        if index < stack.shape[0]:
+            return stack
+        capacity = 2 * index if max_out is None else min(2 * index, max_out)
+        return _grow_buffer(stack, capacity)
+
+    for frame in iter_video_frames(cap, max_frames):
+        if target_size is not None:
+            H0, W0 = frame.shape[:2]
+            target_width, target_height = target_size
+            if W0 > target_width or H0 > target_height:
+                frame = cv2.resize(frame, (target_width, target_height), interpolation=cv2.INTER_AREA)
+
+        if frames_gray is None:
+            H, W = frame.shape[:2]
+            frames_gray = allocate_frames((expected, H, W), dtype, on_disk=on_disk)
+            if keep_bgr:
+                frames_bgr = allocate_frames((expected, H, W, 3), np.uint8, on_disk=on_disk)
+
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        if keep_bgr and n_in % decimation == 0:
+            frames_bgr = ensure_capacity(frames_bgr, n_in // decimation)
+            frames_bgr[n_in // decimation] = frame
+        for out in ([gray] if decimator is None else decimator.push(gray)):
+            frames_gray = ensure_capacity(frames_gray, n)
+            _store_gray(frames_gray, n, out, dtype)
+            n += 1
+        n_in += 1
+
+        if progress_bar is not None and frame_count > 0:
+            progress_bar.progress(min(n_in / (expected * decimation), 1.0))
+
+    if decimator is not None:
+        for out in decimator.flush():
+            frames_gray = ensure_capacity(frames_gray, n)
+            _store_gray(frames_gray, n, out, dtype)
+            n += 1
+
+    if n == 0:
+        raise ValueError("Não foi possível ler frames do vídeo.")
+
+    frames_gray = _truncate_frames(frames_gray, n)
+    if keep_bgr:
+        frames_bgr = _truncate_frames(frames_bgr, n)
+    return frames_gray, frames_bgr, fps / decimation
+
+
+
+def _resize_to_target(frame, target_size):
+    """Reduz o frame para target_size se ele for maior (como em read_video_stack)."""
+    if target_size is not None:
+        H0, W0 = frame.shape[:2]
+        if W0 > target_size[0] or H0 > target_size[1]:
+            frame = cv2.resize(frame, tuple(target_size), interpolation=cv2.INTER_AREA)
+    return frame
+
+
+def iter_gray_frames(video_path, max_frames=None, target_size=None, decimation=1, decimation_method='fir',
+                     decimation_margin=2.0):
+    """
+    Gerador de frames em cinza float32 [0, 1] decodificados em streaming (mesmo
+    redimensionamento e decimação de read_video_stack), sem manter a pilha em
+    memória.
+    """
+    cap, _, _ = open_video(video_path)
+    grays = (
+        cv2.cvtColor(_resize_to_target(frame, target_size), cv2.COLOR_BGR2GRAY)
+        for frame in iter_video_frames(cap, max_frames)
+    )
+    for gray in iter_decimated(grays, int(decimation), decimation_method, decimation_margin):
+        yield gray.astype(np.float32) / 255.0
+
+
+def read_video_crops(video_path, boxes, max_frames=None, target_size=None, dtype=np.float32,
+                     on_disk=False, progress_bar=None, decimation=1, decimation_method='fir',
+                     decimation_margin=2.0):
+    """
+    Lê o vídeo em streaming guardando apenas os recortes pedidos, cada um em sua
+    própria pilha em cinza: a memória e as etapas seguintes escalam com a área
+    dos recortes, não com a do sensor.
+        Parâmetros:
+        - video_path: caminho do arquivo de vídeo
+        - boxes: lista de (x0, y0, x1, y1) nas coordenadas de trabalho
+          (após target_size)
+        - max_frames, target_size, dtype, on_disk, progress_bar, decimation,
+          decimation_method, decimation_margin: como em read_video_stack (um
+          decimador por recorte)
+
+        Retorna:
+        - crops: lista de pilhas (T, y1 - y0, x1 - x0), uma por recorte
+        - fps: taxa de quadros por segundo (efetiva: fps do vídeo / decimation)
+        - frame_size: (largura, altura) de trabalho do quadro inteiro
+    """
+    cap, fps, frame_count = open_video(video_path)
+    decimation = int(decimation)
+    decimators = [
+        TemporalDecimator(decimation, decimation_method, decimation_margin) if decimation > 1 else None
+        for _ in boxes
+    ]
+    expected = _expected_frames(frame_count, max_frames, decimation)
+    max_out = None if max_frames is None else -(-max_frames // decimation)
+    total_in = expected * decimation
+
+    crops = [allocate_frames((expected, y1 - y0, x1 - x0), dtype, on_disk=on_disk) for x0, y0, x1, y1 in boxes]
+    frame_size = None
+    n = 0
+    n_in = 0
+
+    def store(outputs):
+        # Os decimadores avançam juntos: cada chamada emite o mesmo número de frames por recorte
+        nonlocal crops, expected, n
+        for k in range(len(outputs[0])):
+            if n == expected:
+                # Contagem do container subestimada: dobra a capacidade
+                expected = 2 * n if max_out is None else min(2 * n, max_out)
+                crops = [_grow_buffer(crop, expected) for crop in crops]
+            for crop, out in zip(crops, outputs):
+                _store_gray(crop, n, out[k], dtype)
+            n += 1
+
+    for frame in iter_video_frames(cap, max_frames):
+        frame = _resize_to_target(frame, target_size)
+        if frame_size is None:
+            frame_size = (frame.shape[1], frame.shape[0])
+
+        outputs = []
+        for decimator, (x0, y0, x1, y1) in zip(decimators, boxes):
+            gray = cv2.cvtColor(frame[y0:y1, x0:x1], cv2.COLOR_BGR2GRAY)
+            outputs.append([gray] if decimator is None else decimator.push(gray))
+        if outputs:
+            store(outputs)
+        n_in += 1
+
+        if progress_bar is not None and frame_count > 0:
+            progress_bar.progress(min(n_in / total_in, 1.0))
+
+    if decimation > 1 and boxes:
+        store([decimator.flush() for decimator in decimators])
+
+    if n_in == 0:
+        raise ValueError("Não foi possível ler frames do vídeo.")
+    return [_truncate_frames(crop, n) for crop in crops], fps / decimation, frame_size
+
+def read_video(video_path, max_frames=None):
+    """
+    Lê vídeo e retorna array de frames.
+        Parâmetros:
+        - video_path: caminho do arquivo de vídeo
+        - max_frames: número máximo de frames (None = todos)
+        
+        Retorna:
+        - frames: array (T, H, W, C)
+        - fps: taxa de quadros por segundo
+    """
+    _, frames, fps = read_video_stack(video_path, max_frames=max_frames, dtype=np.uint8, keep_bgr=True)
+    return frames, fps
+
+
+# Codecs testados em ordem na abertura do writer: (fourcc, extensão, mime)
+VIDEO_CODECS = [('MJPG', '.avi', 'video/x-msvideo'), ('mp4v', '.mp4', 'video/mp4')]
+
+
+class StreamingVideoWriter:
+    """
+    Escritor de vídeo em streaming: os frames são enviados por uma fila limitada
+    e codificados em uma thread de fundo, sobrepondo renderização e codificação
+    sem manter a pilha de saída inteira em memória.
+    O codec é escolhido uma única vez, na abertura (primeiro de VIDEO_CODECS
+    que o OpenCV consegue abrir).
+        Parâmetros:
+        - fps: taxa de quadros
+        - frame_size: (largura, altura) dos frames
+        - output_path: caminho de saída (None = arquivo temporário da sessão);
+          a extensão é ajustada ao codec escolhido
+        - queue_size: número máximo de frames aguardando codificação
+    """
+
+    def __init__(self, fps, frame_size, output_path=None, queue_size=32):
+        if not output_path:
+            output_path = os.path.join(get_scratch_dir(), f"output_{uuid.uuid4().hex}.avi")
+        else:
+            output_path = os.path.abspath(output_path)
+        self.frame_size = tuple(int(v) for v in frame_size)
+        self.path = None
+        self.mime = None
+        self._writer = None
+        for codec, ext, mime in VIDEO_CODECS:
+            path = os.path.splitext(output_path)[0] + ext
+            writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*codec), fps, self.frame_size)
+            if writer.isOpened():
+                self.path, self.mime, self._writer = path, mime, writer
+                break
+            writer.release()
+        if self._writer is None:
+            raise RuntimeError(f"Não foi possível abrir o arquivo de vídeo para escrita: {output_path}. Verifique permissões e codecs disponíveis.")
+
+        self.frames_written = 0
+        self._error = None
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = threading.Thread(target=self._encode_loop, daemon=True)
+        self._thread.start()
+
+    def _encode_loop(self):
+        while True:
+            frame = self._queue.get()
+            if frame is None:
+                break
+            # Depois de um erro a fila continua sendo esvaziada, para que
+            # write() e close() nunca fiquem bloqueados
+            if self._error is not None:
+                continue
+            try:
+                self._writer.write(frame)
+                self.frames_written += 1
+            except Exception as e:
+                self._error = e
+
+    def _put(self, item):
+        """Enfileira sem bloquear indefinidamente se a thread de codificação terminou."""
+        while True:
+            if not self._thread.is_alive():
+                raise RuntimeError(f"Erro ao codificar vídeo: {self._error or 'thread de codificação encerrada'}")
+            try:
+                self._queue.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                pass
+
+    def write(self, frame):
+        """
+        Enfileira um frame BGR (H, W, 3) para codificação. O frame não deve ser
+        modificado depois de enviado. Bloqueia se a fila estiver cheia.
+        """
+        if self._error is not None:
+            raise RuntimeError(f"Erro ao codificar vídeo: {self._error}")
+        frame_np = np.asarray(frame)
+        if frame_np.ndim != 3 or frame_np.shape[2] != 3:
+            raise ValueError("Frame deve ter 3 canais (BGR)")
+        if (frame_np.shape[1], frame_np.shape[0]) != self.frame_size:
+            raise ValueError(f"Frame {frame_np.shape[1]}x{frame_np.shape[0]} difere do tamanho do vídeo {self.frame_size[0]}x{self.frame_size[1]}")
+        if frame_np.dtype != np.uint8:
+            frame_np = np.clip(frame_np, 0, 255).astype(np.uint8)
+        self._put(frame_np)
+
+    def close(self):
+        """Aguarda a codificação dos frames pendentes, fecha o arquivo e retorna o caminho."""
+        if self._writer is not None:
+            try:
+                self._put(None)
+                self._thread.join()
+            except RuntimeError:
+                self._error = self._error or 'thread de codificação encerrada'
+            finally:
+                self._writer.release()
+                self._writer = None
+        if self._error is not None:
+            raise RuntimeError(f"Erro ao codificar vídeo: {self._error}")
+        return self.path
+
+    def read_bytes(self):
+        """Conteúdo do vídeo finalizado (para st.download_button)."""
+        with open(self.close(), 'rb') as f:
+            return f.read()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def write_video(output_path, frames, fps):
+    """
+    Escreve vídeo a partir de array (ou iterável) de frames.
+        Parâmetros:
+        - output_path: caminho de saída (vazio = arquivo temporário da sessão)
+        - frames: array (T, H, W, 3) BGR, ou iterável de frames (H, W, 3)
+        - fps: taxa de quadros
+
+        Retorna:
+        - caminho do arquivo gravado (extensão conforme o codec escolhido)
+    """
+    writer = None
+    try:
+        for frame in frames:
+            if writer is None:
+                H, W = np.asarray(frame).shape[:2]
+                writer = StreamingVideoWriter(fps, (W, H), output_path)
+            writer.write(frame)
+    finally:
+        if writer is not None:
+            writer.close()
+    if writer is None:
+        raise ValueError("Nenhum frame para gravar.")
+    return writer.path
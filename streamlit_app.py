@@ -1,332 +1,121 @@
 import os
-os.environ["TEMP"] = "F:\\Temp"
-os.environ["TMP"] = "F:\\Temp"
-
 import streamlit as st
-from streamlit_drawable_canvas import st_canvas
 import numpy as np
 import cv2
-from scipy import signal
-import pandas as pd
-import matplotlib.pyplot as plt
-from matplotlib import cm
-import io
-from PIL import Image
 import tempfile
-import os
+import json
+import hashlib
+import time
 import uuid
-import atexit
+import warnings
+
+from evm import (
+    CACHE_DIR,
+    Profiler,
+    ThrottledProgress,
+    VIDEO_CODECS,
+    StageCache,
+    HeatmapRenderer,
+    apply_bandpass_filter,
+    apply_colormap_lut,
+    TimeSeriesWriter,
+    causal_bandpass_rms,
+    coarse_to_fine_rms,
+    composite_rms,
+    composite_tensor_field,
+    compute_rms_map,
+    decimation_factor,
+    default_memory_budget,
+    describe_plan,
+    fft_bandpass_filter,
+    get_job_manager,
+    get_scratch_dir,
+    iter_causal_bandpass,
+    iter_composite_filtered,
+    iter_gray_frames,
+    iter_live_heatmap,
+    iter_laplacian_reconstruction,
+    laplacian_evm,
+    load_params,
+    map_image16_bytes,
+    normalize_map,
+    npy_bytes,
+    npz_bytes,
+    parse_bands,
+    parse_rois,
+    plan_processing,
+    principal_tensor_field,
+    process_rois,
+    read_video_crops,
+    read_video_stack,
+    roi_area_fraction,
+    roi_coverage,
+    scale_rois,
+    stabilize_video,
+    StreamingVideoWriter,
+    sweep_bandpass_rms,
+    sweep_grid,
+    sweep_npz_bytes,
+    sweep_summary,
+    variant_label,
+)
+from evm.incremental import INCREMENTAL_STAGES, STAGE_LABELS, changed_params, invalidated_stages
+from evm.pipeline import _stabilization_key, probe_video
+from evm.profiling import annotate, stage as profile_stage
 st.set_page_config(page_title="EVM - Análise de Tensões Residuais", page_icon="🔬", layout="wide")
+
+
 # =====================================================
-# FUNÇÕES DE PROCESSAMENTO
+# INTERFACE STREAMLIT
 # =====================================================
-
-def principal_tensor_vectors(heatmap):
-    """
-    Calcula o maior vetor próprio do tensor de deformação (gradiente) para cada pixel.
-    Retorna:
-        eigvals: autovalor máximo (H, W)
-        eigvecs: vetor próprio correspondente (H, W, 2)
-    """
-    # Garante float32 para compatibilidade com np.linalg
-    heatmap = heatmap.astype(np.float32)
-    grad_x = np.gradient(heatmap, axis=1)
-    grad_y = np.gradient(heatmap, axis=0)
-    H, W = heatmap.shape
-    eigvals = np.zeros((H, W), dtype=np.float32)
-    eigvecs = np.zeros((H, W, 2), dtype=np.float32)
-    for y in range(H):
-        for x in range(W):
-            # Tensor de deformação simétrico 2x2
-            J = np.array([
-                [grad_x[y, x], 0.5 * (grad_y[y, x] + grad_x[y, x])],
-                [0.5 * (grad_y[y, x] + grad_x[y, x]), grad_y[y, x]]
-            ], dtype=np.float32)
-            vals, vecs = np.linalg.eigh(J)
-            idx = np.argmax(np.abs(vals))
-            eigvals[y, x] = vals[idx]
-            eigvecs[y, x] = vecs[:, idx]
-    return eigvals, eigvecs
-
-def stabilize_video(frames, progress_bar=None):
-    """
-    Estabiliza sequência de frames usando detecção de features ORB.
-    Remove movimento de câmera indesejado.
-        Parâmetros:
-        - frames: array (T, H, W) de frames em escala de cinza
-        - progress_bar: barra de progresso do Streamlit (opcional)
-        
-        Retorna:
-        - frames_stabilized: array estabilizado
-    """
-    T, H, W = frames.shape
-    frames_stabilized = np.zeros_like(frames)
-    
-    # Frame de referência (primeiro frame)
-    frames_stabilized[0] = frames[0]
-    reference_frame = frames[0].astype(np.uint8)
-    
-    # Detector ORB
-    orb = cv2.ORB_create(nfeatures=500)
-    
-    # Detecta keypoints e descritores no frame de referência
-    kp_ref, des_ref = orb.detectAndCompute(reference_frame, None)
-    
-    if des_ref is None or len(kp_ref) < 10:
-        st.warning("⚠️ Poucos features detectados. Usando frames originais.")
-        return frames
-    
-    # Matcher
-    bf = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True)
-    
-    for i in range(1, T):
-        current_frame = frames[i].astype(np.uint8)
-        
-        # Detecta keypoints no frame atual
-        kp_curr, des_curr = orb.detectAndCompute(current_frame, None)
-        
-        if des_curr is None or len(kp_curr) < 10:
-            # Se falhar, usa frame original
-            frames_stabilized[i] = frames[i]
-            continue
-        
-        # Matching
+def show_warning(message, category, filename, lineno, file=None, line=None):
+    """Exibe na interface os avisos emitidos pelo núcleo de processamento."""
+    st.warning(str(message))
+
+
+def rois_from_canvas(json_data, scale):
+    """Converte retângulos e polígonos desenhados no canvas em ROIs nas coordenadas do vídeo."""
+    rois = []
+    for obj in (json_data or {}).get('objects', []):
+        if obj.get('type') == 'rect':
+            x0, y0 = obj['left'], obj['top']
+            x1 = x0 + obj['width'] * obj.get('scaleX', 1)
+            y1 = y0 + obj['height'] * obj.get('scaleY', 1)
+            rois.append([x0 * scale, y0 * scale, x1 * scale, y1 * scale])
+        elif obj.get('type') == 'path':
+            points = [[cmd[1] * scale, cmd[2] * scale] for cmd in obj.get('path', []) if len(cmd) >= 3]
+            if len(points) >= 3:
+                rois.append(points)
+    return rois
+
+
+def discard_scratch_video(path):
+    """Remove um vídeo de saída gerado no diretório de trabalho da sessão (ignora outros caminhos)."""
+    if path and os.path.dirname(os.path.abspath(path)) == get_scratch_dir():
         try:
-            matches = bf.match(des_ref, des_curr)
-            matches = sorted(matches, key=lambda x: x.distance)
-            
-            if len(matches) >= 10:
-                # Extrai pontos correspondentes
-                src_pts = np.float32([kp_ref[m.queryIdx].pt for m in matches[:50]]).reshape(-1, 1, 2)
-                dst_pts = np.float32([kp_curr[m.trainIdx].pt for m in matches[:50]]).reshape(-1, 1, 2)
-                
-                # Estima transformação afim
-                M, mask = cv2.estimateAffinePartial2D(dst_pts, src_pts)
-                
-                if M is not None:
-                    # Aplica transformação para estabilizar
-                    stabilized = cv2.warpAffine(current_frame, M, (W, H))
-                    frames_stabilized[i] = stabilized
-                else:
-                    frames_stabilized[i] = frames[i]
-            else:
-                frames_stabilized[i] = frames[i]
-        except:
-            frames_stabilized[i] = frames[i]
-        
-        # Atualiza barra de progresso
-        if progress_bar is not None:
-            progress_bar.progress((i + 1) / T)
-    
-    return frames_stabilized
-
-
-
-def read_video(video_path, max_frames=None):
-    """
-    Lê vídeo e retorna array de frames.
-        Parâmetros:
-        - video_path: caminho do arquivo de vídeo
-        - max_frames: número máximo de frames (None = todos)
-        
-        Retorna:
-        - frames: array (T, H, W, C)
-        - fps: taxa de quadros por segundo
-    """
-    cap = cv2.VideoCapture(video_path)
-    
-    fps = cap.get(cv2.CAP_PROP_FPS)
-    if fps <= 0 or fps > 1000:
-        st.warning(f"⚠️ FPS inválido detectado ({fps}). Usando 30 FPS como padrão.")
-        fps = 30.0
-    
-    frames = []
-    count = 0
-    
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            break
-        
-        frames.append(frame)
-        count += 1
-        
-        if max_frames is not None and count >= max_frames:
-            break
-    
-    cap.release()
-    
-    if len(frames) == 0:
-        raise ValueError("Não foi possível ler frames do vídeo.")
-    
-    return np.array(frames), fps
-
-
-
-def apply_bandpass_filter(frames_gray, fps, f_low, f_high, order=5, progress_bar=None):
-    """
-    Aplica filtro passa-banda temporal Butterworth.
-        Parâmetros:
-        - frames_gray: array (T, H, W) normalizado [0, 1]
-        - fps: taxa de quadros
-        - f_low: frequência baixa (Hz)
-        - f_high: frequência alta (Hz)
-        - order: ordem do filtro
-        
-        Retorna:
-        - filtered: array filtrado (T, H, W)
-    """
-    nyquist = fps / 2.0
-    
-    if f_high >= nyquist:
-        raise ValueError(f"f_high ({f_high} Hz) deve ser menor que a frequência de Nyquist ({nyquist} Hz).")
-    
-    # Normaliza frequências
-    low = f_low / nyquist
-    high = f_high / nyquist
-    
-    # Cria filtro Butterworth
-    sos = signal.butter(order, [low, high], btype='band', output='sos')
-    
-    T, H, W = frames_gray.shape
-    filtered = np.zeros_like(frames_gray)
-
-    # Aplica filtro por linha (otimização) e atualiza barra de progresso
-    for y in range(H):
-        # Processa todos os pixels da linha de uma vez (mais rápido)
-        pixel_signals = frames_gray[:, y, :]
-        filtered[:, y, :] = signal.sosfiltfilt(sos, pixel_signals, axis=0)
-        # Atualiza barra de progresso
-        if progress_bar is not None:
-            progress_bar.progress((y + 1) / H)
-    return filtered
-
-
-
-def compute_rms_map(filtered_frames):
-    """
-    Calcula mapa RMS (Root Mean Square) ao longo do tempo.
-        Parâmetros:
-        - filtered_frames: array (T, H, W)
-        
-        Retorna:
-        - rms_map: array (H, W)
-    """
-    # Converte para float16 para economizar memória
-    filtered_frames = filtered_frames.astype(np.float16)
-    rms_map = np.sqrt(np.mean(filtered_frames ** 2, axis=0))
-    return rms_map
-
-
-
-def normalize_map(rms_map, p_low=5, p_high=95):
-    """
-    Normaliza mapa por percentis.
-    Retorna array normalizado [0, 1].
-    """
-    p5 = np.percentile(rms_map, p_low)
-    p95 = np.percentile(rms_map, p_high)
-    denom = p95 - p5
-    # Se p5 == p95 ou denom ~ 0, normaliza pelo valor máximo
-    if np.isclose(denom, 0) or not np.isfinite(denom):
-        max_val = np.max(rms_map)
-        if max_val > 0:
-            normalized = rms_map / max_val
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def describe_job(job):
+    """Linha de estado de um job da fila (ver evm.jobs)."""
+    title = f"**{job['label']}** · `{job['id']}`"
+    if job['status'] == 'queued':
+        return f"{title} — ⏳ na fila (posição {job['queue_position']})"
+    if job['status'] == 'running':
+        if job['stage']:
+            current = f"etapa \"{job['stage']}\""
         else:
-            normalized = np.zeros_like(rms_map)
-    else:
-        normalized = (rms_map - p5) / denom
-        normalized = np.clip(normalized, 0, 1)
-        normalized = np.nan_to_num(normalized, nan=0.0, posinf=1.0, neginf=0.0)
-    return normalized
-
-
-
-def create_heatmap_overlay(frame_bgr, heatmap_normalized, colormap_name='inferno', alpha=0.5):
-    """
-    Cria overlay do heatmap sobre o frame original.
-        Parâmetros:
-        - frame_bgr: frame original BGR (H, W, 3)
-        - heatmap_normalized: mapa normalizado [0, 1] (H, W)
-        - colormap_name: nome do colormap matplotlib
-        - alpha: opacidade do overlay [0, 1]
-        
-        Retorna:
-        - overlay: frame com heatmap sobreposto (H, W, 3)
-    """
-    # Garante que alpha está entre 0 e 1
-    alpha = np.clip(alpha, 0, 1)
-
-    # Aplica colormap (compatível com Matplotlib <3.7 e >=3.7)
-    cmap = cm.get_cmap(colormap_name)
-    heatmap_colored = cmap(heatmap_normalized)[:, :, :3]  # RGB
-    heatmap_colored = (heatmap_colored * 255).astype(np.uint8)
-
-    # Converte para BGR
-    heatmap_bgr = cv2.cvtColor(heatmap_colored, cv2.COLOR_RGB2BGR)
-
-    # Garante que ambos são uint8
-    if not np.issubdtype(frame_bgr.dtype, np.uint8):
-        frame_bgr = np.clip(frame_bgr * 255, 0, 255).astype(np.uint8)
-    if not np.issubdtype(heatmap_bgr.dtype, np.uint8):
-        heatmap_bgr = np.clip(heatmap_bgr * 255, 0, 255).astype(np.uint8)
-
-    # Blend
-    overlay = cv2.addWeighted(frame_bgr, 1 - alpha, heatmap_bgr, alpha, 0)
-    return overlay
-
-
-
-def write_video(output_path, frames, fps):
-    """
-    Escreve vídeo a partir de array de frames.
-        Parâmetros:
-        - output_path: caminho de saída
-        - frames: array (T, H, W, 3) BGR
-        - fps: taxa de quadros
-    """
-    T, H, W, C = frames.shape
-
-    # Se output_path for vazio, salva na pasta do projeto
-    if not output_path:
-        output_path = os.path.join(os.getcwd(), 'output_final.avi')
-    else:
-        output_path = os.path.abspath(output_path)
-
-    # Tenta MJPG primeiro, depois mp4v
-    codecs = [('MJPG', '.avi'), ('mp4v', '.mp4')]
-    last_error = None
-    for codec, ext in codecs:
-        test_path = os.path.splitext(output_path)[0] + ext
-        fourcc = cv2.VideoWriter_fourcc(*codec)
-        try:
-            # Log de debug
-            print(f"[DEBUG] Salvando vídeo em {test_path} com codec {codec}")
-            print(f"[DEBUG] Frame shape: {frames[0].shape}, dtype: {frames[0].dtype}")
-            out = cv2.VideoWriter(test_path, fourcc, fps, (W, H))
-            if not out.isOpened():
-                raise RuntimeError(f"Não foi possível abrir o arquivo de vídeo para escrita: {test_path}. Verifique permissões, codecs e formato dos frames.")
-
-            for frame in frames:
-                # Garante formato uint8 e BGR e que frame é array numpy
-                frame_np = np.asarray(frame)
-                if frame_np.dtype != np.uint8:
-                    frame_np = np.clip(frame_np, 0, 255).astype(np.uint8)
-                if frame_np.shape[2] != 3:
-                    raise ValueError("Frame deve ter 3 canais (BGR)")
-                out.write(frame_np)
-            out.release()
-            return test_path
-        except Exception as e:
-            last_error = e
-            continue
-    raise RuntimeError(f"Erro ao tentar salvar o vídeo. Último erro: {last_error}")
-
+            current = "entre etapas" if job['stages_done'] else "iniciando"
+        return f"{title} — ⚙️ em execução: {current} ({len(job['stages_done'])} etapa(s) concluída(s), {time.time() - job['started']:.0f} s)"
+    if job['status'] == 'done':
+        return f"{title} — ✅ concluído em {job['finished'] - job['started']:.1f} s"
+    if job['status'] == 'cancelled':
+        return f"{title} — ✖️ cancelado"
+    return f"{title} — ❌ {job['error']}"
 
 
-# =====================================================
-# INTERFACE STREAMLIT
-# =====================================================
 st.title("🔬 Análise de Tensões via EVM")
 st.markdown("### Eulerian Video Magnification para Resposta Vibracional")
 # Aviso crítico
@@ -355,6 +144,34 @@ enable_stabilization = st.sidebar.checkbox(
 value=True,
 help="Remove movimento de câmera antes do processamento EVM. Recomendado para vídeos capturados sem tripé."
 )
+stabilization_method = st.sidebar.selectbox(
+    "Método de estabilização",
+    options=["LK piramidal (rápido)", "ORB (referência)"],
+    index=0,
+    disabled=not enable_stabilization,
+    help="LK rastreia um conjunto fixo de features com fluxo óptico em uma versão reduzida dos frames. ORB detecta e casa features em cada frame na resolução de trabalho (mais lento, mantido para comparação)."
+)
+use_decimation = st.sidebar.checkbox(
+    "Decimação temporal pela banda (FPS alto)",
+    value=False,
+    help="Reduz a taxa de quadros já na leitura, com anti-aliasing temporal, para a menor taxa cuja Nyquist fica acima da banda analisada com a margem escolhida. Ex.: 240 FPS analisados em 1-5 Hz com margem 2 viram 20 FPS (12x menos frames em todas as etapas)."
+)
+decimation_margin = st.sidebar.number_input(
+    "Margem da decimação (Nyquist / f_high)",
+    min_value=1.25,
+    max_value=10.0,
+    value=2.0,
+    step=0.05,
+    disabled=not use_decimation,
+    help="A nova frequência de Nyquist fica pelo menos esta vezes acima da maior f_high (banda principal e varredura). A transição do filtro anti-aliasing ocupa essa folga: margens menores mantêm mais frames, mas exigem um FIR mais longo (decodificação mais lenta)."
+)
+decimation_method = 'mean' if st.sidebar.selectbox(
+    "Anti-aliasing da decimação",
+    options=["FIR passa-baixas", "Média por bloco (mais rápido)"],
+    index=0,
+    disabled=not use_decimation,
+    help="FIR: banda plana (erro < 1%) até f_high e rejeição de 50 dB a partir da nova Nyquist, com qualquer margem. Média: atenua o topo da banda (~10% na margem 2) e rejeita menos o aliasing."
+).startswith("Média") else 'fir'
 # Parâmetros EVM
 st.sidebar.markdown("### 🔧 Parâmetros EVM")
 f_low = st.sidebar.number_input(
@@ -387,6 +204,64 @@ max_value=10,
 value=5,
 help="Ordem do filtro Butterworth"
 )
+filter_mode = st.sidebar.selectbox(
+    "Modo do filtro temporal",
+    options=["Fase zero (sosfiltfilt)", "Causal em blocos (streaming)", "FFT ideal (lote)"],
+    index=0,
+    help="Fase zero exige a pilha inteira em memória. O modo causal processa blocos de frames carregando o estado do filtro, com memória constante (resposta |H| em vez de |H|², com atraso de fase). O modo FFT aplica uma máscara ideal no espectro, calcula o RMS por Parseval e gera mapas de frequência dominante e potência na banda."
+)
+filter_key = {"Causal em blocos (streaming)": 'causal', "FFT ideal (lote)": 'fft'}.get(filter_mode, 'zero_phase')
+if filter_mode == "Causal em blocos (streaming)":
+    warmup_frames = st.sidebar.number_input(
+        "Frames de aquecimento descartados",
+        min_value=0,
+        max_value=1000,
+        value=30,
+        step=5,
+        help="Frames iniciais ignorados no RMS enquanto o transiente do filtro causal se dissipa"
+    )
+else:
+    warmup_frames = 0
+use_multires = filter_mode == "Fase zero (sosfiltfilt)" and st.sidebar.checkbox(
+    "Análise multirresolução (grosso → fino)",
+    value=False,
+    help="Calcula o RMS em um nível grosso da pirâmide Gaussiana e filtra na resolução de trabalho apenas as regiões quentes (dilatadas). Fora delas o mapa é o RMS grosso interpolado. O overlay do vídeo é gerado com o filtro causal em streaming."
+)
+if use_multires:
+    coarse_levels = st.sidebar.slider(
+        "Reduções do nível grosso",
+        min_value=1,
+        max_value=4,
+        value=2,
+        help="Cada redução divide largura e altura por 2 (2 = 1/16 dos pixels)"
+    )
+    hot_percentile = st.sidebar.slider(
+        "Percentil das regiões refinadas",
+        min_value=50,
+        max_value=99,
+        value=90,
+        help="Pixels do mapa grosso acima deste percentil (e sua vizinhança) são refinados na resolução de trabalho"
+    )
+else:
+    coarse_levels, hot_percentile = 2, 90
+use_sweep = st.sidebar.checkbox(
+    "Varredura de bandas e ordens",
+    value=False,
+    help="Calcula mapas RMS para várias bandas/ordens a partir da mesma pilha lida e estabilizada (uma única leitura e estabilização), além da banda principal"
+)
+if use_sweep:
+    sweep_bands_text = st.sidebar.text_input(
+        "Bandas da varredura (Hz)",
+        value="0.5-3, 3-6, 6-10",
+        help="Lista f_low-f_high separada por vírgulas"
+    )
+    sweep_orders_text = st.sidebar.text_input(
+        "Ordens da varredura",
+        value=str(filter_order),
+        help="Ordens do Butterworth separadas por vírgulas (ignoradas no modo FFT)"
+    )
+else:
+    sweep_bands_text, sweep_orders_text = "", ""
 st.sidebar.markdown("### 📊 Normalização")
 p_low = st.sidebar.slider(
 "Percentil baixo",
@@ -438,9 +313,11 @@ if output_mode == "Heatmap RMS":
         help="Multiplica o mapa RMS para realçar diferenças visuais.",
         key="visual_gain"
     )
-
-    # Garante que output_frames está definido antes do uso
-    output_frames = None
+    export_series = st.sidebar.checkbox(
+        "Gravar série temporal filtrada (NPZ)",
+        value=False,
+        help="Grava os frames filtrados em blocos comprimidos durante a renderização, para análise modal offline (download após o processamento)"
+    )
 
     # LOGS DETALHADOS PARA DEBUG
     # debug_var('heatmap_map', heatmap_map)  # Só pode ser chamado após definição de heatmap_map
@@ -458,11 +335,18 @@ else:
     colormap_name = None
     overlay_alpha = None
     visual_gain = 1.0
+    export_series = False
     vmin = None
     vmax = None
 
-# ROI desenhável REMOVIDO
-# ...remover todas as variáveis, widgets e lógica relacionadas a ROI, canvas, frame_for_canvas, x0, y0, x1, y1, roi_xmin, roi_xmax, roi_ymin, roi_ymax, use_roi, etc...
+# Regiões de interesse: retângulos/polígonos em JSON (e desenhados no canvas, se disponível)
+st.sidebar.markdown("### 🎯 Regiões de Interesse")
+roi_text = st.sidebar.text_area(
+    "ROIs (JSON, pixels do vídeo original)",
+    value="",
+    placeholder="[[100, 50, 400, 300], [[500, 100], [600, 100], [550, 200]]]",
+    help="Lista de retângulos [x0, y0, x1, y1] e/ou polígonos [[x, y], ...]. Vazio = quadro inteiro. Apenas as ROIs são lidas, estabilizadas, filtradas e reduzidas ao RMS (em paralelo), e o mapa é composto no quadro inteiro. Usado no modo Heatmap RMS."
+)
 
 # =====================================================
 # UPLOAD E PROCESSAMENTO
@@ -475,21 +359,96 @@ type=['mp4', 'avi', 'mov'],
 help="Selecione o arquivo de vídeo para análise"
 )
 
-# ROI desenhável REMOVIDO (não há mais seleção/desenho de ROI)
-
 # Performance
 st.sidebar.markdown("### ⚡ Performance")
+# Padrão medido uma vez por sessão: um valor padrão diferente a cada execução
+# recriaria o widget (e invalidaria os resultados guardados)
+default_budget_mb = st.session_state.get('default_memory_budget_mb')
+if default_budget_mb is None:
+    default_budget_mb = max(256, default_memory_budget() // 1024 ** 2 // 256 * 256)
+    st.session_state['default_memory_budget_mb'] = default_budget_mb
+memory_budget_mb = st.sidebar.number_input(
+    "Orçamento de memória (MB)",
+    min_value=256,
+    max_value=1024 * 1024,
+    value=default_budget_mb,
+    step=256,
+    help="Pico de RAM permitido ao processamento. O padrão é 60% da memória disponível. A resolução e o armazenamento das pilhas são escolhidos para caber neste limite."
+)
+allow_disk_store = st.sidebar.checkbox(
+    "Permitir frames em disco (clipes longos)",
+    value=True,
+    help="Quando as pilhas não cabem no orçamento na resolução nativa, mantém-nas em arquivos mapeados em memória (memmap) no diretório temporário, processadas em blocos, em vez de reduzir a resolução."
+)
 max_frames = st.sidebar.number_input(
     "Máximo de frames para preview",
     min_value=10,
-    max_value=1000,
+    max_value=100000 if allow_disk_store else 1000,
     value=100,
     step=10,
     help="Limita processamento para testes rápidos"
 )
+n_workers = st.sidebar.number_input(
+    "Threads de processamento",
+    min_value=1,
+    max_value=256,
+    value=os.cpu_count() or 1,
+    step=1,
+    help="Número de blocos da imagem filtrados em paralelo. O resultado é idêntico ao processamento serial."
+)
+resolution_mode = st.sidebar.selectbox(
+    "Resolução de trabalho",
+    ["Automática (orçamento de memória)", "Máxima 640x360 (preview rápido)"],
+    index=0,
+    help="Automática: usa a resolução nativa se couber no orçamento de memória (em RAM ou em disco) e só reduz o necessário."
+)
+use_stage_cache = st.sidebar.checkbox(
+    "Cache de etapas em disco",
+    value=True,
+    help="Reutiliza leitura, estabilização, filtragem e RMS de execuções anteriores com o mesmo vídeo e parâmetros. Ao mudar só um parâmetro final, as etapas anteriores não são recalculadas."
+)
+cache_max_mb = st.sidebar.number_input(
+    "Tamanho máximo do cache (MB)",
+    min_value=64,
+    max_value=1024 * 1024,
+    value=4096,
+    step=256,
+    disabled=not use_stage_cache,
+    help=f"Entradas menos usadas recentemente são removidas ao exceder o limite. Diretório: {os.path.join(CACHE_DIR, 'stages')}"
+)
+profile_memory = st.sidebar.checkbox(
+    "Medir memória por etapa",
+    value=False,
+    help="Registra o pico de memória alocada em cada etapa (tracemalloc) na tabela de tempos e no trace exportado. O rastreamento de alocações torna as etapas mais lentas (até ~2x nas etapas com muitos arrays temporários): use apenas para investigar memória."
+)
+use_job_queue = st.sidebar.checkbox(
+    "Processar em segundo plano (fila de jobs)",
+    value=False,
+    help="Envia o processamento a um processo de trabalho da fila local, com limite de jobs simultâneos e de memória compartilhado por todas as sessões (EVM_MAX_JOBS, EVM_JOBS_MAX_MEMORY_MB). A interface continua responsiva, o job pode ser cancelado e o resultado fica no diretório do job."
+)
+if use_stage_cache:
+    with st.sidebar.expander("📦 Estatísticas do cache"):
+        cache_stats = st.session_state.get('stage_cache_stats', {})
+        if cache_stats:
+            import pandas as pd
+            st.table(pd.DataFrame.from_dict(cache_stats, orient='index')[['hits', 'misses']])
+        else:
+            st.caption("Nenhum acesso ao cache nesta sessão.")
+        st.caption(f"Ocupação: {StageCache().size() / 1024 ** 2:.1f} MB")
+        if st.button("🗑️ Limpar cache"):
+            StageCache().clear()
+            st.session_state['stage_cache_stats'] = {}
 if uploaded_file is not None:
-    # Garante que output_frames está definido antes de qualquer uso
-    output_frames = None
+    # Garante que as saídas estão definidas antes de qualquer uso
+    preview_frame = None
+    output_video_path = None
+    fft_result = None
+    series_path = None
+    heatmap_map = None
+    # ROIs do mapa exibido (None = quadro inteiro): tensores e percentis ignoram o exterior
+    heatmap_rois = None
+    tensor_field = None
+    preview_inputs = None
 
     # DEBUG: Log tipos de variáveis críticas
     # def debug_var(name, var):
@@ -504,260 +463,736 @@ if uploaded_file is not None:
     # debug_var('output_mode', output_mode)
     # debug_var('output_frames', output_frames)
     # Salva temporariamente
+    video_bytes = uploaded_file.getvalue()
+    # Hash do conteúdo: chave dos caches persistentes por vídeo
+    video_hash = hashlib.sha256(video_bytes).hexdigest()
     with tempfile.NamedTemporaryFile(delete=False, suffix='.mp4') as tmp_file:
-        tmp_file.write(uploaded_file.read())
+        tmp_file.write(video_bytes)
         video_path = tmp_file.name
     st.success(f"✅ Vídeo carregado: {uploaded_file.name}")
-    
+
+    # ROIs desenhadas sobre o primeiro frame (requer streamlit-drawable-canvas)
+    canvas_rois = []
+    try:
+        from streamlit_drawable_canvas import st_canvas
+    except ImportError:
+        st_canvas = None
+    if st_canvas is not None:
+        with st.expander("🎯 Desenhar ROIs no primeiro frame"):
+            cap = cv2.VideoCapture(video_path)
+            ok, first_frame = cap.read()
+            cap.release()
+            if ok:
+                from PIL import Image
+                canvas_scale = min(1.0, 800 / first_frame.shape[1])
+                canvas_frame = cv2.resize(first_frame, None, fx=canvas_scale, fy=canvas_scale, interpolation=cv2.INTER_AREA)
+                drawing_mode = st.radio(
+                    "Forma", ["rect", "polygon"], horizontal=True,
+                    format_func=lambda mode: "Retângulo" if mode == "rect" else "Polígono (clique direito fecha)"
+                )
+                canvas = st_canvas(
+                    fill_color="rgba(255, 165, 0, 0.2)",
+                    stroke_width=2,
+                    stroke_color="#ffa500",
+                    background_image=Image.fromarray(cv2.cvtColor(canvas_frame, cv2.COLOR_BGR2RGB)),
+                    height=canvas_frame.shape[0],
+                    width=canvas_frame.shape[1],
+                    drawing_mode=drawing_mode,
+                    key="roi_canvas"
+                )
+                canvas_rois = rois_from_canvas(canvas.json_data, 1.0 / canvas_scale)
+
+    try:
+        roi_list = parse_rois((json.loads(roi_text) if roi_text.strip() else []) + canvas_rois)
+    except ValueError as e:
+        st.error(f"❌ ROIs inválidas: {e}")
+        roi_list = []
+    try:
+        sweep_orders = [int(v) for v in sweep_orders_text.replace(';', ',').split(',') if v.strip()]
+        if filter_mode == "FFT ideal (lote)" or not sweep_orders:
+            # O filtro ideal não tem ordem: uma variante por banda
+            sweep_orders = [filter_order]
+        sweep_variants = sweep_grid(parse_bands(sweep_bands_text), sweep_orders)
+    except ValueError as e:
+        st.error(f"❌ Varredura inválida: {e}")
+        sweep_variants = []
+    sweep_results = None
+    use_rois = bool(roi_list) and output_mode == "Heatmap RMS"
+    if roi_list and not use_rois:
+        st.info("ℹ️ As ROIs são usadas apenas no modo Heatmap RMS; o EVM Laplaciano processa o quadro inteiro.")
+    elif use_rois:
+        st.info(f"🎯 {len(roi_list)} ROI(s) definida(s).")
+    if sweep_variants and use_rois:
+        st.info("ℹ️ A varredura usa o quadro inteiro e é ignorada com ROIs.")
+
+    # Parâmetros que afetam os resultados, com os nomes do grafo de dependências
+    # entre etapas (evm/incremental.py)
+    output_key = 'heatmap' if output_mode == "Heatmap RMS" else 'laplacian'
+    ui_params = {
+        'video': video_hash,
+        'max_frames': max_frames,
+        'target_size': resolution_mode,
+        'memory_budget_mb': memory_budget_mb,
+        'on_disk': allow_disk_store,
+        'rois': json.dumps([[list(roi['box']), None if roi['polygon'] is None else roi['polygon'].tolist()] for roi in roi_list]),
+        'decimation': use_decimation,
+        'decimation_margin': decimation_margin,
+        'decimation_method': decimation_method,
+        'stabilize': enable_stabilization,
+        'stabilization_method': stabilization_method,
+        'f_low': f_low,
+        'f_high': f_high,
+        'filter_order': filter_order,
+        'filter_mode': filter_mode,
+        'warmup_frames': warmup_frames,
+        'multiresolution': use_multires,
+        'coarse_levels': coarse_levels,
+        'refine_percentile': hot_percentile,
+        'sweep_bands': sweep_bands_text,
+        'sweep_orders': sweep_orders_text,
+        'output_mode': output_key,
+        'alpha': alpha,
+        'visual_gain': visual_gain,
+        'colormap': colormap_name,
+        'overlay_alpha': overlay_alpha,
+        'p_low': p_low,
+        'p_high': p_high,
+        'export_filtered': export_series,
+    }
+
     # Botão de processar
-    if st.button("▶️ Processar Vídeo", type="primary"):
-        
+    process_clicked = st.button("▶️ Processar Vídeo", type="primary")
+    if process_clicked and use_job_queue:
+        # O pipeline roda em um processo de trabalho da fila; o resultado é lido
+        # do diretório do job na seção Jobs
         try:
-            # Leitura do vídeo
-            st.info("📹 Lendo vídeo...")
-            frames_bgr, fps = read_video(video_path, max_frames=max_frames)
-            T, H, W, C = frames_bgr.shape
-            
-            st.success(f"✅ Vídeo lido: {T} frames, {W}x{H}, {fps:.2f} FPS")
-            
-            # Validação de Nyquist
-            nyquist = fps / 2.0
-            if f_high >= nyquist:
-                st.error(f"❌ Erro: f_high ({f_high} Hz) deve ser menor que FPS/2 ({nyquist:.2f} Hz).")
-                st.stop()
-            
-            # Redimensionamento automático para economizar memória
-            target_width, target_height = 640, 360
-            H0, W0 = frames_bgr[0].shape[:2]
-            if W0 > target_width or H0 > target_height:
-                st.warning(f"🔄 Redimensionando frames para {target_width}x{target_height} para evitar erro de memória.")
-                frames_bgr = np.array([
-                    cv2.resize(f, (target_width, target_height), interpolation=cv2.INTER_AREA)
-                    for f in frames_bgr
-                ])
-            # Conversão para escala de cinza
-            st.info("🎨 Convertendo para escala de cinza...")
-            frames_gray = np.array([cv2.cvtColor(f, cv2.COLOR_BGR2GRAY) for f in frames_bgr])
-            frames_gray = frames_gray.astype(np.float32) / 255.0
-
-            # ROI: recorte dos frames REMOVIDO
-
-            frames_bgr_roi = frames_bgr  # sempre igual ao original
-            
-            # Estabilização (opcional)
-            if enable_stabilization:
-                st.info("🎥 Estabilizando vídeo...")
-                st.write("[LOG] Iniciando estabilização dos frames...")
-                stab_progress = st.progress(0)
-                frames_gray = stabilize_video(frames_gray, stab_progress)
-                st.success("✅ Vídeo estabilizado!")
-                st.write("[LOG] Estabilização concluída.")
+            job_params = load_params(
+                f_low=f_low,
+                f_high=f_high,
+                alpha=alpha,
+                filter_order=filter_order,
+                filter_mode=filter_key,
+                warmup_frames=warmup_frames,
+                multiresolution=use_multires,
+                coarse_levels=coarse_levels,
+                refine_percentile=hot_percentile,
+                stabilize=enable_stabilization,
+                stabilization_method='orb' if stabilization_method.startswith("ORB") else 'lk',
+                max_frames=max_frames,
+                decimation='auto' if use_decimation else None,
+                decimation_margin=decimation_margin,
+                decimation_method=decimation_method,
+                target_size=(640, 360) if resolution_mode.startswith("Máxima") else None,
+                memory_budget_mb=memory_budget_mb,
+                on_disk=None if allow_disk_store else False,
+                p_low=p_low,
+                p_high=p_high,
+                output_mode=output_key,
+                colormap=colormap_name,
+                overlay_alpha=overlay_alpha,
+                visual_gain=visual_gain,
+                export_filtered=export_series,
+                rois=[
+                    list(roi['box']) if roi['polygon'] is None else roi['polygon'].tolist()
+                    for roi in roi_list
+                ] if use_rois else None,
+                sweep_bands=sweep_bands_text or None,
+                sweep_orders=sweep_orders if sweep_bands_text else None,
+            )
+            job_owner = st.session_state.setdefault('job_owner', uuid.uuid4().hex)
+            job_id = get_job_manager().submit(
+                video_path, job_params,
+                owner=job_owner,
+                label=uploaded_file.name,
+                copy_video=True,
+                threads=n_workers
+            )
+            st.success(f"📋 Job `{job_id}` enviado para a fila. Acompanhe o progresso na seção Jobs.")
+        except (ValueError, OSError) as e:
+            st.error(f"❌ Não foi possível enviar o job: {e}")
+    elif process_clicked:
+        profiler = Profiler(track_memory=profile_memory)
+
+        # Avisos do núcleo (evm) são exibidos na interface; as etapas são
+        # registradas no profiler ativo
+        with warnings.catch_warnings(), profiler.activate():
+            warnings.simplefilter("always")
+            warnings.showwarning = show_warning
+            video_writer = None
+            try:
+                # Plano de memória: resolução e armazenamento das pilhas que cabem no orçamento
+                with profile_stage('plano de memória'):
+                    max_size = (640, 360) if resolution_mode.startswith("Máxima") else None
+                    T_probe, H_probe, W_probe, _ = probe_video(
+                        video_path, {'target_size': max_size, 'max_frames': max_frames}
+                    )
+                    _, H_native, W_native, native_fps = probe_video(video_path, {'target_size': None, 'max_frames': None})
+                    # Decimação temporal: a maior f_high analisada (banda e varredura) fica abaixo da nova Nyquist
+                    decimation = 1
+                    if use_decimation:
+                        band_high = max([f_high] + [variant['f_high'] for variant in sweep_variants])
+                        decimation = decimation_factor(native_fps, band_high, decimation_margin)
+                    decimate = dict(decimation=decimation, decimation_method=decimation_method,
+                                    decimation_margin=decimation_margin)
+                    # Transformações de estabilização em cache são por pilha: frames decimados têm chave própria
+                    stab_hash = _stabilization_key(video_hash, decimation, decimation_method, decimation_margin)
+                    memory_plan = plan_processing(
+                        -(-(T_probe or max_frames) // decimation), H_probe, W_probe,
+                        budget_bytes=memory_budget_mb * 1024 ** 2,
+                        on_disk=None if allow_disk_store else False,
+                        filter_mode=filter_key,
+                        output_mode='heatmap' if output_mode == "Heatmap RMS" else 'laplacian',
+                        stabilize=enable_stabilization,
+                        workers=n_workers,
+                        filter_order=filter_order,
+                        multiresolution=use_multires,
+                        area_fraction=roi_area_fraction(roi_list, W_native, H_native) if use_rois else 1.0
+                    )
+                    annotate(strategy=memory_plan['strategy'], estimated_mb=memory_plan['estimated_bytes'] / 1024 ** 2)
+                plan_text = f"🧮 Plano de memória: {describe_plan(memory_plan)}."
+                if memory_plan['fits']:
+                    st.info(plan_text)
+                else:
+                    st.warning(plan_text + " Reduza o número de frames ou aumente o orçamento.")
+                target_size = (memory_plan['width'], memory_plan['height'])
+                use_disk_store = memory_plan['on_disk']
+
+                # Validação de Nyquist na taxa efetiva, antes da leitura
+                nyquist = native_fps / decimation / 2.0
+                if f_high >= nyquist:
+                    detail = f" após decimação por {decimation}" if decimation > 1 else ""
+                    st.error(f"❌ Erro: f_high ({f_high} Hz) deve ser menor que FPS/2 ({nyquist:.2f} Hz{detail}).")
+                    st.stop()
+
+                # Cache de etapas: pilhas grandes só são cacheadas em memória (RAM)
+                stage_cache = StageCache(max_bytes=cache_max_mb * 1024 ** 2, enabled=use_stage_cache)
+                cache_stacks = use_stage_cache and not use_disk_store
+
+                # Leitura do vídeo
+                st.info("📹 Lendo vídeo...")
+                read_progress = ThrottledProgress(st.progress(0))
+
+                if use_rois:
+                    # Apenas os recortes das ROIs são guardados: o custo escala com a área de interesse
+                    with profile_stage('leitura', rois=len(roi_list)):
+                        rois = scale_rois(roi_list, target_size[0] / W_native, target_size[1] / H_native, *target_size)
+                        crops, fps, (W, H) = read_video_crops(
+                            video_path, [roi['box'] for roi in rois],
+                            max_frames=max_frames,
+                            target_size=target_size,
+                            on_disk=use_disk_store,
+                            progress_bar=read_progress,
+                            **decimate
+                        )
+                        T = crops[0].shape[0]
+                        annotate(**{f'roi_{i}': crop for i, crop in enumerate(crops)}, fps=fps)
+                    read_progress.progress(1.0)
+                else:
+                    def decode_stage(dtype):
+                        # Nenhum modo de renderização atual precisa da pilha BGR: tudo é
+                        # derivado da pilha em cinza decodificada em streaming
+                        gray, _, fps_read = read_video_stack(
+                            video_path,
+                            max_frames=max_frames,
+                            target_size=target_size,
+                            dtype=dtype,
+                            keep_bgr=False,
+                            on_disk=use_disk_store,
+                            progress_bar=read_progress,
+                            **decimate
+                        )
+                        return {'gray': gray, 'fps': np.float64(fps_read)}
+
+                    with profile_stage('leitura'):
+                        decode_params = dict(video=video_hash, max_frames=max_frames, target_size=target_size)
+                        if decimation > 1:
+                            decode_params.update(decimate)
+                        if cache_stacks and decimation == 1:
+                            # Pilha em cinza cacheada como uint8 (sem perdas, 4x menor)
+                            decoded, upstream_key = stage_cache.get_or_compute(
+                                'decode', lambda: decode_stage(np.uint8), **decode_params
+                            )
+                            frames_gray = np.empty(decoded['gray'].shape, dtype=np.float32)
+                            np.divide(decoded['gray'], 255.0, out=frames_gray, casting='unsafe')
+                        elif cache_stacks:
+                            # Frames decimados são médias ponderadas com precisão abaixo de
+                            # 1/255: arredondar para uint8 mudaria o RMS, então ficam em float32
+                            decoded, upstream_key = stage_cache.get_or_compute(
+                                'decode', lambda: decode_stage(np.float32), **decode_params
+                            )
+                            frames_gray = decoded['gray']
+                        else:
+                            decoded, upstream_key = decode_stage(np.float32), stage_cache.key('decode', **decode_params)
+                            frames_gray = decoded['gray']
+                        fps = float(decoded['fps'])
+                        del decoded
+                        annotate(frames=frames_gray, fps=fps)
+                    read_progress.progress(1.0)
+                    T, H, W = frames_gray.shape
             
-            # Aplicação do filtro EVM
-            st.info(f"🔧 Aplicando filtro passa-banda [{f_low}-{f_high} Hz]...")
-            st.write(f"[LOG] Filtro Butterworth: ordem={filter_order}, f_low={f_low}, f_high={f_high}, fps={fps}")
-            progress_bar = st.progress(0)
-            filtered = apply_bandpass_filter(frames_gray, fps, f_low, f_high, filter_order, progress_bar)
-            progress_bar.progress(1.0)
-            st.write("[LOG] Filtro passa-banda aplicado.")
-
-            # Aplica Ganho Alpha diretamente ao sinal filtrado
-            st.info(f"🔊 Aplicando Ganho Alpha = {alpha} ao sinal filtrado...")
-            st.write(f"[LOG] Multiplicando sinal filtrado por alpha={alpha}")
-            filtered_amplified = filtered * alpha
-
-            # Cálculo do mapa RMS
-            st.info("📊 Calculando mapa RMS...")
-            st.write("[LOG] Calculando RMS dos frames amplificados...")
-            rms_map = compute_rms_map(filtered_amplified)
-            st.write(f"[LOG] RMS map (com ganho) - min: {np.min(rms_map):.6f}, max: {np.max(rms_map):.6f}, mean: {np.mean(rms_map):.6f}, std: {np.std(rms_map):.6f}")
-            progress_bar.progress(0.7)
-
-            if output_mode == "Heatmap RMS":
-                st.info("🟢 Gerando heatmap RMS absoluto de toda a imagem...")
-                st.write(f"[LOG] Usando mapa RMS absoluto com visual_gain={visual_gain}")
-                heatmap_map = rms_map * visual_gain
-                st.write(f"[LOG] Heatmap RMS absoluto: min={np.min(heatmap_map):.6f}, max={np.max(heatmap_map):.6f}, mean={np.mean(heatmap_map):.6f}, std={np.std(heatmap_map):.6f}")
-                progress_bar.progress(0.9)
-                # debug_var('heatmap_map', heatmap_map)
-            else:
-                st.info("🎬 Gerando vídeo com deslocamentos amplificados...")
-                heatmap_map = None
-                progress_bar.progress(0.9)
+                decimation_text = f" (decimado por {decimation} de {native_fps:.2f} FPS)" if decimation > 1 else ""
+                st.success(f"✅ Vídeo lido: {T} frames, {W}x{H}, {fps:.2f} FPS{decimation_text}")
             
-            # Geração do vídeo de saída
-            st.info("🎬 Gerando vídeo de saída com overlay...")
-            output_frames = []
-
-            if output_mode == "Heatmap RMS":
-                # Calcula os tensores principais uma vez para todos os frames
-                eigvals, eigvecs = principal_tensor_vectors(heatmap_map)
-                threshold = np.percentile(np.abs(eigvals), 99)  # 1% mais significativos
-                significant_idxs = np.argwhere(np.abs(eigvals) >= threshold)
-                max_vectors = 30
-                if significant_idxs.shape[0] > max_vectors:
-                    rng = np.random.default_rng(seed=42)
-                    selected = rng.choice(significant_idxs.shape[0], size=max_vectors, replace=False)
-                    significant_idxs = significant_idxs[selected]
-
-                H, W = heatmap_map.shape
-                diag = np.sqrt(H**2 + W**2)
-                eigvals_abs = np.abs(eigvals)
-                if len(significant_idxs) > 0:
-                    min_val = np.min(eigvals_abs[tuple(significant_idxs.T)])
-                    max_val = np.max(eigvals_abs[tuple(significant_idxs.T)])
-                else:
-                    min_val = 0
-                    max_val = 1
-                # Índice do tensor mais crítico
-                if len(significant_idxs) > 0:
-                    idx_crit = np.argmax(eigvals_abs[tuple(significant_idxs.T)])
-                    y_crit, x_crit = significant_idxs[idx_crit]
+                # ROI: recorte dos frames REMOVIDO
+
+                if use_rois:
+                    # Cada ROI é estabilizada, filtrada e reduzida ao RMS de forma independente
+                    st.info(f"🎯 Processando {len(rois)} ROI(s) em paralelo [{f_low}-{f_high} Hz]...")
+                    progress_bar = ThrottledProgress(st.progress(0))
+                    with profile_stage('filtro + RMS (ROIs)', rois=len(rois)):
+                        roi_results = process_rois(
+                            crops, rois, fps, f_low, f_high,
+                            workers=n_workers,
+                            progress_bar=progress_bar,
+                            video_hash=stab_hash,
+                            order=filter_order,
+                            gain=alpha,
+                            filter_mode=filter_key,
+                            stabilize=enable_stabilization,
+                            stabilization_method='orb' if stabilization_method == "ORB (referência)" else 'lk',
+                            warmup_frames=warmup_frames,
+                            multiresolution=use_multires
+                        )
+                        del crops
+                        rms_map = composite_rms(rois, roi_results, W, H)
+                        heatmap_rois = rois
+                    # Renderização sobre o quadro inteiro decodificado de novo em streaming
+                    frames_gray_raw = iter_gray_frames(video_path, max_frames, target_size, **decimate)
+                    filtered = iter_composite_filtered(rois, roi_results, W, H, fps, f_low, f_high, filter_order)
                 else:
-                    y_crit, x_crit = None, None
-
-                # Cria máscara para amplificar apenas os 30 tensores máximos
-                mask_amplify = np.zeros((H, W), dtype=np.float32)
-                for y, x in significant_idxs:
-                    mask_amplify[y, x] = 1.0
-                # Suaviza a máscara para evitar artefatos
-                mask_amplify = cv2.GaussianBlur(mask_amplify, (7, 7), 0)
-
-                # Frame base congelado (primeiro frame em cinza)
-                frozen_gray = cv2.cvtColor(frames_bgr_roi[0], cv2.COLOR_BGR2GRAY).astype(np.float32) / 255.0
-
-                for i, frame_bgr in enumerate(frames_bgr_roi):
-                    if filtered.shape[1:] == frame_bgr.shape[:2]:
-                        # Amplifica apenas nos locais dos 30 tensores máximos, mantendo o movimento do vídeo
-                        frame_gray = cv2.cvtColor(frame_bgr, cv2.COLOR_BGR2GRAY).astype(np.float32) / 255.0
-                        amplified_gray = frame_gray + (filtered[i] * mask_amplify * alpha)
-                        amplified_gray = np.clip(amplified_gray, 0, 1)
-                        amplified_bgr = cv2.cvtColor((amplified_gray * 255).astype(np.uint8), cv2.COLOR_GRAY2BGR)
+                    # Pilha em cinza não estabilizada, usada na renderização. O EVM
+                    # Laplaciano só usa essa pilha: estabilização e filtro principal
+                    # ficam restritos ao heatmap (e a estabilização, à varredura)
+                    frames_gray_raw = frames_gray
+                    heatmap_mode = output_mode == "Heatmap RMS"
+
+                    # Estabilização (opcional)
+                    if enable_stabilization and (heatmap_mode or sweep_variants):
+                        st.info("🎥 Estabilizando vídeo...")
+                        stab_progress = ThrottledProgress(st.progress(0))
+                        stab_method = 'orb' if stabilization_method == "ORB (referência)" else 'lk'
+
+                        def stabilize_stage():
+                            return {'frames': stabilize_video(
+                                frames_gray, stab_progress,
+                                method=stab_method,
+                                video_hash=stab_hash
+                            )}
+
+                        with profile_stage('estabilização', method=stab_method):
+                            stab_params = dict(upstream=upstream_key, method=stab_method)
+                            if cache_stacks:
+                                stabilized, upstream_key = stage_cache.get_or_compute('stabilize', stabilize_stage, **stab_params)
+                            else:
+                                stabilized, upstream_key = stabilize_stage(), stage_cache.key('stabilize', **stab_params)
+                            frames_gray = stabilized['frames']
+                        st.success("✅ Vídeo estabilizado!")
+
+                    # Varredura: todas as variantes a partir da pilha já lida e estabilizada,
+                    # antes do filtro principal (que pode filtrar essa pilha no lugar)
+                    if sweep_variants:
+                        st.info(f"🔀 Varredura de {len(sweep_variants)} variante(s) de banda/ordem...")
+                        sweep_progress = ThrottledProgress(st.progress(0))
+
+                        def sweep_stage():
+                            results = sweep_bandpass_rms(
+                                frames_gray, fps, sweep_variants,
+                                gain=alpha,
+                                filter_mode=filter_key,
+                                warmup_frames=warmup_frames,
+                                workers=n_workers,
+                                progress_bar=sweep_progress
+                            )
+                            return {'rms': np.stack([r['rms'] for r in results])}
+
+                        with profile_stage('varredura', variants=len(sweep_variants)):
+                            sweep_stack, _ = stage_cache.get_or_compute(
+                                'sweep', sweep_stage,
+                                upstream=upstream_key, fps=fps, mode=filter_key, alpha=alpha,
+                                warmup=warmup_frames, variants=json.dumps(sweep_variants)
+                            )
+                        sweep_results = [dict(v, rms=rms) for v, rms in zip(sweep_variants, sweep_stack['rms'])]
+                        sweep_progress.progress(1.0)
+
+                    # Aplicação do filtro EVM
+                    if heatmap_mode:
+                        st.info(f"🔧 Aplicando filtro passa-banda [{f_low}-{f_high} Hz]...")
+                    progress_bar = ThrottledProgress(st.progress(0))
+                    filter_params = dict(upstream=upstream_key, f_low=f_low, f_high=f_high, fps=fps)
+                    if not heatmap_mode:
+                        rms_map = filtered = None
+                    elif filter_mode == "Causal em blocos (streaming)":
+                        # Passada única: filtro causal + RMS online, sem pilha filtrada
+                        st.info(f"🔊 Aplicando Ganho Alpha = {alpha} ao sinal filtrado...")
+                        st.info("📊 Calculando mapa RMS...")
+                        with profile_stage('filtro causal + RMS', order=filter_order, warmup=warmup_frames):
+                            rms_result, _ = stage_cache.get_or_compute(
+                                'rms',
+                                lambda: {'rms': causal_bandpass_rms(
+                                    frames_gray, fps, f_low, f_high, filter_order,
+                                    warmup_frames=warmup_frames, gain=alpha, progress_bar=progress_bar
+                                )},
+                                mode='causal', order=filter_order, warmup=warmup_frames, alpha=alpha, **filter_params
+                            )
+                        rms_map = rms_result['rms']
+                        filtered = None
+                    elif use_multires:
+                        # RMS no nível grosso; só as regiões quentes são filtradas na
+                        # resolução de trabalho (sem pilha filtrada completa)
+                        st.info("📊 Calculando mapa RMS multirresolução...")
+                        with profile_stage('RMS multirresolução', order=filter_order, levels=coarse_levels, percentile=hot_percentile):
+                            rms_result, _ = stage_cache.get_or_compute(
+                                'rms',
+                                lambda: coarse_to_fine_rms(
+                                    frames_gray, fps, f_low, f_high, filter_order, gain=alpha,
+                                    coarse_levels=coarse_levels, hot_percentile=hot_percentile,
+                                    workers=n_workers, progress_bar=progress_bar
+                                ),
+                                mode='multires', order=filter_order, alpha=alpha,
+                                levels=coarse_levels, percentile=hot_percentile, **filter_params
+                            )
+                        rms_map = rms_result['rms']
+                        st.info(f"🔍 Regiões refinadas: {float(rms_result['refined_fraction']):.1%} da imagem.")
+                        filtered = None
+                    elif filter_mode == "FFT ideal (lote)":
+                        # rfft em lote: RMS por Parseval; a inversa gera os frames
+                        # filtrados usados no overlay do heatmap
+                        st.info("📊 Calculando mapa RMS pelo espectro...")
+
+                        def fft_stage():
+                            return fft_bandpass_filter(
+                                frames_gray, fps, f_low, f_high,
+                                workers=n_workers, progress_bar=progress_bar
+                            )
+
+                        with profile_stage('filtro FFT + RMS'):
+                            fft_params = dict(mode='fft', with_filtered=True, **filter_params)
+                            if cache_stacks:
+                                fft_result, _ = stage_cache.get_or_compute('filter', fft_stage, **fft_params)
+                            else:
+                                fft_result = fft_stage()
+                        filtered = fft_result.get('filtered')
+                        # O RMS da banda é linear no ganho: alpha não invalida o filtro
+                        rms_map = alpha * fft_result['rms']
                     else:
-                        amplified_bgr = frame_bgr
+                        zero_phase_params = dict(mode='zero_phase', order=filter_order, **filter_params)
+                        rms_params = dict(upstream=stage_cache.key('filter', **zero_phase_params), alpha=alpha)
+                        rms_result = stage_cache.get('rms', stage_cache.key('rms', **rms_params))
+                        if rms_result is None or output_mode == "Heatmap RMS":
+                            # O overlay do heatmap usa os frames filtrados. A pilha
+                            # estabilizada não é mais usada depois do filtro: filtra no lugar
+                            in_place = memory_plan['in_place'] and frames_gray is not frames_gray_raw
+
+                            def filter_stage():
+                                return {'filtered': apply_bandpass_filter(
+                                    frames_gray, fps, f_low, f_high, filter_order, progress_bar,
+                                    workers=n_workers, out=frames_gray if in_place else None
+                                )}
+
+                            with profile_stage('filtro passa-banda', order=filter_order, workers=n_workers):
+                                if cache_stacks:
+                                    filtered = stage_cache.get_or_compute('filter', filter_stage, **zero_phase_params)[0]['filtered']
+                                else:
+                                    filtered = filter_stage()['filtered']
+                                annotate(filtered=filtered)
+                        else:
+                            filtered = None
+                        progress_bar.progress(1.0)
+
+                        # Aplica Ganho Alpha ao sinal filtrado durante o cálculo do RMS
+                        # (sem materializar uma cópia amplificada da pilha)
+                        st.info(f"🔊 Aplicando Ganho Alpha = {alpha} ao sinal filtrado...")
+
+                        # Cálculo do mapa RMS
+                        st.info("📊 Calculando mapa RMS...")
+                        with profile_stage('RMS', alpha=alpha):
+                            annotate(cache_rms='miss' if rms_result is None else 'hit')
+                            if rms_result is None:
+                                rms_result = {'rms': compute_rms_map(filtered, gain=alpha)}
+                                stage_cache.put('rms', stage_cache.key('rms', **rms_params), rms_result)
+                        rms_map = rms_result['rms']
+
+                # Estatísticas do cache acumuladas na sessão
+                session_stats = st.session_state.setdefault('stage_cache_stats', {})
+                for stage, counts in stage_cache.stats.items():
+                    totals = session_stats.setdefault(stage, {'hits': 0, 'misses': 0})
+                    totals['hits'] += counts['hits']
+                    totals['misses'] += counts['misses']
+                progress_bar.progress(0.7)
+
+                if output_mode == "Heatmap RMS":
+                    st.info("🟢 Gerando heatmap RMS absoluto de toda a imagem...")
+                    heatmap_map = rms_map * visual_gain
+                    # Metadados das exportações binárias do mapa e da série filtrada
+                    export_metadata = {
+                        'video': uploaded_file.name,
+                        'fps': float(fps),
+                        'f_low': float(f_low),
+                        'f_high': float(f_high),
+                        'filter_mode': filter_key,
+                        'filter_order': int(filter_order),
+                        'alpha': float(alpha),
+                        'visual_gain': float(visual_gain),
+                        'width': int(W),
+                        'height': int(H),
+                        'frames': int(T),
+                    }
+                    progress_bar.progress(0.9)
+                else:
+                    st.info("🎬 Gerando vídeo com deslocamentos amplificados...")
+                    heatmap_map = None
+                    progress_bar.progress(0.9)
+            
+                # Geração do vídeo de saída: frames codificados em streaming por uma
+                # thread de fundo, sem acumular a pilha de saída em memória
+                st.info("🎬 Gerando vídeo de saída com overlay...")
+                video_writer = StreamingVideoWriter(fps, (W, H))
+
+                if output_mode == "Heatmap RMS":
+                    # Calcula o campo de tensores e as camadas estáticas (heatmap colorido,
+                    # setas e máscara de amplificação) uma vez para todos os frames
+                    with profile_stage('tensores', visual_gain=visual_gain):
+                        if heatmap_rois:
+                            tensor_field = composite_tensor_field(heatmap_rois, heatmap_map)
+                        else:
+                            tensor_field = principal_tensor_field(heatmap_map)
+                        renderer = HeatmapRenderer(
+                            tensor_field,
+                            colormap_name=colormap_name,
+                            overlay_alpha=overlay_alpha,
+                            gain=alpha
+                        )
+                        annotate(
+                            rms_min=float(np.min(heatmap_map)),
+                            rms_max=float(np.max(heatmap_map)),
+                            rms_mean=float(np.mean(heatmap_map))
+                        )
 
-                    # Overlay do heatmap
-                    overlay = create_heatmap_overlay(
-                        amplified_bgr,
-                        np.abs(eigvals) / (np.max(np.abs(eigvals)) + 1e-8),
-                        colormap_name=colormap_name,
-                        alpha=overlay_alpha
-                    )
-                    overlay_vec = overlay.copy()
-
-                    # Desenha os 30 tensores principais no frame
-                    for j, (y, x) in enumerate(significant_idxs):
-                        v = eigvecs[y, x]
-                        norm = np.linalg.norm(v)
-                        if norm == 0:
-                            continue
-                        scale = 0.1 * diag
-                        x1 = int(round(x + v[0] * scale))
-                        y1 = int(round(y + v[1] * scale))
-                        val = eigvals_abs[y, x]
-                        t = (val - min_val) / (max_val - min_val) if max_val > min_val else 0
-                        hue = int(120 * (1 - t))  # 120=azul, 0=vermelho
-                        sat = int(200 + 55 * t)
-                        val_cv = int(200 + 55 * t)
-                        if y == y_crit and x == x_crit:
-                            hue = 0
-                            sat = 255
-                            val_cv = 255
-                        hsv_color = np.uint8([[[hue, sat, val_cv]]])
-                        bgr_color = cv2.cvtColor(hsv_color, cv2.COLOR_HSV2BGR)[0, 0].tolist()
-                        color = tuple(int(c) for c in bgr_color)
-                        cv2.arrowedLine(
-                            overlay_vec,
-                            (x, y),
-                            (x1, y1),
-                            color,
-                            thickness=2,
-                            tipLength=0.2
+                    with profile_stage('renderização', frames=T):
+                        # No modo causal os frames filtrados são regenerados em streaming
+                        if filtered is None:
+                            filtered_frames = iter_causal_bandpass(frames_gray, fps, f_low, f_high, filter_order)
+                        else:
+                            filtered_frames = iter(filtered)
+
+                        # Série filtrada gravada em blocos na mesma passada da renderização
+                        series_writer = None
+                        if export_series:
+                            series_writer = TimeSeriesWriter(
+                                os.path.join(get_scratch_dir(), f"serie_filtrada_{video_hash[:12]}.npz"),
+                                dtype=np.float16,
+                                metadata=dict(export_metadata, gain_applied=False)
+                            )
+                        for frame_gray, filtered_frame in zip(frames_gray_raw, filtered_frames):
+                            # Amplifica apenas nos locais dos 30 tensores máximos, mantendo o movimento do vídeo
+                            overlay_vec = renderer.render(frame_gray, filtered_frame)
+                            if preview_frame is None:
+                                preview_frame = overlay_vec
+                                # Entradas do frame de preview, para refazer a exibição sem reprocessar
+                                preview_inputs = (np.array(frame_gray), np.array(filtered_frame))
+                            video_writer.write(overlay_vec)
+                            if series_writer is not None:
+                                series_writer.write(filtered_frame)
+                        output_video_path = video_writer.close()
+                        series_path = series_writer.close() if series_writer is not None else None
+                    progress_bar.progress(1.0)
+                    # Exportações geradas sob demanda (inclusive em execuções seguintes)
+                    st.session_state['rms_export'] = {
+                        'video_hash': video_hash,
+                        'map': heatmap_map,
+                        'metadata': export_metadata,
+                        'series_path': series_path,
+                    }
+                    st.success("✅ Processamento concluído!")
+                else:
+                    # EVM Laplaciano em tons de cinza com transições suaves (melhor qualidade visual)
+                    st.info("🔬 Aplicando EVM Laplaciano em tons de cinza (transições suaves, sem overlay)...")
+                    n_levels = 4  # Níveis da pirâmide Laplaciana
+                    T, H, W = frames_gray_raw.shape
+                    # Libera as pilhas estabilizada e filtrada antes de montar a pirâmide
+                    frames_gray = filtered = stabilized = None
+
+                    # 1-2. Pirâmide em arrays contíguos por nível, filtrada, suavizada e
+                    # amplificada (níveis processados concorrentemente)
+                    laplacian_engine = 'fft' if filter_mode == "FFT ideal (lote)" else 'butterworth'
+                    with profile_stage('EVM Laplaciano', engine=laplacian_engine, n_levels=n_levels):
+                        filtered_pyrs, lowpass_stack = laplacian_evm(
+                            frames_gray_raw, fps, f_low, f_high, filter_order, alpha,
+                            n_levels=n_levels,
+                            engine=laplacian_engine,
+                            workers=n_workers
                         )
-                    output_frames.append(overlay_vec)
-                output_frames = np.array(output_frames)
-                progress_bar.progress(1.0)
-                st.success("✅ Processamento concluído!")
+
+                    # 3. Reconstrói os frames amplificados em streaming sobre os frames
+                    # originais em cinza (não estabilizados)
+                    with profile_stage('renderização', frames=T):
+                        for recon_bgr in iter_laplacian_reconstruction(frames_gray_raw, filtered_pyrs, lowpass_stack):
+                            if preview_frame is None:
+                                preview_frame = recon_bgr
+                            video_writer.write(recon_bgr)
+                        output_video_path = video_writer.close()
+                    progress_bar.progress(1.0)
+                    st.success("✅ Processamento concluído!")
+
+                # O vídeo da execução anterior é substituído: remove o arquivo antigo
+                previous_results = st.session_state.get('evm_results')
+                if previous_results is not None and previous_results['output_video_path'] != output_video_path:
+                    discard_scratch_video(previous_results['output_video_path'])
+
+                # Resultados guardados na sessão: mudanças só de exibição, ganho visual
+                # ou alpha são aplicadas depois sem refiltrar (ver o ramo abaixo)
+                st.session_state['evm_results'] = {
+                    'params': dict(ui_params),
+                    'video_params': dict(ui_params),
+                    'rms_unit': None if heatmap_map is None else rms_map / alpha,
+                    'heatmap_map': heatmap_map,
+                    'heatmap_rois': heatmap_rois,
+                    'tensor_field': tensor_field,
+                    'preview_inputs': preview_inputs,
+                    'preview_frame': preview_frame,
+                    'output_video_path': output_video_path,
+                    'fft_result': None if fft_result is None else {
+                        name: fft_result[name] for name in ('dominant_freq', 'band_fraction')
+                    },
+                    'sweep_results': sweep_results,
+                }
+            except Exception as e:
+                # Vídeo parcial de uma execução interrompida não é exibido nem reaproveitado
+                if video_writer is not None:
+                    try:
+                        discard_scratch_video(video_writer.close())
+                    except RuntimeError:
+                        discard_scratch_video(video_writer.path)
+                st.error(f"❌ Erro durante o processamento do vídeo: {e}")
+
+        # Perfil da execução: tabela por etapa e trace para chrome://tracing / Perfetto
+        with st.expander("⏱️ Tempo por etapa", expanded=True):
+            import pandas as pd
+            st.table(pd.DataFrame(profiler.rows()).set_index('etapa'))
+            st.download_button(
+                label="📥 Baixar perfil (Chrome trace JSON)",
+                data=profiler.chrome_trace_json(),
+                file_name="evm_profile.json",
+                mime="application/json",
+                help="Abra em chrome://tracing ou ui.perfetto.dev"
+            )
+    else:
+        # Sem novo processamento: resultados da sessão. Se só mudaram parâmetros das
+        # etapas baratas (escala do RMS, tensores, exibição), elas são refeitas a
+        # partir dos mapas guardados; mudanças anteriores exigem Processar
+        evm_results = st.session_state.get('evm_results')
+        if evm_results is not None and evm_results['params']['video'] == video_hash:
+            stale = invalidated_stages(evm_results['params'], ui_params, output_key)
+            heavy_stages = [stage for stage in stale if stage not in INCREMENTAL_STAGES and stage != 'video']
+            if heavy_stages:
+                changed = ', '.join(changed_params(evm_results['params'], ui_params))
+                st.info(f"ℹ️ Parâmetros alterados ({changed}): clique em Processar para recalcular a partir da etapa \"{STAGE_LABELS[heavy_stages[0]]}\" (as etapas anteriores são lidas do cache).")
             else:
-                # EVM Laplaciano em tons de cinza com transições suaves (melhor qualidade visual)
-                st.info("🔬 Aplicando EVM Laplaciano em tons de cinza (transições suaves, sem overlay)...")
-                n_levels = 4  # Níveis da pirâmide Laplaciana
-                output_frames = []
-                T = frames_bgr_roi.shape[0]
-                H, W = frames_bgr_roi.shape[1:3]
-
-                # Converte frames para escala de cinza [0,1]
-                frames_gray = np.array([cv2.cvtColor(f, cv2.COLOR_BGR2GRAY) for f in frames_bgr_roi]).astype(np.float32) / 255.0
-
-                # 1. Construir pirâmide Laplaciana para todos os frames (em cinza)
-                laplacian_pyrs = []
-                for i in range(T):
-                    frame = frames_gray[i]
-                    pyr = []
-                    current = frame
-                    for _ in range(n_levels):
-                        next_ = cv2.pyrDown(current)
-                        up = cv2.pyrUp(next_, dstsize=(current.shape[1], current.shape[0]))
-                        lap = current - up
-                        pyr.append(lap)
-                        current = next_
-                    pyr.append(current)  # nível mais baixo
-                    laplacian_pyrs.append(pyr)
-
-                # 2. Para cada nível da pirâmide (exceto o mais baixo), empilhar no tempo e aplicar filtro temporal
-                filtered_pyrs = []
-                for level in range(n_levels):
-                    # Empilha todos os frames desse nível: shape (T, H, W)
-                    level_stack = np.stack([laplacian_pyrs[t][level] for t in range(T)], axis=0)
-                    # Aplica filtro temporal passa-banda com suavização adicional (janela de média móvel)
-                    filtered_level = apply_bandpass_filter(level_stack, fps, f_low, f_high, filter_order)
-                    # Suavização temporal extra para transições suaves
-                    kernel_size = 5  # tamanho da janela (ímpar)
-                    if kernel_size > 1:
-                        pad = kernel_size // 2
-                        filtered_level = np.pad(filtered_level, ((pad, pad), (0, 0), (0, 0)), mode='edge')
-                        filtered_level = np.array([
-                            np.mean(filtered_level[i:i+kernel_size], axis=0)
-                            for i in range(T)
-                        ])
-                    # Amplifica
-                    filtered_level *= alpha
-                    filtered_pyrs.append(filtered_level)
-                # O nível mais baixo não é amplificado
-                lowpass_stack = np.stack([laplacian_pyrs[t][-1] for t in range(T)], axis=0)
-
-                # 3. Reconstruir frames amplificados
-                for t in range(T):
-                    # Começa pelo nível mais baixo (sem amplificação)
-                    recon = lowpass_stack[t]
-                    for level in reversed(range(n_levels)):
-                        recon = cv2.pyrUp(recon, dstsize=filtered_pyrs[level][t].shape[::-1])
-                        recon = recon + filtered_pyrs[level][t]
-                    recon = np.clip(recon, 0, 1)
-
-                    # --- Mantém tons de cinza originais, mas destaca apenas os tensores de deslocamento em vermelho ---
-                    disp_norm = np.abs(recon)
-                    disp_norm = disp_norm / (disp_norm.max() + 1e-8)
-                    threshold = np.percentile(disp_norm, 90)
-                    mask = disp_norm >= threshold
-
-                    # Luminância original normalizada
-                    luminance = frames_gray[t]
-                    luminance = np.clip(luminance, 0, 1)
-
-                    # Cria imagem BGR em tons de cinza do frame original
-                    gray_bgr = cv2.cvtColor((luminance * 255).astype(np.uint8), cv2.COLOR_GRAY2BGR)
-
-                    # Destaca apenas os tensores de deslocamento (pixels da máscara) em vermelho puro
-                    recon_bgr = gray_bgr.copy()
-                    recon_bgr[mask] = [0, 0, 255]  # BGR: vermelho puro
-
-                    output_frames.append(recon_bgr)
-                output_frames = np.array(output_frames)
-                progress_bar.progress(1.0)
-                st.success("✅ Processamento concluído!")
-        except Exception as e:
-            st.error(f"❌ Erro durante o processamento do vídeo: {e}")
+                t_update = time.perf_counter()
+                if output_key == 'heatmap' and stale:
+                    if 'rms' in stale or 'tensors' in stale:
+                        # RMS(alpha·x) = |alpha|·RMS(x): sem refiltrar
+                        evm_results['heatmap_map'] = evm_results['rms_unit'] * (alpha * visual_gain)
+                        if evm_results['heatmap_rois']:
+                            evm_results['tensor_field'] = composite_tensor_field(evm_results['heatmap_rois'], evm_results['heatmap_map'])
+                        else:
+                            evm_results['tensor_field'] = principal_tensor_field(evm_results['heatmap_map'])
+                    renderer = HeatmapRenderer(
+                        evm_results['tensor_field'],
+                        colormap_name=colormap_name,
+                        overlay_alpha=overlay_alpha,
+                        gain=alpha
+                    )
+                    evm_results['preview_frame'] = renderer.render(*evm_results['preview_inputs'])
+                    if evm_results['sweep_results']:
+                        sweep_scale = alpha / evm_results['params']['alpha']
+                        evm_results['sweep_results'] = [dict(r, rms=r['rms'] * sweep_scale) for r in evm_results['sweep_results']]
+                    rms_export = st.session_state.get('rms_export')
+                    if rms_export is not None:
+                        rms_export['map'] = evm_results['heatmap_map']
+                        rms_export['metadata'].update(alpha=float(alpha), visual_gain=float(visual_gain))
+                    st.caption(f"⚡ Atualizado sem reprocessar ({', '.join(STAGE_LABELS[s] for s in stale if s != 'video')}) em {(time.perf_counter() - t_update) * 1000:.0f} ms")
+                evm_results['params'] = dict(ui_params)
+
+                heatmap_map = evm_results['heatmap_map']
+                heatmap_rois = evm_results['heatmap_rois']
+                preview_frame = evm_results['preview_frame']
+                output_video_path = evm_results['output_video_path']
+                fft_result = evm_results['fft_result']
+                sweep_results = evm_results['sweep_results']
+                if 'video' in invalidated_stages(evm_results['video_params'], ui_params, output_key):
+                    st.warning("🎬 O vídeo de saída foi gerado com os parâmetros anteriores. Clique em Processar para regenerá-lo (as etapas em cache são reaproveitadas).")
+
+# =====================================================
+# MODO AO VIVO
+# =====================================================
+st.markdown("---")
+st.markdown("## 📡 Modo ao Vivo")
+with st.expander("Heatmap RMS em tempo real (janela deslizante)"):
+    st.caption(
+        "Lê frames de uma câmera (índice), URL ou arquivo, aplica o filtro passa-banda causal e atualiza "
+        "o mapa RMS de uma janela deslizante. Um arquivo é reproduzido no seu FPS nativo, como se fosse uma câmera. "
+        "Clique em qualquer controle (ou em Parar) para encerrar."
+    )
+    live_source = st.text_input(
+        "Fonte",
+        value="",
+        help="Índice da câmera (ex.: 0), URL de stream ou caminho de arquivo. Vazio = vídeo carregado acima."
+    )
+    live_col1, live_col2, live_col3 = st.columns(3)
+    with live_col1:
+        live_window = st.number_input("Janela (s)", min_value=0.5, max_value=60.0, value=4.0, step=0.5)
+    with live_col2:
+        live_refresh = st.number_input("Atualizações por segundo", min_value=0.5, max_value=30.0, value=2.0, step=0.5)
+    with live_col3:
+        live_duration = st.number_input("Duração máxima (s)", min_value=5, max_value=3600, value=60, step=5)
+    start_live = st.button("▶️ Iniciar ao vivo")
+
+if start_live:
+    if live_source.strip():
+        source = int(live_source) if live_source.strip().isdigit() else live_source.strip()
+    elif uploaded_file is not None:
+        source = video_path
+    else:
+        source = None
+        st.error("❌ Informe uma fonte ou carregue um vídeo.")
+    if source is not None:
+        st.button("⏹️ Parar")
+        live_image = st.empty()
+        live_status = st.empty()
+        latencies = []
+        with warnings.catch_warnings():
+            warnings.simplefilter("always")
+            warnings.showwarning = show_warning
+            try:
+                for update in iter_live_heatmap(
+                    source, f_low, f_high, filter_order,
+                    window_seconds=live_window,
+                    refresh_hz=live_refresh,
+                    gain=alpha,
+                    p_low=p_low,
+                    p_high=p_high,
+                    colormap_name=colormap_name or 'inferno',
+                    overlay_alpha=overlay_alpha if overlay_alpha is not None else 0.5,
+                    target_size=(640, 360) if resolution_mode.startswith("Máxima") else None,
+                    max_seconds=live_duration
+                ):
+                    latencies.append(update['latency_s'])
+                    live_image.image(cv2.cvtColor(update['overlay'], cv2.COLOR_BGR2RGB), use_column_width=True)
+                    live_status.caption(
+                        f"Frame {update['frame_index']} · janela {update['window_frames']} frames · "
+                        f"entrada {update['input_fps']:.1f}/{update['fps']:.1f} FPS · "
+                        f"latência {update['latency_s'] * 1000:.0f} ms (máx. no bloco {update['latency_max_s'] * 1000:.0f} ms) · "
+                        f"cálculo {update['processing_s'] * 1000:.0f} ms"
+                    )
+            except Exception as e:
+                st.error(f"❌ Erro no modo ao vivo: {e}")
+        if latencies:
+            st.success(
+                f"✅ Sessão encerrada: {len(latencies)} atualizações, latência média "
+                f"{np.mean(latencies) * 1000:.0f} ms, p95 {np.percentile(latencies, 95) * 1000:.0f} ms."
+            )
+
 # =====================================================
 # VISUALIZAÇÃO DOS RESULTADOS
 # =====================================================
@@ -767,14 +1202,16 @@ st.markdown("## 📊 Resultados")
 # Só mostra resultados se as variáveis existem e foram processadas
 if (
     uploaded_file is not None
-    and 'output_frames' in locals() and output_frames is not None
-    and isinstance(output_frames, np.ndarray)
-    and output_frames.shape[0] > 0
+    and preview_frame is not None
+    and output_video_path is not None
 ):
+    # matplotlib é carregado apenas quando há resultados a exibir
+    import matplotlib.pyplot as plt
+
     col1, col2 = st.columns(2)
     with col1:
         st.markdown("### 🖼️ Frame Original")
-        st.image(cv2.cvtColor(output_frames[0], cv2.COLOR_BGR2RGB), use_container_width=True)
+        st.image(cv2.cvtColor(preview_frame, cv2.COLOR_BGR2RGB), use_container_width=True)
     with col2:
         if output_mode == "Heatmap RMS" and 'heatmap_map' in locals() and heatmap_map is not None:
             st.markdown("### 🔥 Heatmap de Tensão (RMS)")
@@ -791,12 +1228,33 @@ if (
             # Removido: exibição do vídeo na tela principal
             # (O vídeo estará disponível apenas para download na barra lateral)
 
+    if fft_result is not None:
+        st.markdown("### 🎼 Análise Espectral (FFT)")
+        col3, col4 = st.columns(2)
+        with col3:
+            fig, ax = plt.subplots(figsize=(8, 6))
+            im = ax.imshow(fft_result['dominant_freq'], cmap='viridis', vmin=f_low, vmax=f_high)
+            ax.set_title("Frequência dominante na banda")
+            ax.axis('off')
+            cbar = plt.colorbar(im, ax=ax, fraction=0.046, pad=0.04)
+            cbar.set_label('Hz', rotation=270, labelpad=20)
+            st.pyplot(fig)
+        with col4:
+            fig, ax = plt.subplots(figsize=(8, 6))
+            im = ax.imshow(fft_result['band_fraction'], cmap='magma', vmin=0, vmax=1)
+            ax.set_title("Fração da potência na banda")
+            ax.axis('off')
+            cbar = plt.colorbar(im, ax=ax, fraction=0.046, pad=0.04)
+            cbar.set_label('Fração', rotation=270, labelpad=20)
+            st.pyplot(fig)
+
     # Permitir download dos arquivos gerados na barra lateral
     with st.sidebar:
         st.markdown("### ⬇️ Downloads dos Arquivos Gerados")
         if output_mode == "Heatmap RMS" and 'heatmap_map' in locals() and heatmap_map is not None:
             # Salva heatmap como imagem PNG em buffer
-            heatmap_img = (normalize_map(heatmap_map, p_low, p_high) * 255).astype(np.uint8)
+            coverage = roi_coverage(heatmap_rois, heatmap_map.shape[1], heatmap_map.shape[0]) if heatmap_rois else None
+            heatmap_img = (normalize_map(heatmap_map, p_low, p_high, mask=coverage) * 255).astype(np.uint8)
             heatmap_img_color = cv2.applyColorMap(heatmap_img, cv2.COLORMAP_INFERNO)
             is_success, buffer = cv2.imencode(".png", heatmap_img_color)
             if is_success:
@@ -806,23 +1264,139 @@ if (
                     file_name="heatmap_rms.png",
                     mime="image/png"
                 )
-            # Salva heatmap como CSV
-            csv_buffer = io.StringIO()
-            pd.DataFrame(heatmap_map).to_csv(csv_buffer, index=False)
-            st.download_button(
-                label="📥 Baixar Heatmap RMS (CSV)",
-                data=csv_buffer.getvalue(),
-                file_name="heatmap_rms.csv",
-                mime="text/csv"
-            )
         # Download do vídeo de saída (com overlay ou amplificado)
-        if output_frames is not None and isinstance(output_frames, np.ndarray) and output_frames.shape[0] > 0:
-            # Salva o vídeo gerado em arquivo temporário
-            video_path_out = write_video(None, output_frames, fps)
-            with open(video_path_out, "rb") as f:
+        if output_video_path is not None:
+            # Vídeo já codificado em streaming no arquivo temporário da sessão
+            video_ext = os.path.splitext(output_video_path)[1]
+            with open(output_video_path, "rb") as f:
                 st.download_button(
                     label="📥 Baixar Vídeo Gerado",
                     data=f,
-                    file_name="video_resultado.mp4",
-                    mime="video/mp4"
-                )
\ No newline at end of file
+                    file_name=f"video_resultado{video_ext}",
+                    mime=next((mime for _, ext, mime in VIDEO_CODECS if ext == video_ext), "application/octet-stream")
+                )
+# Grade da varredura: mapas RMS de todas as variantes na mesma escala de cores
+if uploaded_file is not None and sweep_results:
+    st.markdown("### 🔀 Varredura de Bandas e Ordens")
+    sweep_normalized = normalize_map(np.stack([r['rms'] for r in sweep_results]), p_low, p_high)
+    sweep_columns = st.columns(min(3, len(sweep_results)))
+    for i, (result, normalized) in enumerate(zip(sweep_results, sweep_normalized)):
+        with sweep_columns[i % len(sweep_columns)]:
+            st.image(
+                cv2.cvtColor(apply_colormap_lut(normalized, colormap_name or 'inferno'), cv2.COLOR_BGR2RGB),
+                caption=variant_label(result),
+                use_column_width=True
+            )
+    import pandas as pd
+    st.table(pd.DataFrame(sweep_summary(sweep_results, p_low, p_high)))
+    # O NPZ comprime os N mapas: gerado apenas quando pedido, não a cada
+    # reexecução da página
+    if st.button("⚙️ Preparar exportação da varredura", help="Mapas RMS (N, H, W) e a banda/ordem de cada variante"):
+        sweep_data = sweep_npz_bytes(
+            sweep_results, fps=fps, alpha=alpha, filter_mode=filter_key,
+            width=W, height=H, frames=T
+        )
+        st.download_button(
+            label=f"📥 Baixar Varredura (NPZ, {len(sweep_data) / 1024 ** 2:.1f} MB)",
+            data=sweep_data,
+            file_name="varredura_rms.npz",
+            mime="application/octet-stream"
+        )
+
+# Exportações binárias do mapa RMS: geradas apenas quando pedidas e mantidas
+# na sessão, para que o download não exija reprocessar o vídeo
+rms_export = st.session_state.get('rms_export')
+if uploaded_file is not None and rms_export is not None and rms_export['video_hash'] == video_hash:
+    with st.sidebar:
+        st.markdown("### 💾 Exportar Mapa RMS")
+        export_options = ["NPZ (mapa + metadados)", "NPY (mapa)", "PNG 16 bits", "TIFF 16 bits"]
+        if rms_export['series_path'] is not None and os.path.exists(rms_export['series_path']):
+            export_options.append("Série temporal filtrada (NPZ em blocos)")
+        export_format = st.selectbox(
+            "Formato",
+            options=export_options,
+            help="NPZ/NPY guardam o mapa em float32 sem perdas; PNG/TIFF de 16 bits guardam o mapa bruto quantizado de 0 ao máximo (escala no nome do arquivo)"
+        )
+        if st.button("⚙️ Preparar exportação"):
+            # A série temporal é enviada direto do arquivo, sem carregá-la na memória
+            export_path = None
+            if export_format.startswith("NPZ"):
+                export_data = npz_bytes(rms_export['metadata'], rms=rms_export['map'])
+                export_name, export_mime = "heatmap_rms.npz", "application/octet-stream"
+            elif export_format.startswith("NPY"):
+                export_data = npy_bytes(rms_export['map'])
+                export_name, export_mime = "heatmap_rms.npy", "application/octet-stream"
+            elif export_format.startswith("Série"):
+                export_path = rms_export['series_path']
+                export_name, export_mime = "serie_filtrada.npz", "application/octet-stream"
+            else:
+                ext = '.png' if export_format.startswith("PNG") else '.tiff'
+                export_data, scale = map_image16_bytes(rms_export['map'], ext)
+                export_name = f"heatmap_rms_16bit_escala_{scale:.6g}{ext}"
+                export_mime = "image/png" if ext == '.png' else "image/tiff"
+                st.caption(f"Valor RMS = pixel × {scale:.6g} / 65535")
+            export_size = os.path.getsize(export_path) if export_path is not None else len(export_data)
+            export_label = f"📥 Baixar {export_name} ({export_size / 1024 ** 2:.1f} MB)"
+            if export_path is not None:
+                with open(export_path, "rb") as f:
+                    st.download_button(label=export_label, data=f, file_name=export_name, mime=export_mime)
+            else:
+                st.download_button(label=export_label, data=export_data, file_name=export_name, mime=export_mime)
+
+# =====================================================
+# FILA DE JOBS
+# =====================================================
+# Jobs desta sessão: estado, progresso por etapa, cancelamento e resultados
+# lidos do diretório de cada job
+job_owner = st.session_state.get('job_owner')
+if job_owner is not None:
+    st.markdown("---")
+    st.markdown("## 📋 Jobs")
+    job_manager = get_job_manager()
+    st.caption(
+        f"Até {job_manager.max_concurrent} job(s) simultâneo(s) e {job_manager.max_memory_bytes / 1024 ** 3:.1f} GB "
+        f"de RAM estimada, compartilhados por todas as sessões. Diretório: {job_manager.root}"
+    )
+    job_slots = {}
+    for job in job_manager.list_jobs(owner=job_owner):
+        job_col1, job_col2 = st.columns([5, 1])
+        with job_col2:
+            if job['status'] in ('queued', 'running'):
+                if st.button("✖️ Cancelar", key=f"cancel_{job['id']}"):
+                    job_manager.cancel(job['id'])
+                    job = job_manager.status(job['id'])
+            elif st.button("🗑️ Remover", key=f"remove_{job['id']}"):
+                job_manager.remove(job['id'])
+                continue
+        with job_col1:
+            job_slots[job['id']] = st.empty()
+            job_slots[job['id']].markdown(describe_job(job))
+        if job['status'] == 'done':
+            job_outputs = dict(job['result']['outputs'], metrics=job['result']['metrics'])
+            with st.expander(f"Resultados de {job['label']}"):
+                job_images = [job_outputs[name] for name in ('preview_png', 'heatmap_png') if name in job_outputs]
+                for column, image_path in zip(st.columns(max(1, len(job_images))), job_images):
+                    with column:
+                        st.image(image_path, use_column_width=True)
+                if job['result'].get('rms'):
+                    st.json(job['result']['rms'], expanded=False)
+                for name, path in sorted(job_outputs.items()):
+                    if path is not None and os.path.isfile(path):
+                        with open(path, "rb") as f:
+                            st.download_button(
+                                label=f"📥 {os.path.basename(path)}",
+                                data=f,
+                                file_name=os.path.basename(path),
+                                key=f"download_{job['id']}_{name}"
+                            )
+
+    # Atualiza o progresso até um job terminar; qualquer interação com a
+    # página interrompe o laço (o Streamlit reexecuta o script)
+    active_jobs = [job_id for job_id in job_slots if job_manager.status(job_id)['status'] in ('queued', 'running')]
+    while active_jobs:
+        time.sleep(1.0)
+        for job_id in active_jobs:
+            job = job_manager.status(job_id)
+            job_slots[job_id].markdown(describe_job(job))
+            if job['status'] not in ('queued', 'running'):
+                st.rerun()